@@ -14,7 +14,9 @@ import arcpy
 from arcpy.sa import *
 import sys
 import os
-from SupportingFunctions import find_available_num_prefix, make_layer
+import numpy as np
+from SupportingFunctions import find_available_num_prefix, make_layer, get_zone_raster, ZoneGrid, zonal_max, \
+    cached_drainage_area
 arcpy.CheckOutExtension('Spatial')
 
 
@@ -197,40 +199,21 @@ def calc_drain_area(DEM):
     :param DEM: The original input DEM
     :return:
     """
-    #  --smooth input dem by 3x3 cell window--
     #  define raster environment settings
     desc = arcpy.Describe(DEM)
     arcpy.env.extent = desc.Extent
     arcpy.env.outputCoordinateSystem = desc.SpatialReference
     arcpy.env.cellSize = desc.meanCellWidth
-    # calculate mean z over 3x3 cell window
-    neighborhood = NbrRectangle(3, 3, "CELL")
-    tmp_dem = FocalStatistics(DEM, neighborhood, 'MEAN')
-    # clip smoothed dem to input dem
-    smoothedDEM = ExtractByMask(tmp_dem, DEM)
-    #  define raster environment settings
-    desc = arcpy.Describe(smoothedDEM)
-    arcpy.env.extent = desc.Extent
-    arcpy.env.outputCoordinateSystem = desc.SpatialReference
-    arcpy.env.cellSize = desc.meanCellWidth
-    #  calculate cell area for use in drainage area calcultion
-    height = desc.meanCellHeight
-    width = desc.meanCellWidth
-    cell_area = height * width
-    # derive drainage area raster (in square km) from input DEM
+    # get drainage area raster (in square km) for input DEM from the drainage area cache, or derive it from the
+    # DEM smoothed over a 3x3 cell window (fill, flow direction and flow accumulation)
     # note: draiange area calculation assumes input dem is in meters
-    filledDEM = Fill(smoothedDEM) # fill sinks in dem
-    flow_direction = FlowDirection(filledDEM) # calculate flow direction
-    flow_accumulation = FlowAccumulation(flow_direction) # calculate flow accumulation
-    drain_area = flow_accumulation * cell_area / 1000000 # calculate drainage area in square kilometers
-    # save drainage area raster
-    drain_area_path = os.path.dirname(DEM) + "/Flow/DrainArea_sqkm.tif"
+    flow_folder = os.path.dirname(DEM) + "/Flow"
+    if not os.path.exists(flow_folder):
+        os.mkdir(flow_folder)
+    drain_area_path = flow_folder + "/DrainArea_sqkm.tif"
     if os.path.exists(drain_area_path):
         arcpy.Delete_management(drain_area_path)
-        drain_area.save(drain_area_path)
-    else:
-        os.mkdir(os.path.dirname(DEM) + "/Flow")
-        drain_area.save(drain_area_path)
+    cached_drainage_area(DEM, drain_area_path)
     return drain_area_path
 
 
@@ -245,25 +228,42 @@ def add_raster_values(thiessen_clip, raster, field_type, temp_dir):
     if field_type == "precip":
         field_name = "PRECIP"
 
-    # Zonal statistics of drainage area and precip using thiessen polygons
-    tbl_out = os.path.join(temp_dir, "zonal_tbl_" + field_type + ".dbf")
-    tbl_zs = ZonalStatisticsAsTable(thiessen_clip, "RCH_FID", raster, tbl_out, "DATA", "MAXIMUM")
-    # delete required fields if already in thiessen fields
+    # the thiessen polygons can only be rasterized onto the raster's grid if both are in the same coordinate system, so
+    # rasters in another coordinate system (e.g., geographic PRISM precipitation) are projected onto the thiessen
+    # polygons' coordinate system first
+    thiessen_sr = arcpy.Describe(thiessen_clip).spatialReference
+    if arcpy.Describe(raster).spatialReference.name != thiessen_sr.name and thiessen_sr.type == "Projected":
+        projected_raster = os.path.join(temp_dir, field_type + "_projected.tif")
+        arcpy.ProjectRaster_management(raster, projected_raster, thiessen_sr, "NEAREST")
+        raster = projected_raster
+
+    n_zones = max(row[0] for row in arcpy.da.SearchCursor(thiessen_clip, "RCH_FID")) + 1
+    if arcpy.Describe(raster).spatialReference.name == thiessen_sr.name:
+        # maximum drainage area and precip within each thiessen polygon, using thiessen polygons rasterized onto the
+        # raster's grid (cached beside the thiessen polygons so reruns and other tools on the same grid reuse them)
+        zone_grid = ZoneGrid(get_zone_raster(thiessen_clip, "RCH_FID", raster), n_zones)
+        raster_max = zonal_max(zone_grid.zones(), zone_grid.read_values(raster), n_zones)
+    else:
+        # zonal statistics of drainage area and precip using thiessen polygons that can't be put on the raster's grid
+        tbl_out = os.path.join(temp_dir, "zonal_tbl_" + field_type + ".dbf")
+        tbl_zs = ZonalStatisticsAsTable(thiessen_clip, "RCH_FID", raster, tbl_out, "DATA", "MAXIMUM")
+        raster_max = np.full(n_zones, np.nan)
+        for rch_fid, zone_max in arcpy.da.SearchCursor(tbl_zs, ["RCH_FID", "MAX"]):
+            raster_max[rch_fid] = zone_max
+    # polygons without a raster value get 0 and are filled in below
+    raster_max[np.isnan(raster_max)] = 0
+    # delete required field if already in thiessen fields
     thiessen_fields = [f.name for f in arcpy.ListFields(thiessen_clip)]
-    if "MAX" in thiessen_fields:
-        arcpy.DeleteField_management(thiessen_clip, "MAX")
     if field_name in thiessen_fields:
         arcpy.DeleteField_management(thiessen_clip, field_name)
-        
-    # join thiessen clip to zonal statas table and calculate raster value for each thiessen polygon
-    arcpy.JoinField_management(thiessen_clip, "RCH_FID", tbl_zs, "RCH_FID", "MAX")
+
+    # calculate raster value for each thiessen polygon
     arcpy.AddField_management(thiessen_clip, field_name, "FLOAT")
-    with arcpy.da.UpdateCursor(thiessen_clip, ["MAX", field_name]) as cursor:
+    with arcpy.da.UpdateCursor(thiessen_clip, ["RCH_FID", field_name]) as cursor:
         for row in cursor:
-            row[1] = row[0]
+            row[1] = raster_max[row[0]]
             cursor.updateRow(row)
-    arcpy.DeleteField_management(thiessen_clip, "MAX")
-  
+
     ## We're going to extract raster values to the center of each thiessen polygon that did not
     ## receive a value using zonal statistics. Most polygons are being "missed" for precip and some
     ## for drainage area since the raster resolution is larger than many of these tiny thiessen polygons -
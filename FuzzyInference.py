@@ -0,0 +1,561 @@
+# -----------------------------------------------------------------------------------------------------------------------
+# Name:        Fuzzy Inference
+# Purpose:     Array tools for evaluating fuzzy inference systems (e.g., the RCA riparian condition FIS) over many
+#              inputs at once. Uses numpy only, so it can be used without arcpy.
+#
+# Created:     10/2026
+# Licence:     This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 4.0 International
+#              License. To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/4.0/.
+# -----------------------------------------------------------------------------------------------------------------------
+
+import glob
+import hashlib
+import multiprocessing
+import os
+import uuid
+import numpy as np
+
+# default size cap for cached FIS surfaces (MB); the least recently used surfaces are deleted to stay under it
+SURFACE_CACHE_MAX_MB = 512
+
+# maximum number of FIS outputs held at once when summarizing sensitivity samples for blocks of values
+SENSITIVITY_BLOCK_OUTPUTS = 1000000
+
+
+def surface_axes(resolution, n_inputs=3):
+    """
+    :param resolution: Number of grid points along each input axis
+    :param n_inputs: Number of FIS inputs
+    :return: List of evenly spaced grid point values from 0 to 1 for each input
+    """
+    if resolution < 2:
+        raise Exception("ERROR: FIS surface resolution must be at least 2.")
+    return [np.linspace(0, 1, resolution) for i in range(n_inputs)]
+
+
+def build_surface(evaluate, resolution):
+    """
+    Evaluates a three-input FIS at every point of a regular grid over the unit cube
+    :param evaluate: Function taking arrays of the three inputs and returning an array of FIS outputs
+    :param resolution: Number of grid points along each input axis
+    :return: Array (resolution x resolution x resolution) of FIS outputs, indexed by input 1, 2 and 3 grid points
+    """
+    axes = surface_axes(resolution)
+    grid = np.meshgrid(*axes, indexing="ij")
+    values = evaluate(grid[0].ravel(), grid[1].ravel(), grid[2].ravel())
+    return np.asarray(values, dtype=np.float64).reshape(grid[0].shape)
+
+
+def interpolate_surface(surface, input1, input2, input3):
+    """
+    Interpolates FIS outputs from a surface made by build_surface with trilinear interpolation
+    :param surface: Array of FIS outputs on a regular grid over the unit cube
+    :param input1: Array of values of the first input (values outside 0 to 1 are clamped)
+    :param input2: Array of values of the second input
+    :param input3: Array of values of the third input
+    :return: Array of interpolated FIS outputs
+    """
+    lower_index = []
+    fraction = []
+    for axis, values in enumerate([input1, input2, input3]):
+        n_points = surface.shape[axis]
+        # position along the axis in grid cells, and the grid cell each value falls in
+        position = np.clip(np.asarray(values, dtype=np.float64), 0, 1) * (n_points - 1)
+        index = np.minimum(np.floor(position).astype(np.int64), n_points - 2)
+        lower_index.append(index)
+        fraction.append(position - index)
+    i, j, k = lower_index
+    x, y, z = fraction
+    # interpolate along the third axis, then the second, then the first
+    c00 = surface[i, j, k] * (1 - z) + surface[i, j, k + 1] * z
+    c01 = surface[i, j + 1, k] * (1 - z) + surface[i, j + 1, k + 1] * z
+    c10 = surface[i + 1, j, k] * (1 - z) + surface[i + 1, j, k + 1] * z
+    c11 = surface[i + 1, j + 1, k] * (1 - z) + surface[i + 1, j + 1, k + 1] * z
+    c0 = c00 * (1 - y) + c01 * y
+    c1 = c10 * (1 - y) + c11 * y
+    return c0 * (1 - x) + c1 * x
+
+
+def surface_error(surface, evaluate, input1, input2, input3, n_samples=100, seed=0):
+    """
+    Compares interpolated surface outputs to exact FIS outputs for a random sample of inputs
+    :param surface: Array of FIS outputs on a regular grid over the unit cube
+    :param evaluate: Function taking arrays of the three inputs and returning an array of exact FIS outputs
+    :param input1: Array of values of the first input
+    :param input2: Array of values of the second input
+    :param input3: Array of values of the third input
+    :param n_samples: Maximum number of inputs to compare
+    :param seed: Seed for drawing the sample
+    :return: Maximum absolute difference between interpolated and exact outputs
+    """
+    n_inputs = len(input1)
+    sample = np.random.RandomState(seed).permutation(n_inputs)[:min(n_samples, n_inputs)]
+    inputs = [np.asarray(values, dtype=np.float64)[sample] for values in [input1, input2, input3]]
+    exact = np.asarray(evaluate(*inputs), dtype=np.float64)
+    interpolated = interpolate_surface(surface, *inputs)
+    return np.abs(interpolated - exact).max()
+
+
+def cached_surface(fis, resolution, cache_folder, max_cache_mb=SURFACE_CACHE_MAX_MB):
+    """
+    Loads a FIS surface from a cache folder, or builds it with build_surface and saves it there. Surfaces are named by
+    a hash of the FIS definition and the resolution, so runs with the same FIS share them.
+    :param fis: MamdaniFIS to evaluate
+    :param resolution: Number of grid points along each input axis
+    :param cache_folder: Folder holding cached surfaces
+    :param max_cache_mb: Size cap for the cache folder (MB)
+    :return: Array of FIS outputs on a regular grid over the unit cube (memory-mapped if read from the cache)
+    """
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    surface_file = os.path.join(cache_folder, "FIS_Surface_{0}_{1}.npy".format(fis.definition_key(), resolution))
+    if os.path.exists(surface_file):
+        # mark the surface as recently used
+        os.utime(surface_file, None)
+        return np.load(surface_file, mmap_mode="r")
+
+    surface = build_surface(fis.evaluate, resolution)
+    # write to a temporary file first so a run sharing the cache never reads a partly written surface
+    temp_file = os.path.join(cache_folder, "temp_{0}.npy".format(uuid.uuid4().hex))
+    np.save(temp_file, surface)
+    try:
+        os.rename(temp_file, surface_file)
+    except OSError:
+        # another run saved the same surface first
+        os.remove(temp_file)
+    evict_cached_surfaces(cache_folder, max_cache_mb, keep=surface_file)
+    return surface
+
+
+def evict_cached_surfaces(cache_folder, max_cache_mb, keep=None):
+    """
+    Deletes the least recently used cached surfaces until the cache is under its size cap
+    :param cache_folder: Folder holding cached surfaces
+    :param max_cache_mb: Size cap for the cache folder (MB)
+    :param keep: Surface file not to delete (optional)
+    """
+    surface_files = sorted(glob.glob(os.path.join(cache_folder, "FIS_Surface_*.npy")), key=os.path.getmtime)
+    cache_size = sum(os.path.getsize(surface_file) for surface_file in surface_files)
+    for surface_file in surface_files:
+        if cache_size <= max_cache_mb * 1024 * 1024:
+            break
+        if surface_file == keep:
+            continue
+        cache_size -= os.path.getsize(surface_file)
+        try:
+            os.remove(surface_file)
+        except OSError:
+            # another run may be reading (Windows) or have already deleted it
+            pass
+
+
+def membership_function(x, breakpoints):
+    """
+    Evaluates a triangular or trapezoidal membership function (same values as skfuzzy trimf and trapmf)
+    :param x: Array of values
+    :param breakpoints: Three breakpoints (a, b, c) for a triangle or four (a, b, c, d) for a trapezoid
+    :return: Array of membership values
+    """
+    if len(breakpoints) == 3:
+        return trapezoid(x, breakpoints[0], breakpoints[1], breakpoints[1], breakpoints[2])
+    elif len(breakpoints) == 4:
+        return trapezoid(x, *breakpoints)
+    else:
+        raise Exception("ERROR: Membership functions need three (triangle) or four (trapezoid) breakpoints.")
+
+
+def trapezoid(x, a, b, c, d):
+    """
+    Evaluates a trapezoidal membership function (a triangle if b == c) whose breakpoints can differ for each value
+    :param x: Array of values
+    :param a: Breakpoint where membership starts rising from 0 (a scalar or an array that broadcasts with x)
+    :param b: Breakpoint where membership reaches 1
+    :param c: Breakpoint where membership starts falling from 1
+    :param d: Breakpoint where membership reaches 0
+    :return: Array of membership values
+    """
+    x, a, b, c, d = np.broadcast_arrays(np.asarray(x, dtype=np.float64), a, b, c, d)
+    y = np.zeros(x.shape)
+    rising = (a < x) & (x < b)
+    y[rising] = (x[rising] - a[rising]) / (b[rising] - a[rising]).astype(np.float64)
+    falling = (c < x) & (x < d)
+    y[falling] = (d[falling] - x[falling]) / (d[falling] - c[falling]).astype(np.float64)
+    y[(b <= x) & (x <= c)] = 1
+    return y
+
+
+class MamdaniFIS(object):
+    """
+    Mamdani fuzzy inference system (min for AND, max for OR and aggregation, centroid defuzzification) that is
+    evaluated for arrays of inputs at once
+    """
+    def __init__(self, inputs, output, rules, universe, exact_centroid=False):
+        """
+        :param inputs: List of (name, terms) for each input, where terms is a list of (term name, breakpoints) as
+        taken by membership_function
+        :param output: (name, terms) for the output
+        :param rules: List of rules, each a tuple with the term(s) for each input followed by the output term. Input terms
+        are a term name, a tuple of term names combined with OR, or None if the rule does not use the input
+        :param universe: Array of values the membership functions are sampled at
+        :param exact_centroid: If True, outputs are defuzzified with the exact centroid of the aggregated output
+        membership function rather than the centroid of the function sampled on the universe
+        """
+        self.inputs = inputs
+        self.output = output
+        self.rules = rules
+        self.universe = np.asarray(universe, dtype=np.float64)
+
+        # membership functions sampled on the universe (terms x universe)
+        self.input_mfs = [np.array([membership_function(self.universe, bp) for term, bp in terms])
+                          for name, terms in inputs]
+        self.output_mfs = np.array([membership_function(self.universe, bp) for term, bp in output[1]])
+
+        # compile the rules to the indices of the terms they use for each input and their output term
+        self.rule_terms = []
+        self.rule_outputs = np.zeros(len(rules), dtype=np.int64)
+        output_names = [term for term, bp in output[1]]
+        for r, rule in enumerate(rules):
+            if len(rule) != len(inputs) + 1:
+                raise Exception("ERROR: FIS rule {0} does not have a term for each input and the output.".format(r))
+            term_indices = []
+            for (name, terms), rule_terms in zip(inputs, rule[:-1]):
+                if rule_terms is None:
+                    term_indices.append(None)
+                    continue
+                if not isinstance(rule_terms, tuple):
+                    rule_terms = (rule_terms,)
+                input_names = [term for term, bp in terms]
+                for term in rule_terms:
+                    if term not in input_names:
+                        raise Exception("ERROR: FIS rule {0} uses unknown term '{1}' of {2}.".format(r, term, name))
+                term_indices.append(np.array([input_names.index(term) for term in rule_terms]))
+            self.rule_terms.append(term_indices)
+            if rule[-1] not in output_names:
+                raise Exception("ERROR: FIS rule {0} uses unknown output term '{1}'.".format(r, rule[-1]))
+            self.rule_outputs[r] = output_names.index(rule[-1])
+        # output terms that no rule uses are left out of the aggregated output
+        self.used_outputs = np.unique(self.rule_outputs)
+        self.exact_centroid = exact_centroid
+
+        # breakpoints of the output membership functions (terms x 4, triangles as trapezoids with b == c) and the pairs
+        # of output terms that overlap, which is where the aggregated output can have breakpoints between theirs
+        self.output_breakpoints = np.array([[bp[0], bp[1], bp[1], bp[2]] if len(bp) == 3 else bp
+                                            for term, bp in output[1]], dtype=np.float64)
+        self.overlapping_outputs = [(k, l) for i, k in enumerate(self.used_outputs) for l in self.used_outputs[i + 1:]
+                                    if self.output_breakpoints[k, 0] < self.output_breakpoints[l, 3]
+                                    and self.output_breakpoints[l, 0] < self.output_breakpoints[k, 3]]
+
+    def definition_key(self):
+        """
+        Hashes the membership functions, rules, universe and defuzzification method
+        :return: Hex string key
+        """
+        definition = repr((self.inputs, self.output, self.rules, self.universe.tolist(), bool(self.exact_centroid)))
+        return hashlib.md5(definition.encode("utf-8")).hexdigest()[:12]
+
+    def memberships(self, index, values, breakpoints=None):
+        """
+        :param index: Index of the input
+        :param values: Array of input values (clipped to the universe)
+        :param breakpoints: Array (values x terms x 4) of membership function breakpoints to use for each value instead
+        of the FIS ones (optional)
+        :return: Array (values x terms) of membership values
+        """
+        u = self.universe
+        x = np.clip(np.asarray(values, dtype=np.float64), u[0], u[-1])
+        if breakpoints is None:
+            return np.column_stack([np.interp(x, u, mf, left=0, right=0) for mf in self.input_mfs[index]])
+
+        # interpolate between the membership values at the universe points on either side of each value, as np.interp
+        # does with the sampled membership functions
+        i = np.clip(np.searchsorted(u, x, "right") - 1, 0, len(u) - 2)
+        weight = (x - u[i]) / (u[i + 1] - u[i])
+        memberships = np.zeros((len(x), breakpoints.shape[1]))
+        for t in range(breakpoints.shape[1]):
+            a, b, c, d = breakpoints[:, t].T
+            lower = trapezoid(u[i], a, b, c, d)
+            memberships[:, t] = lower + weight * (trapezoid(u[i + 1], a, b, c, d) - lower)
+        return memberships
+
+    def output_cuts(self, *inputs, **kwargs):
+        """
+        :param inputs: Array of values for each input
+        :param input_breakpoints: List of arrays (values x terms x 4) of membership function breakpoints to use for each
+        input value instead of the FIS ones (optional)
+        :return: Array (values x output terms) of the level each output term is cut at
+        """
+        input_breakpoints = kwargs.get("input_breakpoints", [None] * len(inputs))
+        memberships = [self.memberships(i, values, breakpoints)
+                       for i, (values, breakpoints) in enumerate(zip(inputs, input_breakpoints))]
+        cuts = np.zeros((len(memberships[0]), len(self.output_mfs)))
+        for term_indices, output_index in zip(self.rule_terms, self.rule_outputs):
+            strength = np.ones(len(cuts))
+            for input_memberships, indices in zip(memberships, term_indices):
+                if indices is not None:
+                    strength = np.fmin(strength, input_memberships[:, indices].max(axis=1))
+            cuts[:, output_index] = np.fmax(cuts[:, output_index], strength)
+        return cuts
+
+    def defuzzify_sampled(self, cuts):
+        """
+        Centroid of the aggregated output, sampled on the universe plus the points where each output term crosses its
+        cut level and integrated as a piecewise-linear function (same as skfuzzy)
+        :param cuts: Array (values x output terms) of the level each output term is cut at
+        :return: Array of defuzzified outputs
+        """
+        u = self.universe
+        n_values = len(cuts)
+        # points along each universe segment: its start and the crossing point of each output term (if any)
+        points = np.empty((n_values, len(u) - 1, len(self.used_outputs) + 1))
+        points[:, :, 0] = u[:-1]
+        for p, k in enumerate(self.used_outputs):
+            mf = self.output_mfs[k]
+            cut = cuts[:, k:k + 1]
+            above = np.where(cut == 0, mf > cut, mf >= cut)
+            crossing = above[:, 1:] != above[:, :-1]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = u[:-1] + (cut - mf[:-1]) * (u[1:] - u[:-1]) / (mf[1:] - mf[:-1])
+            points[:, :, p + 1] = np.where(crossing, x, u[1:])
+        points.sort(axis=2)
+        points = np.column_stack([points.reshape(n_values, -1), np.repeat(u[-1], n_values)])
+
+        # aggregated output: max of the output terms cut at their levels
+        y = np.zeros(points.shape)
+        for k in self.used_outputs:
+            mf = np.interp(points.ravel(), u, self.output_mfs[k], left=0, right=0).reshape(points.shape)
+            y = np.fmax(y, np.fmin(cuts[:, k:k + 1], mf))
+        return centroid(points, y)
+
+    def defuzzify_exact(self, cuts, breakpoints=None):
+        """
+        Exact centroid of the aggregated output (the max of the output membership functions cut at their levels), which is
+        piecewise-linear with breakpoints at the membership function breakpoints, the points where each function reaches
+        its cut level and the points where overlapping functions cross
+        :param cuts: Array (values x output terms) of the level each output term is cut at
+        :param breakpoints: Array (values x output terms x 4) of output membership function breakpoints to use for each
+        value instead of the FIS ones (optional)
+        :return: Array of defuzzified outputs
+        """
+        n_values = len(cuts)
+        used = self.used_outputs
+        if breakpoints is None:
+            breakpoints = self.output_breakpoints[np.newaxis]
+            static_points = np.repeat([np.unique(self.output_breakpoints[used])], n_values, axis=0)
+            pairs = self.overlapping_outputs
+        else:
+            static_points = breakpoints[:, used].reshape(n_values, -1)
+            # with breakpoints that vary by value, any two terms may overlap
+            pairs = [(k, l) for i, k in enumerate(used) for l in used[i + 1:]]
+        a, b, c, d = [breakpoints[:, used, j] for j in range(4)]
+        cut = cuts[:, used]
+        points = np.column_stack([static_points, a + cut * (b - a), d - cut * (d - c)])
+        points.sort(axis=1)
+
+        def clipped(k, x):
+            bp = [breakpoints[:, k, j:j + 1] for j in range(4)]
+            return np.fmin(cuts[:, k:k + 1], trapezoid(x, *bp))
+
+        # between consecutive points each clipped function is linear, so two of them cross where their difference
+        # changes sign
+        crossings = [points]
+        for k, l in pairs:
+            difference = clipped(k, points) - clipped(l, points)
+            d0 = difference[:, :-1]
+            d1 = difference[:, 1:]
+            crossing = d0 * d1 < 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x = points[:, :-1] + (points[:, 1:] - points[:, :-1]) * d0 / (d0 - d1)
+            crossings.append(np.where(crossing, x, points[:, :-1]))
+        points = np.column_stack(crossings)
+        points.sort(axis=1)
+
+        y = np.zeros(points.shape)
+        for k in used:
+            y = np.fmax(y, clipped(k, points))
+        return centroid(points, y)
+
+    def evaluate(self, *inputs, **kwargs):
+        """
+        :param inputs: Array of values for each input
+        :param chunk_size: Number of values to evaluate at a time (optional)
+        :param exact_centroid: Overrides exact_centroid of the FIS (optional)
+        :param input_breakpoints: List of arrays (values x terms x 4) of membership function breakpoints to use for each
+        input value instead of the FIS ones (optional)
+        :param output_breakpoints: Array (values x output terms x 4) of output membership function breakpoints to use for
+        each value instead of the FIS ones (optional; needs the exact centroid)
+        :return: Array of FIS outputs (0 where no rule fires)
+        """
+        chunk_size = kwargs.get("chunk_size", 10000)
+        exact_centroid = kwargs.get("exact_centroid", self.exact_centroid)
+        input_breakpoints = kwargs.get("input_breakpoints", [None] * len(inputs))
+        output_breakpoints = kwargs.get("output_breakpoints")
+        if output_breakpoints is not None and not exact_centroid:
+            raise Exception("ERROR: Output breakpoints that vary by value need the exact centroid.")
+
+        def rows(array, start):
+            return None if array is None else array[start:start + chunk_size]
+
+        inputs = [np.asarray(values, dtype=np.float64).ravel() for values in inputs]
+        out = np.zeros(len(inputs[0]))
+        for start in range(0, len(out), chunk_size):
+            chunk = [values[start:start + chunk_size] for values in inputs]
+            cuts = self.output_cuts(*chunk, input_breakpoints=[rows(bp, start) for bp in input_breakpoints])
+            if exact_centroid:
+                out[start:start + chunk_size] = self.defuzzify_exact(cuts, rows(output_breakpoints, start))
+            else:
+                out[start:start + chunk_size] = self.defuzzify_sampled(cuts)
+        return out
+
+    def skfuzzy_simulation(self):
+        """
+        Builds the same FIS with skfuzzy (used to check results; skfuzzy is only needed here)
+        :return: skfuzzy control system simulation with the FIS input and output names
+        """
+        from skfuzzy import control as ctrl
+
+        antecedents = []
+        for name, terms in self.inputs:
+            antecedent = ctrl.Antecedent(self.universe, name)
+            for term, bp in terms:
+                antecedent[term] = membership_function(self.universe, bp)
+            antecedents.append(antecedent)
+        consequent = ctrl.Consequent(self.universe, self.output[0])
+        for term, bp in self.output[1]:
+            consequent[term] = membership_function(self.universe, bp)
+
+        rules = []
+        for rule in self.rules:
+            antecedent = None
+            for variable, rule_terms in zip(antecedents, rule[:-1]):
+                if rule_terms is None:
+                    continue
+                if not isinstance(rule_terms, tuple):
+                    rule_terms = (rule_terms,)
+                term = variable[rule_terms[0]]
+                for other in rule_terms[1:]:
+                    term = term | variable[other]
+                antecedent = term if antecedent is None else antecedent & term
+            rules.append(ctrl.Rule(antecedent, consequent[rule[-1]]))
+        return ctrl.ControlSystemSimulation(ctrl.ControlSystem(rules))
+
+    def skfuzzy_difference(self, n_samples=1000, seed=0):
+        """
+        Compares outputs with skfuzzy for random inputs in the universe
+        :param n_samples: Number of random inputs
+        :param seed: Seed for drawing the inputs
+        :return: Maximum absolute difference between the outputs of this FIS and skfuzzy
+        """
+        random = np.random.RandomState(seed)
+        inputs = [random.uniform(self.universe[0], self.universe[-1], n_samples) for i in range(len(self.inputs))]
+        simulation = self.skfuzzy_simulation()
+        expected = np.zeros(n_samples)
+        for i in range(n_samples):
+            for (name, terms), values in zip(self.inputs, inputs):
+                simulation.input[name] = values[i]
+            simulation.compute()
+            expected[i] = simulation.output[self.output[0]]
+        return np.abs(self.evaluate(*inputs, exact_centroid=False) - expected).max()
+
+
+def centroid(x, y):
+    """
+    Centroids of piecewise-linear functions
+    :param x: Array (functions x points) of sorted breakpoints of each function
+    :param y: Array (functions x points) of function values at the breakpoints
+    :return: Array of centroids (0 where a function has no area)
+    """
+    dx = np.diff(x, axis=1)
+    x1 = x[:, :-1]
+    y1 = y[:, :-1]
+    y2 = y[:, 1:]
+    area = 0.5 * dx * (y1 + y2)
+    moment = dx * (x1 * 0.5 * (y1 + y2) + dx * (y2 + 0.5 * y1) / 3.0)
+    return moment.sum(axis=1) / np.fmax(area.sum(axis=1), np.finfo(np.float64).eps)
+
+
+def sample_breakpoints(fis, n_samples, spread, seed=0):
+    """
+    Draws FIS parameter sets by shifting each membership function breakpoint by a uniform random amount. Breakpoints at
+    0 or 1 (shoulders) are kept; shifted breakpoints are clipped to 0 to 1 and re-sorted.
+    :param fis: MamdaniFIS whose breakpoints are shifted
+    :param n_samples: Number of parameter sets
+    :param spread: Largest shift of a breakpoint
+    :param seed: Seed for drawing the shifts
+    :return: List of arrays (samples x terms x 4) of breakpoints for each input, and the array for the output
+    """
+    random = np.random.RandomState(seed)
+
+    def sample(terms):
+        samples = np.zeros((n_samples, len(terms), 4))
+        for t, (term, bp) in enumerate(terms):
+            bp = np.asarray(bp, dtype=np.float64)
+            shift = random.uniform(-spread, spread, (n_samples, len(bp)))
+            shift[:, (bp <= 0) | (bp >= 1)] = 0
+            shifted = np.sort(np.clip(bp + shift, 0, 1), axis=1)
+            samples[:, t] = shifted[:, [0, 1, 1, 2]] if len(bp) == 3 else shifted
+        return samples
+
+    return [sample(terms) for name, terms in fis.inputs], sample(fis.output[1])
+
+
+def evaluate_sample_chunk(args):
+    """
+    Evaluates a FIS for each value with each of a chunk of parameter sets as one batch (run in a process pool by
+    evaluate_sensitivity)
+    :param args: Tuple of the MamdaniFIS, a list of arrays of values for each input, a list of arrays (samples x terms
+    x 4) of breakpoints for each input and the array of output breakpoints
+    :return: Array (values x samples) of FIS outputs
+    """
+    fis, inputs, input_breakpoints, output_breakpoints = args
+    n_values = len(inputs[0])
+    n_samples = len(output_breakpoints)
+    # one row for each value and parameter set
+    outputs = fis.evaluate(*[np.repeat(values, n_samples) for values in inputs],
+                           input_breakpoints=[np.tile(bp, (n_values, 1, 1)) for bp in input_breakpoints],
+                           output_breakpoints=np.tile(output_breakpoints, (n_values, 1, 1)),
+                           exact_centroid=True)
+    return outputs.reshape(n_values, n_samples)
+
+
+def evaluate_sensitivity(fis, inputs, n_samples, spread, percentiles, seed=0, n_processes=1, chunk_size=10000):
+    """
+    Monte Carlo sensitivity of FIS outputs to the membership function breakpoints
+    :param fis: MamdaniFIS to evaluate
+    :param inputs: List of arrays of values for each input
+    :param n_samples: Number of parameter sets to draw with sample_breakpoints
+    :param spread: Largest shift of a breakpoint
+    :param percentiles: List of percentiles (0 to 100) of the outputs to return
+    :param seed: Seed for drawing the parameter sets
+    :param n_processes: Number of processes to evaluate chunks of parameter sets in
+    :param chunk_size: Number of value and parameter set pairs to evaluate in each chunk
+    :return: Arrays of the mean and standard deviation of the outputs for each value, and an array (values x
+    percentiles) of output percentiles
+    """
+    input_breakpoints, output_breakpoints = sample_breakpoints(fis, n_samples, spread, seed)
+    inputs = [np.asarray(values, dtype=np.float64).ravel() for values in inputs]
+    n_values = len(inputs[0])
+    mean = np.zeros(n_values)
+    std = np.zeros(n_values)
+    percentile_values = np.zeros((n_values, len(percentiles)))
+
+    # summarize blocks of values at a time, splitting the parameter sets for each block into chunks
+    block_size = max(1, SENSITIVITY_BLOCK_OUTPUTS // n_samples)
+    samples_per_chunk = max(1, chunk_size // min(block_size, n_values))
+    pool = multiprocessing.Pool(n_processes) if n_processes > 1 else None
+    try:
+        for start in range(0, n_values, block_size):
+            block = [values[start:start + block_size] for values in inputs]
+            tasks = [(fis, block, [bp[s:s + samples_per_chunk] for bp in input_breakpoints],
+                      output_breakpoints[s:s + samples_per_chunk]) for s in range(0, n_samples, samples_per_chunk)]
+            if pool is None:
+                outputs = np.column_stack([evaluate_sample_chunk(task) for task in tasks])
+            else:
+                outputs = np.column_stack(pool.map(evaluate_sample_chunk, tasks))
+            mean[start:start + block_size] = outputs.mean(axis=1)
+            std[start:start + block_size] = outputs.std(axis=1)
+            percentile_values[start:start + block_size] = np.percentile(outputs, percentiles, axis=1).T
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return mean, std, percentile_values
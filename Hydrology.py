@@ -0,0 +1,618 @@
+# -----------------------------------------------------------------------------------------------------------------------
+# Name:        Hydrology
+# Purpose:     Array tools for conditioning DEMs and deriving flow (e.g., for drainage area in VBET and the bankfull
+#              channel tool). Uses numpy only, so it can be used without arcpy.
+#
+# Created:     10/2026
+# Licence:     This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 4.0 International
+#              License. To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/4.0/.
+# -----------------------------------------------------------------------------------------------------------------------
+
+import heapq
+import multiprocessing
+import sys
+import time
+from collections import deque
+import numpy as np
+
+# number of cells in each tile of rows flooded at once when filling depressions; the flood keeps python objects for
+# every cell in a tile, so this bounds its memory (roughly 100 bytes per cell)
+FILL_TILE_CELLS = 1000000
+
+# (row, column) offsets to the eight neighbours of a cell
+NEIGHBOUR_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+# label of cells that drain to the edge of the DEM or to NODATA
+OUTLET_LABEL = 0
+
+# number of cells in each tile of rows worked on at once by the moving window functions (smoothing, slope and flow
+# direction); they work in float64 within a tile, so this bounds their temporary arrays
+WINDOW_TILE_CELLS = 1000000
+
+# flow direction of cells that don't flow to another cell (cells draining off the DEM, sinks and NODATA cells)
+NO_FLOW = -1
+
+# maximum number of cells passed downstream at once when accumulating flow
+ACCUMULATION_CHUNK_CELLS = 1000000
+
+# approximate peak memory per DEM cell used by drainage_area on a float32 DEM (including the DEM and the result), on
+# top of the tile being filled
+DRAIN_AREA_BYTES_PER_CELL = 40
+
+
+def fill_depressions(dem, epsilon=0.0, tile_rows=None, n_processes=1):
+    """
+    Fills depressions in a DEM, so every cell has a path that never goes uphill to the edge of the DEM or to a NODATA
+    cell (like Spatial Analyst Fill). Uses priority-flood, flooding inward from the outlet cells in order of elevation.
+    Large DEMs are flooded in tiles of rows; each tile is flooded from its own edges, the spill elevations between
+    tiles are solved on a graph of the areas draining to each tile edge cell, and each tile is then raised to the spill
+    elevation of the area it drains to.
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :param epsilon: If greater than 0, filled depressions and flats are given a gradient of epsilon per cell toward
+    their outlet so they still drain. In a tiled fill the gradient is built by flooding the whole filled DEM once from
+    its outlets, so this step isn't bounded by the tile size.
+    :param tile_rows: Number of rows in each tile (optional; by default tiles hold about FILL_TILE_CELLS cells)
+    :param n_processes: Number of processes to flood tiles in
+    :return: Array of filled elevations, with NaN for NODATA cells. Without an epsilon gradient the filled elevations
+    are all DEM values, so the array has the DEM's (float) type; with a gradient it is float64.
+    """
+    dem = np.asarray(dem)
+    if dem.dtype.kind != 'f':
+        dem = dem.astype(np.float64)
+    nrows, ncols = dem.shape
+    if tile_rows is None:
+        tile_rows = max(1, FILL_TILE_CELLS // max(ncols, 1))
+    tiles = [(row_start, min(row_start + tile_rows, nrows)) for row_start in range(0, nrows, tile_rows)]
+    outlets = outlet_mask(dem)
+    if len(tiles) == 1:
+        filled = flood_tile((dem, outlets, None, epsilon))[0]
+        return filled if epsilon > 0 else filled.astype(dem.dtype)
+
+    pool = multiprocessing.Pool(n_processes) if n_processes > 1 else None
+    try:
+        # flood each tile from its outlet cells and from its edges shared with other tiles, labelling each edge cell
+        # and the area that drains to it. Tiles are copied into the filled DEM as they finish, so only their labels
+        # are held until the spill elevations are known.
+        seam_starts = [OUTLET_LABEL + 1]
+        for row_start, row_end in tiles:
+            seam_starts.append(seam_starts[-1] + int(tile_seam(dem, outlets, row_start, row_end).sum()))
+        tasks = ((dem[row_start:row_end], outlets[row_start:row_end],
+                  seam_labels(tile_seam(dem, outlets, row_start, row_end), first_label), 0.0)
+                 for (row_start, row_end), first_label in zip(tiles, seam_starts))
+        filled = np.empty(dem.shape, dtype=dem.dtype)
+        tile_labels = []
+        graph = {}
+        for (row_start, row_end), (tile_filled, labels, edges) in zip(tiles, map_tiles(pool, tasks)):
+            filled[row_start:row_end] = tile_filled
+            merge_spill_edges(graph, edges)
+            if row_start > 0:
+                merge_spill_edges(graph, seam_spill_edges(filled[row_start - 1], tile_labels[-1][-1],
+                                                          filled[row_start], labels[0]))
+            tile_labels.append(labels)
+            del tile_filled, labels, edges
+
+        # raise each tile to the spill elevation of the area each of its cells drains to, freeing its labels
+        spill = spill_elevations(graph, seam_starts[-1])
+        del graph
+        for row_start, row_end in tiles:
+            labels = tile_labels.pop(0)
+            np.maximum(filled[row_start:row_end], spill[labels], out=filled[row_start:row_end], casting="unsafe")
+            del labels
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if epsilon > 0:
+        # a flat can drain through a cell on a tile edge and back into the same tile, so the gradients are built from
+        # the true outlets across the whole filled DEM rather than tile by tile
+        filled = flood_tile((filled, outlets, None, epsilon))[0]
+    filled[np.isnan(dem)] = np.nan
+    return filled
+
+
+def tile_seam(dem, outlets, row_start, row_end):
+    """
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :param outlets: Boolean array of outlet cells (see outlet_mask)
+    :param row_start: First row of the tile
+    :param row_end: Row after the last row of the tile
+    :return: Boolean array over the tile, True for cells on an edge shared with another tile that aren't outlets
+    """
+    seam = np.zeros((row_end - row_start, dem.shape[1]), dtype=bool)
+    seam[0] = row_start > 0
+    seam[-1] |= row_end < dem.shape[0]
+    seam &= ~outlets[row_start:row_end] & ~np.isnan(dem[row_start:row_end])
+    return seam
+
+
+def seam_labels(seam, first_label):
+    """
+    :param seam: Boolean array over a tile, True for its seam cells (see tile_seam)
+    :param first_label: Label of the first seam cell
+    :return: Int32 array numbering the seam cells in order from the first label, with -1 elsewhere
+    """
+    labels = np.full(seam.shape, -1, dtype=np.int32)
+    labels[seam] = np.arange(first_label, first_label + seam.sum())
+    return labels
+
+
+def undrained_cells(dem):
+    """
+    Finds cells that can't drain, e.g., to check a fill with an epsilon gradient
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :return: Boolean array, True for cells that aren't outlets and have no neighbour lower than themselves
+    """
+    nrows, ncols = dem.shape
+    padded = np.pad(dem, 1, mode="constant", constant_values=np.nan)
+    lower = np.zeros(dem.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for row_offset, col_offset in NEIGHBOUR_OFFSETS:
+            lower |= padded[1 + row_offset:1 + row_offset + nrows, 1 + col_offset:1 + col_offset + ncols] < dem
+    return ~lower & ~outlet_mask(dem) & ~np.isnan(dem)
+
+
+def map_tiles(pool, tasks):
+    """
+    :param pool: multiprocessing Pool to flood tiles in, or None to flood them in this process
+    :param tasks: Iterable of flood_tile arguments
+    :return: Iterator of flood_tile results, in task order, produced as they are needed
+    """
+    if pool is None:
+        return (flood_tile(task) for task in tasks)
+    return pool.imap(flood_tile, tasks)
+
+
+def outlet_mask(dem):
+    """
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :return: Boolean array, True for cells on the edge of the DEM or next to a NODATA cell
+    """
+    nodata = np.pad(np.isnan(dem), 1, mode="constant", constant_values=True)
+    nrows, ncols = dem.shape
+    outlets = np.zeros(dem.shape, dtype=bool)
+    for row_offset, col_offset in NEIGHBOUR_OFFSETS:
+        outlets |= nodata[1 + row_offset:1 + row_offset + nrows, 1 + col_offset:1 + col_offset + ncols]
+    return outlets & ~np.isnan(dem)
+
+
+def flood_tile(args):
+    """
+    Priority-flood of one tile of a DEM from a set of seed cells
+    :param args: Tuple of (array of elevations with NaN for NODATA, boolean array of outlet seed cells, array of labels
+    for other seed cells with -1 elsewhere or None, epsilon)
+    :return: Array of filled elevations, array of the label of the seed each cell drains to, and dictionary of
+    (label, label) to the lowest elevation the areas draining to two seeds meet at
+    """
+    dem, outlets, seed_labels, epsilon = args
+    nrows, ncols = dem.shape
+    width = ncols + 2
+    # pad the tile with a ring of closed cells, so neighbours can be found from flat indices without bounds checks
+    padded = np.pad(dem, 1, mode="constant", constant_values=np.nan)
+    closed = bytearray(np.isnan(padded).ravel().astype(np.uint8).tobytes())
+    z = padded.ravel().tolist()
+    labels = np.full(padded.shape, -1, dtype=np.int32)
+    seeds = np.pad(outlets, 1, mode="constant", constant_values=False)
+    labels[seeds] = OUTLET_LABEL
+    if seed_labels is not None:
+        other_seeds = np.pad(seed_labels >= 0, 1, mode="constant", constant_values=False)
+        labels[other_seeds] = np.pad(seed_labels, 1, mode="constant", constant_values=-1)[other_seeds]
+        seeds |= other_seeds
+    seeds &= ~np.isnan(padded)
+    labels = labels.ravel().tolist()
+    seed_cells = np.flatnonzero(seeds).tolist()
+    offsets = [row_offset * width + col_offset for row_offset, col_offset in NEIGHBOUR_OFFSETS]
+
+    heap = [(z[cell], cell) for cell in seed_cells]
+    heapq.heapify(heap)
+    for cell in seed_cells:
+        closed[cell] = 1
+    # cells raised to the level of the cell that reached them are flooded first, in the order they were reached
+    pit = deque()
+    edges = {}
+    heappop = heapq.heappop
+    heappush = heapq.heappush
+    while heap or pit:
+        if pit:
+            cell = pit.popleft()
+        else:
+            cell = heappop(heap)[1]
+        cell_z = z[cell]
+        cell_label = labels[cell]
+        fill_z = cell_z + epsilon
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                neighbour_label = labels[neighbour]
+                if neighbour_label != cell_label and neighbour_label >= 0:
+                    # the areas draining to two seeds meet here; keep the lowest elevation they meet at
+                    key = (cell_label, neighbour_label) if cell_label < neighbour_label else (neighbour_label, cell_label)
+                    spill_z = cell_z if cell_z > z[neighbour] else z[neighbour]
+                    if spill_z < edges.get(key, np.inf):
+                        edges[key] = spill_z
+                continue
+            closed[neighbour] = 1
+            labels[neighbour] = cell_label
+            if z[neighbour] <= fill_z:
+                z[neighbour] = fill_z
+                pit.append(neighbour)
+            else:
+                heappush(heap, (z[neighbour], neighbour))
+
+    filled = np.array(z).reshape(padded.shape)[1:-1, 1:-1]
+    return filled, np.array(labels, dtype=np.int32).reshape(padded.shape)[1:-1, 1:-1], edges
+
+
+def seam_spill_edges(above_filled, above_labels, below_filled, below_labels):
+    """
+    Finds where the areas draining to edge cells of two neighbouring tiles meet across the edge between the tiles
+    :param above_filled: Filled elevations of the bottom row of the upper tile
+    :param above_labels: Labels of the bottom row of the upper tile
+    :param below_filled: Filled elevations of the top row of the lower tile
+    :param below_labels: Labels of the top row of the lower tile
+    :return: Dictionary of (label, label) to the lowest elevation the two areas meet at
+    """
+    edges = {}
+    ncols = len(above_filled)
+    for col_offset in [-1, 0, 1]:
+        above = slice(max(0, -col_offset), ncols - max(0, col_offset))
+        below = slice(max(0, col_offset), ncols - max(0, -col_offset))
+        a_labels, b_labels = above_labels[above], below_labels[below]
+        keep = (a_labels >= 0) & (b_labels >= 0) & (a_labels != b_labels)
+        spill_z = np.maximum(above_filled[above], below_filled[below])[keep]
+        for pair, value in zip(zip(np.minimum(a_labels, b_labels)[keep].tolist(),
+                                   np.maximum(a_labels, b_labels)[keep].tolist()), spill_z.tolist()):
+            if value < edges.get(pair, np.inf):
+                edges[pair] = value
+    return edges
+
+
+def merge_spill_edges(graph, edges):
+    """
+    Adds spill edges to a graph of labels, keeping the lowest elevation between each pair of labels
+    :param graph: Dictionary of label to dictionary of neighbouring label to spill elevation (modified in place)
+    :param edges: Dictionary of (label, label) to spill elevation
+    """
+    for (label1, label2), spill_z in edges.items():
+        for label, neighbour in [(label1, label2), (label2, label1)]:
+            neighbours = graph.setdefault(label, {})
+            if spill_z < neighbours.get(neighbour, np.inf):
+                neighbours[neighbour] = spill_z
+
+
+def spill_elevations(graph, n_labels):
+    """
+    Finds the elevation each labelled area has to be filled to before it drains to an outlet, flooding the graph of
+    labels from the outlet label in order of elevation
+    :param graph: Dictionary of label to dictionary of neighbouring label to spill elevation
+    :param n_labels: Number of labels
+    :return: Array of spill elevation for each label (-inf for areas that don't need filling to drain)
+    """
+    spill = np.full(n_labels, np.inf)
+    spill[OUTLET_LABEL] = -np.inf
+    heap = [(-np.inf, OUTLET_LABEL)]
+    while heap:
+        spill_z, label = heapq.heappop(heap)
+        if spill_z > spill[label]:
+            continue
+        for neighbour, edge_z in graph.get(label, {}).items():
+            neighbour_z = max(spill_z, edge_z)
+            if neighbour_z < spill[neighbour]:
+                spill[neighbour] = neighbour_z
+                heapq.heappush(heap, (neighbour_z, neighbour))
+    spill[np.isinf(spill)] = -np.inf
+    return spill
+
+
+def mean_filter(values, size=3):
+    """
+    Mean over a square window around each cell, ignoring NODATA cells (like Spatial Analyst FocalStatistics MEAN),
+    from running sums along rows and then columns (a summed-area table). NODATA cells stay NODATA (like clipping the
+    result back to the input with ExtractByMask).
+    :param values: Array of values, with NaN for NODATA cells
+    :param size: Width of the window in cells (odd)
+    :return: Float64 array of window means, with NaN for NODATA cells
+    """
+    valid = ~np.isnan(values)
+    sums = window_sum(np.where(valid, values, 0.0), size)
+    counts = window_sum(valid.astype(np.float64), size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    means[~valid] = np.nan
+    return means
+
+
+def window_sum(values, size):
+    """
+    :param values: Array of values
+    :param size: Width of the square window in cells (odd); cells beyond the edge of the array count as 0
+    :return: Float64 array of the sum over the window around each cell
+    """
+    radius = size // 2
+    sums = np.pad(np.asarray(values, dtype=np.float64), radius, mode="constant", constant_values=0)
+    for axis in [0, 1]:
+        sums = np.cumsum(sums, axis=axis)
+        sums = np.concatenate([np.zeros_like(sums.take([0], axis=axis)), sums], axis=axis)
+        n = sums.shape[axis]
+        sums = sums.take(np.arange(size, n), axis=axis) - sums.take(np.arange(0, n - size), axis=axis)
+    return sums
+
+
+def horn_slope(dem, cell_width, cell_height=None):
+    """
+    Slope in degrees from Horn's third-order finite difference (like Spatial Analyst Slope). Neighbours that are
+    NODATA or beyond the edge of the array take the value of the centre cell.
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :param cell_width: Cell width (in elevation units)
+    :param cell_height: Cell height (optional; defaults to the cell width)
+    :return: Float64 array of slope (degrees), with NaN for NODATA cells
+    """
+    if cell_height is None:
+        cell_height = cell_width
+    nrows, ncols = dem.shape
+    padded = np.pad(dem, 1, mode="constant", constant_values=np.nan)
+    dz_dx = np.zeros(dem.shape)
+    dz_dy = np.zeros(dem.shape)
+    for row_offset, col_offset in NEIGHBOUR_OFFSETS:
+        neighbour = padded[1 + row_offset:1 + row_offset + nrows, 1 + col_offset:1 + col_offset + ncols]
+        neighbour = np.where(np.isnan(neighbour), dem, neighbour)
+        # cells in line with the centre count twice
+        weight = 2 if row_offset == 0 or col_offset == 0 else 1
+        dz_dx += weight * col_offset * neighbour
+        dz_dy += weight * row_offset * neighbour
+    slope = np.degrees(np.arctan(np.hypot(dz_dx / (8 * cell_width), dz_dy / (8 * cell_height))))
+    slope[np.isnan(dem)] = np.nan
+    return slope
+
+
+def smoothed_slope(dem, cell_width, cell_height=None, smoothing_cells=3, tile_rows=None, out=None):
+    """
+    Smooths a DEM with mean_filter and calculates its slope with horn_slope in one pass over tiles of rows, so the
+    smoothed DEM is never held (or saved) in full. Each tile is read with enough rows around it for both windows.
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :param cell_width: Cell width (in elevation units)
+    :param cell_height: Cell height (optional; defaults to the cell width)
+    :param smoothing_cells: Width of the smoothing window in cells (odd)
+    :param tile_rows: Number of rows in each tile (optional; by default tiles hold about WINDOW_TILE_CELLS cells)
+    :param out: Float32 array (e.g., a numpy memmap) with the same shape as the DEM to write slope to (optional)
+    :return: Float32 array of slope (degrees), with NaN for NODATA cells
+    """
+    return map_row_tiles(lambda tile: horn_slope(mean_filter(tile, smoothing_cells), cell_width, cell_height), dem,
+                         smoothing_cells // 2 + 1, tile_rows, out)
+
+
+def smoothed_dem(dem, smoothing_cells=3, tile_rows=None, out=None):
+    """
+    Smooths a DEM with mean_filter over tiles of rows, so the filter's float64 working arrays are only tile sized
+    :param dem: Array of elevations, with NaN for NODATA cells
+    :param smoothing_cells: Width of the smoothing window in cells (odd)
+    :param tile_rows: Number of rows in each tile (optional; by default tiles hold about WINDOW_TILE_CELLS cells)
+    :param out: Float32 array (e.g., a numpy memmap) with the same shape as the DEM to write to (optional)
+    :return: Float32 array of smoothed elevations, with NaN for NODATA cells
+    """
+    return map_row_tiles(lambda tile: mean_filter(tile, smoothing_cells), dem, smoothing_cells // 2, tile_rows, out)
+
+
+def map_row_tiles(function, values, halo, tile_rows=None, out=None):
+    """
+    Applies a moving window function to tiles of rows, reading each tile with enough rows around it for the window
+    :param function: Function of a float64 array, returning an array of the same shape
+    :param values: Array of values (e.g., elevations), or an object with a shape and row slicing such as a memmap
+    :param halo: Number of rows the function's window reaches above and below a cell
+    :param tile_rows: Number of rows in each tile (optional; by default tiles hold about WINDOW_TILE_CELLS cells)
+    :param out: Float32 array (e.g., a numpy memmap) with the same shape as the values to write to (optional)
+    :return: Float32 array of results
+    """
+    nrows, ncols = values.shape
+    if tile_rows is None:
+        tile_rows = max(1, WINDOW_TILE_CELLS // max(ncols, 1))
+    if out is None:
+        out = np.empty(values.shape, dtype=np.float32)
+    for row_start in range(0, nrows, tile_rows):
+        row_end = min(row_start + tile_rows, nrows)
+        tile_start = max(0, row_start - halo)
+        tile = np.asarray(values[tile_start:min(nrows, row_end + halo)], dtype=np.float64)
+        out[row_start:row_end] = function(tile)[row_start - tile_start:row_end - tile_start]
+    return out
+
+
+def flow_directions(dem, cell_width, cell_height=None, tile_rows=None):
+    """
+    Finds the D8 flow direction of each cell (the neighbour with the steepest drop, like Spatial Analyst
+    FlowDirection). Cells on the edge of the DEM or next to NODATA with no drop to another cell flow off the DEM, and
+    cells on flats flow toward the nearest cell that drains off the flat.
+    :param dem: Array of (filled) elevations, with NaN for NODATA cells
+    :param cell_width: Cell width
+    :param cell_height: Cell height (optional; defaults to the cell width)
+    :param tile_rows: Number of rows in each tile the drops are calculated over (in float64) at once (optional; by
+    default tiles hold about WINDOW_TILE_CELLS cells)
+    :return: Int8 array of the index into NEIGHBOUR_OFFSETS of the neighbour each cell flows to, NO_FLOW elsewhere
+    """
+    if cell_height is None:
+        cell_height = cell_width
+    dem = np.asarray(dem)
+    if dem.dtype.kind != 'f':
+        dem = dem.astype(np.float64)
+    nrows, ncols = dem.shape
+    if tile_rows is None:
+        tile_rows = max(1, WINDOW_TILE_CELLS // max(ncols, 1))
+    padded = np.pad(dem, 1, mode="constant", constant_values=np.nan)
+    directions = np.empty(dem.shape, dtype=np.int8)
+    for row_start in range(0, nrows, tile_rows):
+        row_end = min(row_start + tile_rows, nrows)
+        directions[row_start:row_end] = steepest_directions(padded[row_start:row_end + 2], cell_width, cell_height)
+    resolve_flats(padded, directions, outlet_mask(dem))
+    return directions
+
+
+def steepest_directions(padded, cell_width, cell_height):
+    """
+    :param padded: Tile of elevations with a row or column of neighbouring cells (or NaN) on every side
+    :param cell_width: Cell width
+    :param cell_height: Cell height
+    :return: Int8 array of the index into NEIGHBOUR_OFFSETS of each inner cell's steepest downhill neighbour, NO_FLOW
+    for cells without one
+    """
+    padded = np.asarray(padded, dtype=np.float64)
+    nrows, ncols = padded.shape[0] - 2, padded.shape[1] - 2
+    dem = padded[1:-1, 1:-1]
+    directions = np.full(dem.shape, NO_FLOW, dtype=np.int8)
+    steepest = np.zeros(dem.shape)
+    with np.errstate(invalid='ignore'):
+        for index, (row_offset, col_offset) in enumerate(NEIGHBOUR_OFFSETS):
+            neighbour = padded[1 + row_offset:1 + row_offset + nrows, 1 + col_offset:1 + col_offset + ncols]
+            slope = (dem - neighbour) / np.hypot(row_offset * cell_height, col_offset * cell_width)
+            steeper = slope > steepest
+            np.copyto(steepest, slope, where=steeper)
+            directions[steeper] = index
+    return directions
+
+
+def resolve_flats(padded, directions, outlets):
+    """
+    Points cells without a downhill neighbour toward a neighbour at the same elevation that already drains, growing
+    outward from the cells draining off each flat, so flats drain without creating loops. Cells on flats with no
+    drained edge (unfilled pits) are left as sinks.
+    :param padded: Array of elevations padded with a ring of NaN cells
+    :param directions: Array of flow directions, modified in place
+    :param outlets: Boolean array, True for cells that can flow off the DEM
+    """
+    nrows, ncols = directions.shape
+    width = ncols + 2
+    z = padded.ravel()
+    offsets = np.array([row_offset * width + col_offset for row_offset, col_offset in NEIGHBOUR_OFFSETS])
+    drained = np.pad((directions != NO_FLOW) | outlets, 1, mode="constant", constant_values=True).ravel()
+    drained |= np.isnan(z)
+    if drained.all():
+        return
+    padded_directions = np.pad(directions, 1, mode="constant", constant_values=NO_FLOW).ravel()
+    # start from drained cells next to undrained cells at the same elevation
+    undrained = ~drained.reshape(nrows + 2, width)
+    next_to_undrained = np.zeros(undrained.shape, dtype=bool)
+    for row_offset, col_offset in NEIGHBOUR_OFFSETS:
+        next_to_undrained[1:-1, 1:-1] |= undrained[1 + row_offset:1 + row_offset + nrows,
+                                                   1 + col_offset:1 + col_offset + ncols]
+    del undrained
+    frontier = np.flatnonzero(next_to_undrained.ravel() & drained & ~np.isnan(z))
+    del next_to_undrained
+    while frontier.size:
+        reached = []
+        for index, offset in enumerate(offsets):
+            # neighbours in this direction flow back to the frontier cell, in the opposite direction
+            neighbours = frontier + offset
+            flows = ~drained[neighbours] & (z[neighbours] == z[frontier])
+            neighbours = neighbours[flows]
+            padded_directions[neighbours] = len(offsets) - 1 - index
+            drained[neighbours] = True
+            reached.append(neighbours)
+        frontier = np.concatenate(reached)
+    directions[:] = padded_directions.reshape(nrows + 2, width)[1:-1, 1:-1]
+
+
+def flow_accumulation(directions, weights=None):
+    """
+    Sums the weights of the cells upstream of each cell (like Spatial Analyst FlowAccumulation, a cell's own weight is
+    not included). Cells are accumulated in topological order, a level of cells at a time: each level is every cell
+    whose upstream cells have all been accumulated.
+    :param directions: Array of flow directions from flow_directions
+    :param weights: Array of weight for each cell (optional; by default every cell has a weight of 1)
+    :return: Float64 array of accumulated upstream weight for each cell
+    """
+    nrows, ncols = directions.shape
+    n_cells = directions.size
+    index_type = np.int32 if n_cells < 2 ** 31 else np.int64
+    offsets = np.array([row_offset * ncols + col_offset for row_offset, col_offset in NEIGHBOUR_OFFSETS],
+                       dtype=index_type)
+    flat_directions = directions.ravel()
+    flows = flat_directions != NO_FLOW
+    # NO_FLOW picks the last offset, so cells that don't flow are reset afterwards
+    downstream = offsets[flat_directions]
+    downstream += np.arange(n_cells, dtype=index_type)
+    downstream[~flows] = -1
+
+    # count the neighbours flowing into each cell (a neighbour flows in if it points in the opposite direction)
+    padded = np.pad(directions, 1, mode="constant", constant_values=NO_FLOW)
+    upstream_count = np.zeros((nrows, ncols), dtype=np.uint8)
+    for index, (row_offset, col_offset) in enumerate(NEIGHBOUR_OFFSETS):
+        upstream_count += padded[1 + row_offset:1 + row_offset + nrows, 1 + col_offset:1 + col_offset + ncols] == \
+            len(NEIGHBOUR_OFFSETS) - 1 - index
+    upstream_count = upstream_count.ravel()
+    del padded
+
+    if weights is None:
+        accumulation = np.ones(n_cells)
+    else:
+        accumulation = np.array(weights, dtype=np.float64).ravel()
+    level = np.flatnonzero((upstream_count == 0) & flows).astype(index_type)
+    while level.size:
+        # large levels (e.g., the first, every cell without upstream cells) are passed on in chunks to bound the
+        # sorting arrays; a cell is only passed on once all its upstream cells are, so the chunks can't interact
+        next_level = []
+        for chunk_start in range(0, level.size, ACCUMULATION_CHUNK_CELLS):
+            chunk = level[chunk_start:chunk_start + ACCUMULATION_CHUNK_CELLS]
+            targets, inverse = np.unique(downstream[chunk], return_inverse=True)
+            accumulation[targets] += np.bincount(inverse, weights=accumulation[chunk])
+            upstream_count[targets] -= np.bincount(inverse).astype(np.uint8)
+            next_level.append(targets[(upstream_count[targets] == 0) & flows[targets]])
+        level = np.concatenate(next_level)
+    if weights is None:
+        accumulation -= 1
+    else:
+        accumulation -= np.asarray(weights, dtype=np.float64).ravel()
+    return accumulation.reshape(nrows, ncols)
+
+
+def drainage_area(dem, cell_width, cell_height=None, n_processes=1):
+    """
+    Calculates drainage area in square kilometers from a DEM (fill, D8 flow direction and flow accumulation)
+    :param dem: Array of elevations (in meters), with NaN for NODATA cells. A float32 DEM keeps the filled DEM in
+    float32, which needs about DRAIN_AREA_BYTES_PER_CELL bytes per cell at the peak.
+    :param cell_width: Cell width (in meters)
+    :param cell_height: Cell height (in meters; optional, defaults to the cell width)
+    :param n_processes: Number of processes to fill tiles of the DEM in
+    :return: Float32 array of drainage area (square kilometers), with NaN for NODATA cells
+    """
+    if cell_height is None:
+        cell_height = cell_width
+    filled = fill_depressions(dem, n_processes=n_processes)
+    directions = flow_directions(filled, cell_width, cell_height)
+    del filled
+    accumulation = flow_accumulation(directions)
+    del directions
+    accumulation *= cell_width * cell_height / 1000000.0
+    drain_area = accumulation.astype(np.float32)
+    del accumulation
+    drain_area[np.isnan(dem)] = np.nan
+    return drain_area
+
+
+def benchmark(nrows=1000, ncols=1000, seed=0):
+    """
+    Times each step on a synthetic DEM (a tilted surface with random bumps and pits) and prints cells per second
+    :param nrows: Number of rows in the synthetic DEM
+    :param ncols: Number of columns in the synthetic DEM
+    :param seed: Random seed for the synthetic DEM
+    """
+    rng = np.random.RandomState(seed)
+    rows, cols = np.mgrid[0:nrows, 0:ncols]
+    dem = 0.01 * rows + 0.005 * cols + rng.uniform(0, 2, (nrows, ncols))
+    n_cells = nrows * ncols
+    filled = fill_depressions(dem)
+    directions = flow_directions(filled, 10.0)
+    # epsilon fills should leave every cell draining, whether or not the DEM is tiled
+    for tile_rows in [None, -(-nrows // 4)]:
+        if undrained_cells(fill_depressions(dem, epsilon=1e-4, tile_rows=tile_rows)).any():
+            raise Exception("ERROR: Epsilon fill with tile_rows={0} left undrained cells".format(tile_rows))
+    for name, step in [("fill_depressions", lambda: fill_depressions(dem)),
+                       ("fill_depressions (epsilon)", lambda: fill_depressions(dem, epsilon=1e-4)),
+                       ("fill_depressions (4 tiles)", lambda: fill_depressions(dem, tile_rows=-(-nrows // 4))),
+                       ("flow_directions", lambda: flow_directions(filled, 10.0)),
+                       ("flow_accumulation", lambda: flow_accumulation(directions)),
+                       ("smoothed_slope", lambda: smoothed_slope(dem, 10.0))]:
+        start = time.time()
+        step()
+        elapsed = time.time() - start
+        print("{0}: {1} cells in {2:.2f} s ({3:,.0f} cells/s)".format(name, n_cells, elapsed, n_cells / elapsed))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(arg) for arg in sys.argv[1:3]])
@@ -18,13 +18,89 @@ import sys
 import os
 import glob
 import numpy as np
-import skfuzzy as fuzz
-from skfuzzy import control as ctrl
 from math import pi
 import projectxml
 import uuid
 import datetime
-from SupportingFunctions import find_available_num_prefix, make_layer
+import multiprocessing
+from SupportingFunctions import find_available_num_prefix, make_layer, get_zone_raster, ZoneGrid, zonal_mean, \
+    veg_lookup_arrays, make_reach_table, write_reach_table, rasterize_polygons, same_grid, snap_to_grid
+from FuzzyInference import MamdaniFIS, build_surface, cached_surface, interpolate_surface, surface_error, \
+    evaluate_sensitivity
+
+# universe the riparian condition FIS membership functions are sampled on
+RCA_FIS_UNIVERSE = np.arange(0, 1, 0.01)
+# largest difference from skfuzzy allowed by check_fis
+SKFUZZY_TOLERANCE = 1e-9
+
+# FIS inputs and output with their terms and membership function breakpoints (three for a triangle, four for a trapezoid)
+RCA_FIS_INPUTS = [
+    ("input1", [("large", [0, 0, 0.3, 0.5]),
+                ("significant", [0.3, 0.5, 0.85]),
+                ("minor", [0.5, 0.85, 0.95]),
+                ("negligible", [0.85, 0.95, 1, 1])]),
+    ("input2", [("low", [0, 0, 0.017, 0.17]),
+                ("moderate", [0.017, 0.17, 0.416, 0.583]),
+                ("high", [0.416, 0.583, 1, 1])]),
+    ("input3", [("low", [0, 0, 0.5, 0.7]),
+                ("moderate", [0.5, 0.7, 0.9, 0.95]),
+                ("high", [0.9, 0.95, 1, 1])])]
+RCA_FIS_OUTPUT = ("result", [("very poor", [0, 0, 0.1, 0.25]),
+                             ("poor", [0.1, 0.25, 0.35, 0.5]),
+                             ("moderate", [0.35, 0.5, 0.8]),
+                             ("good", [0.5, 0.8, 0.95]),
+                             ("intact", [0.8, 0.95, 1, 1])])
+
+# FIS rules: (RVD, LUI, CONNECT, CONDITION) terms; None where a rule doesn't use an input, a tuple of terms for OR
+RCA_FIS_RULES = [
+    ("large", "low", "low", "poor"),
+    ("large", "low", "moderate", "poor"),
+    ("large", "low", "high", "moderate"),
+    ("large", "moderate", "low", "poor"),
+    (None, "moderate", "moderate", "moderate"),
+    ("large", "moderate", "high", "poor"),
+    ("large", "high", "low", "very poor"),
+    (("significant", "minor", "negligible"), "high", "low", "poor"),
+    (None, "high", "moderate", "poor"),
+    (None, "high", "high", "moderate"),
+    ("significant", "low", "low", "moderate"),
+    ("significant", "low", "moderate", "moderate"),
+    ("significant", "low", "high", "good"),
+    ("significant", "moderate", "low", "poor"),
+    ("significant", "moderate", "high", "moderate"),
+    ("minor", "low", "low", "moderate"),
+    ("minor", "low", "moderate", "good"),
+    ("minor", "low", "high", "intact"),
+    ("minor", "moderate", "low", "moderate"),
+    ("minor", "moderate", "high", "moderate"),
+    ("negligible", "low", "low", "moderate"),
+    ("negligible", "low", "moderate", "good"),
+    ("negligible", "low", "high", "intact"),
+    ("negligible", "moderate", "low", "moderate"),
+    ("negligible", "moderate", "high", "good")]
+
+# default largest shift of a membership function breakpoint in the FIS sensitivity analysis
+SENSITIVITY_SPREAD = 0.05
+# percentiles of condition written by the sensitivity analysis (as COND_P##)
+SENSITIVITY_PERCENTILES = [5, 95]
+
+# model input fields added to the RCA input network
+INPUT_FIELDS = ["LUI", "CONNECT", "EX_VEG", "HIST_VEG", "VEG"]
+
+# condition category labels for each condition code
+CONDITION_TYPES = {
+    0: "",
+    1: "Very Poor",
+    2: "Poor",
+    3: "Moderate",
+    4: "Good",
+    5: "Intact",
+    6: "Confined - Unimpacted",
+    7: "Confined - Impacted",
+    8: "None"}
+CONDITION_LABELS = np.array([CONDITION_TYPES[code] for code in range(len(CONDITION_TYPES))], dtype=object)
+# upper COND_VAL bounds of the Very Poor, Poor, Moderate and Good categories (higher values are Intact)
+CONDITION_BREAKS = [0.2, 0.4, 0.65, 0.85]
 
 
 def main(
@@ -39,7 +115,12 @@ def main(
     lg_river,
     dredge_tailings,
     confin_thresh,
-    outName):
+    outName,
+    fis_surface_resolution=None,
+    fis_cache_folder=None,
+    sensitivity_samples=None,
+    sensitivity_spread=None,
+    sensitivity_processes=None):
     """ Calculates riparian condition for a stream network based on RVD, confinement, vegetation, and valley connectivity
     :param projName: Project name for XML metadata
     :param hucID: Huc ID for XML metadata
@@ -53,6 +134,14 @@ def main(
     :param dredge_tailings: Dredge tailings polygon shapefile
     :param confin_thresh: Confinement threshold for calculating riparian condition
     :param outName: Name for output network
+    :param fis_surface_resolution: Number of grid points along each FIS input for evaluating the FIS once on a grid
+    and interpolating condition for each reach (optional; if not given, the FIS is evaluated for each reach)
+    :param fis_cache_folder: Folder to keep FIS surfaces in, so runs with the same FIS and resolution reuse them
+    (optional; only used with fis_surface_resolution)
+    :param sensitivity_samples: Number of FIS parameter sets to draw for a sensitivity analysis of condition to the
+    membership function breakpoints (optional; if given, adds COND_MEAN, COND_SD and COND_P## fields)
+    :param sensitivity_spread: Largest shift of a breakpoint in the sensitivity analysis (optional)
+    :param sensitivity_processes: Number of processes to run the sensitivity analysis in (optional)
     return: Output network with Riparian Condition fields
     """
     projPath = os.path.dirname(os.path.dirname(output_folder))
@@ -91,222 +180,201 @@ def main(
     fcOut = output_folder + "/rca_table.shp"
     arcpy.CopyFeatures_management(seg_network, fcOut)
 
-    # add model input attributes to input network
+    # get thiessen polygons rasterized onto the vegetation grid (cached per project) and read vegetation lookups from one pass over each raster
+    n_reaches = int(arcpy.GetCount_management(fcOut).getOutput(0))
+    zone_grid = ZoneGrid(get_zone_raster(thiessen_valley, "RCH_FID", ex_veg), n_reaches)
+    ex_lookups = veg_lookup_arrays(ex_veg, ["LU_CODE", "VEGETATED"], zone_grid)
+    # historic vegetation on another grid than existing vegetation (which the zone grid is snapped to) is resampled onto it
+    hist_lookups = veg_lookup_arrays(hist_veg, ["VEGETATED"], zone_grid,
+                                     grid_raster=snap_to_grid(hist_veg, ex_veg, os.path.join(scratch, "hist_veg.tif")))
+
+    # calculate model inputs for each reach and write them to the input network in one pass
     arcpy.AddMessage("Assessing land use intensity...")
-    calc_lui(ex_veg, thiessen_valley, intermediates_folder, fcOut)
+    lui = calc_lui(ex_lookups["LU_CODE"], zone_grid, intermediates_folder)
 
     arcpy.AddMessage("Assessing floodplain connectivity...")
-    calc_connectivity(frag_valley, thiessen_valley, fcOut, dredge_tailings, ex_veg, intermediates_folder, scratch)
+    connect = calc_connectivity(frag_valley, dredge_tailings, zone_grid, intermediates_folder)
     arcpy.AddMessage("Assessing overall vegetation departure...")
-    calc_veg(ex_veg, hist_veg, thiessen_valley, intermediates_folder, fcOut)
+    ex_vegetated, hist_vegetated, veg = calc_veg(ex_lookups["VEGETATED"], hist_lookups["VEGETATED"], zone_grid,
+                                                 intermediates_folder)
 
-    # # # calculate rca for segments in unconfined valleys # # #
-    arcpy.AddMessage("Calculating riparian condition for segments in unconfined valleys...")
+    output = assess_condition(fcOut, seg_network, frag_valley, [lui, connect, ex_vegetated, hist_vegetated, veg],
+                              confin_thresh, rca_out_dir, outName, fis_surface_resolution, fis_cache_folder,
+                              sensitivity_samples, sensitivity_spread, sensitivity_processes)
 
-    arcpy.MakeFeatureLayer_management(fcOut, "rca_in_lyr")
-    arcpy.SelectLayerByAttribute_management("rca_in_lyr", "NEW_SELECTION", '"CONF_RATIO" < {0}'.format(confin_thresh))
-    #arcpy.SelectLayerByAttribute_management("rca_in_lyr", "NEW_SELECTION", """ Con_Type != "BOTH" """)
-    arcpy.FeatureClassToFeatureClass_conversion("rca_in_lyr", scratch, "rca_u")
-    rca_u = scratch + "/rca_u.shp"
+    arcpy.CheckInExtension('spatial')
 
-    ct = arcpy.GetCount_management(rca_u)
-    count = int(ct.getOutput(0))
-    if count is not 0:
+    # make layers
+    arcpy.AddMessage("Making layers...")
+    make_layers(fcOut, intermediates_folder)
+    
+    # write xml
+    arcpy.AddMessage("Writing XML file. NOTE: This is the final step and non-critical to the outputs")
+    try:
+        write_xml(projName, hucID, hucName, projPath, ex_veg, hist_veg, seg_network, frag_valley, lg_river, dredge_tailings, confin_thresh, output)
+    except Exception:
+        arcpy.AddMessage("Writing the XML file has failed, but RVD outputs are saved. This is a known bug in RCAT and you can proceed to the next step without problems.")
+    
 
-        # fix values outside of range of membership functions.
-        cursor = arcpy.da.UpdateCursor(rca_u, ["NATIV_DEP", "LUI", "CONNECT"])
-        for row in cursor:
-            if row[0] < 0:
-                row[0] = 0.01
-            elif row[0] > 1:
-                row[0] = 1
-            elif row[1] < 0:
-                row[1] = 0.01
-            elif row[1] > 1:
-                row[3] = 1
-            elif row[2] < 0:
-                row[2] = 0.01
-            elif row[2] > 1:
-                row[2] = 1
-            cursor.updateRow(row)
-        del row
-        del cursor
-
-        # get arrays from the fields of interest
-        RVDa = arcpy.da.FeatureClassToNumPyArray(rca_u, "NATIV_DEP")
-        LUIa = arcpy.da.FeatureClassToNumPyArray(rca_u, "LUI")
-        CONNECTa = arcpy.da.FeatureClassToNumPyArray(rca_u, "CONNECT")
-
-        # convert the data type of the arrays
-        RVDarray = np.asarray(RVDa, np.float64)
-        LUIarray = np.asarray(LUIa, np.float64)
-        CONNECTarray = np.asarray(CONNECTa, np.float64)
-
-        del RVDa, LUIa, CONNECTa
-
-        # set up FIS
-        RVD = ctrl.Antecedent(np.arange(0, 1, 0.01), "input1")
-        LUI = ctrl.Antecedent(np.arange(0, 1, 0.01), "input2")
-        CONNECT = ctrl.Antecedent(np.arange(0, 1, 0.01), "input3")
-        CONDITION = ctrl.Consequent(np.arange(0, 1, 0.01), "result")
-
-        RVD["large"] = fuzz.trapmf(RVD.universe, [0, 0, 0.3, 0.5])
-        RVD["significant"] = fuzz.trimf(RVD.universe, [0.3, 0.5, 0.85])
-        RVD["minor"] = fuzz.trimf(RVD.universe, [0.5, 0.85, 0.95])
-        RVD["negligible"] = fuzz.trapmf(RVD.universe, [0.85, 0.95, 1, 1])
-
-        LUI["low"] = fuzz.trapmf(LUI.universe, [0, 0, 0.017, 0.17])
-        LUI["moderate"] = fuzz.trapmf(LUI.universe, [0.017, 0.17, 0.416, 0.583])
-        LUI["high"] = fuzz.trapmf(LUI.universe, [0.416, 0.583, 1, 1])
-
-        CONNECT["low"] = fuzz.trapmf(CONNECT.universe, [0, 0, 0.5, 0.7])
-        CONNECT["moderate"] = fuzz.trapmf(CONNECT.universe, [0.5, 0.7, 0.9, 0.95])
-        CONNECT["high"] = fuzz.trapmf(CONNECT.universe, [0.9, 0.95, 1, 1])
-
-        CONDITION["very poor"] = fuzz.trapmf(CONDITION.universe, [0, 0, 0.1, 0.25])
-        CONDITION["poor"] = fuzz.trapmf(CONDITION.universe, [0.1, 0.25, 0.35, 0.5])
-        CONDITION["moderate"] = fuzz.trimf(CONDITION.universe, [0.35, 0.5, 0.8])
-        CONDITION["good"] = fuzz.trimf(CONDITION.universe, [0.5, 0.8, 0.95])
-        CONDITION["intact"] = fuzz.trapmf(CONDITION.universe, [0.8, 0.95, 1, 1])
-
-        rule0 = ctrl.Rule(RVD['large'] & LUI['low'] & CONNECT['low'], CONDITION['poor'])
-        rule1 = ctrl.Rule(RVD['large'] & LUI['low'] & CONNECT['moderate'], CONDITION['poor']) #
-        rule2 = ctrl.Rule(RVD['large'] & LUI['low'] & CONNECT['high'], CONDITION['moderate']) #
-        rule3 = ctrl.Rule(RVD['large'] & LUI['moderate'] & CONNECT['low'], CONDITION['poor'])
-        rule4 = ctrl.Rule(LUI['moderate'] & CONNECT['moderate'], CONDITION['moderate'])
-        rule5 = ctrl.Rule(RVD['large'] & LUI['moderate'] & CONNECT['high'], CONDITION['poor']) #
-        rule6 = ctrl.Rule(RVD['large'] & LUI['high'] & CONNECT['low'], CONDITION['very poor'])
-        rule6_1 = ctrl.Rule((RVD['significant'] | RVD['minor'] | RVD['negligible']) & LUI['high'] & CONNECT['low'], CONDITION['poor'])
-        rule7 = ctrl.Rule(LUI['high'] & CONNECT['moderate'], CONDITION['poor'])
-        rule8 = ctrl.Rule(LUI['high'] & CONNECT['high'], CONDITION['moderate'])
-        rule9 = ctrl.Rule(RVD['significant'] & LUI['low'] & CONNECT['low'], CONDITION['moderate'])
-        rule10 = ctrl.Rule(RVD['significant'] & LUI['low'] & CONNECT['moderate'], CONDITION['moderate'])
-        rule11 = ctrl.Rule(RVD['significant'] & LUI['low'] & CONNECT['high'], CONDITION['good'])
-        rule12 = ctrl.Rule(RVD['significant'] & LUI['moderate'] & CONNECT['low'], CONDITION['poor'])
-        rule13 = ctrl.Rule(RVD['significant'] & LUI['moderate'] & CONNECT['high'], CONDITION['moderate'])
-        rule14 = ctrl.Rule(RVD['minor'] & LUI['low'] & CONNECT['low'], CONDITION['moderate'])
-        rule15 = ctrl.Rule(RVD['minor'] & LUI['low'] & CONNECT['moderate'], CONDITION['good'])
-        rule16 = ctrl.Rule(RVD['minor'] & LUI['low'] & CONNECT['high'], CONDITION['intact'])
-        rule17 = ctrl.Rule(RVD['minor'] & LUI['moderate'] & CONNECT['low'], CONDITION['moderate'])
-        rule18 = ctrl.Rule(RVD['minor'] & LUI['moderate'] & CONNECT['high'], CONDITION['moderate'])
-        rule19 = ctrl.Rule(RVD['negligible'] & LUI['low'] & CONNECT['low'], CONDITION['moderate'])
-        rule20 = ctrl.Rule(RVD['negligible'] & LUI['low'] & CONNECT['moderate'], CONDITION['good'])
-        rule21 = ctrl.Rule(RVD['negligible'] & LUI['low'] & CONNECT['high'], CONDITION['intact'])
-        rule22 = ctrl.Rule(RVD['negligible'] & LUI['moderate'] & CONNECT['low'], CONDITION['moderate'])
-        rule23 = ctrl.Rule(RVD['negligible'] & LUI['moderate'] & CONNECT['high'], CONDITION['good'])
-
-        rca_ctrl = ctrl.ControlSystem([rule0, rule1, rule2, rule3, rule4, rule5, rule6, rule6_1, rule7, rule8, rule9, rule10, rule11, rule12, rule13, rule14, rule15, rule16, rule17, rule18, rule19, rule20, rule21, rule22, rule23])
-        rca_fis = ctrl.ControlSystemSimulation(rca_ctrl)
-
-        # Defuzzify
-        out = np.zeros(len(RVDarray))
-        for i in range(len(out)):
-            rca_fis.input["input1"] = RVDarray[i]
-            rca_fis.input["input2"] = LUIarray[i]
-            rca_fis.input["input3"] = CONNECTarray[i]
-            rca_fis.compute()
-            out[i] = rca_fis.output["result"]
-
-        # save the output text file and merge to network
-        fid = np.arange(0, len(out), 1)
-        columns = np.column_stack((fid, out))
-        out_table = os.path.dirname(fcOut) + "/RCA_Table.txt"
-        np.savetxt(out_table, columns, delimiter=",", header="ID, COND_VAL", comments="")
-
-        final_table = scratch + "/final_table.dbf"
-        arcpy.CopyRows_management(out_table, final_table)
-
-        arcpy.JoinField_management(rca_u, "FID", final_table, "ID", "COND_VAL")
-        rca_u_final = scratch + "/rca_u_final.shp"
-        arcpy.CopyFeatures_management(rca_u, rca_u_final)
+def assess_condition(fcOut, seg_network, frag_valley, inputs, confin_thresh, rca_out_dir, outName,
+                     fis_surface_resolution=None, fis_cache_folder=None, sensitivity_samples=None,
+                     sensitivity_spread=None, sensitivity_processes=None):
+    """
+    Writes the model inputs to the RCA input network, calculates riparian condition for each reach and writes the
+    output network
+    :param fcOut: RCA input network (a copy of the segmented network with NATIV_DEP and CONF_RATIO fields)
+    :param seg_network: Segmented stream network the output network is copied from
+    :param frag_valley: Fragmented valley bottom shapefile
+    :param inputs: List of arrays of values for each reach for each of INPUT_FIELDS
+    :param confin_thresh: Confinement threshold for calculating riparian condition
+    :param rca_out_dir: RCA analysis folder
+    :param outName: Name for output network
+    :param fis_surface_resolution: See main
+    :param fis_cache_folder: See main
+    :param sensitivity_samples: See main
+    :param sensitivity_spread: See main
+    :param sensitivity_processes: See main
+    :return: Output network with Riparian Condition fields
+    """
+    lui, connect, ex_vegetated, hist_vegetated, veg = inputs
+    n_reaches = len(lui)
+    input_table = make_reach_table(n_reaches, [(field, np.float64) for field in INPUT_FIELDS])
+    for field, values in zip(INPUT_FIELDS, [lui, connect, ex_vegetated, hist_vegetated, veg]):
+        input_table[field] = values
+    write_reach_table(fcOut, input_table)
+
+    network_fields = arcpy.da.FeatureClassToNumPyArray(fcOut, ["FID", "NATIV_DEP", "CONF_RATIO"])
+    network_fields = network_fields[np.argsort(network_fields["FID"])]
+    nativ_dep = network_fields["NATIV_DEP"].astype(np.float64)
+    unconfined = network_fields["CONF_RATIO"] < float(confin_thresh)
 
-    else:
+    # # # calculate rca for segments in unconfined valleys # # #
+    arcpy.AddMessage("Calculating riparian condition for segments in unconfined valleys...")
+    if not unconfined.any():
         raise Exception("There are no 'unconfined' segments to assess using FIS. Lower width threshold parameter.")
 
-    # # # calculate rca for segments in confined valleys # # #
-    arcpy.AddMessage("Calculating riparian condition for segments in confined valleys...")
-    arcpy.SelectLayerByAttribute_management("rca_in_lyr", "NEW_SELECTION", '"CONF_RATIO" >= {0}'.format(confin_thresh))
-    #arcpy.SelectLayerByAttribute_management("rca_in_lyr", "NEW_SELECTION", """ Con_Type == "BOTH" """)
-    arcpy.FeatureClassToFeatureClass_conversion("rca_in_lyr", scratch, "rca_c.shp")
-    rca_c = scratch + "/rca_c.shp"
-
-    arcpy.AddField_management(rca_c, "CONDITION", "TEXT")
-    cursor = arcpy.da.UpdateCursor(rca_c, ["LUI", "CONNECT", "VEG", "CONDITION"])
-    for row in cursor:
-        if row[0] <= 0.04 and row[1] == 1 and row[2] > 0.8:
-            row[3] = "Confined - Unimpacted"
+    # fix values outside of range of membership functions (fixed values are written to the output)
+    for values in [nativ_dep, lui, connect]:
+        values[unconfined & (values < 0)] = 0.01
+        values[unconfined & (values > 1)] = 1
+    RVDarray = nativ_dep[unconfined]
+    LUIarray = lui[unconfined]
+    CONNECTarray = connect[unconfined]
+
+    # set up FIS
+    rca_fis = build_rca_fis()
+
+    # Defuzzify
+    if fis_surface_resolution is None:
+        out = rca_fis.evaluate(RVDarray, LUIarray, CONNECTarray)
+    else:
+        # evaluate the FIS once on a regular grid of inputs and interpolate condition for each reach
+        fis_surface_resolution = int(fis_surface_resolution)
+        arcpy.AddMessage("Getting FIS surface ({0} x {0} x {0})...".format(fis_surface_resolution))
+        if fis_cache_folder is None:
+            surface = build_surface(rca_fis.evaluate, fis_surface_resolution)
         else:
-            row[3] = "Confined - Impacted"
-        cursor.updateRow(row)
+            surface = cached_surface(rca_fis, fis_surface_resolution, fis_cache_folder)
+        out = interpolate_surface(surface, RVDarray, LUIarray, CONNECTarray)
+        max_error = surface_error(surface, rca_fis.evaluate, RVDarray, LUIarray, CONNECTarray)
+        arcpy.AddMessage("Maximum FIS surface interpolation error on a sample of reaches: {0:.4f}".format(max_error))
+
+    sensitivity_fields = []
+    if sensitivity_samples is not None:
+        sensitivity_samples = int(sensitivity_samples)
+        spread = SENSITIVITY_SPREAD if sensitivity_spread is None else float(sensitivity_spread)
+        processes = 1 if sensitivity_processes is None else int(sensitivity_processes)
+        arcpy.AddMessage("Running FIS sensitivity analysis ({0} parameter sets)...".format(sensitivity_samples))
+        if processes > 1 and os.name == "nt":
+            # ArcMap runs tools in its own executable, so pool workers have to be started with python.exe
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+        cond_mean, cond_sd, cond_percentiles = evaluate_sensitivity(
+            rca_fis, [RVDarray, LUIarray, CONNECTarray], sensitivity_samples, spread, SENSITIVITY_PERCENTILES,
+            n_processes=processes)
+        sensitivity_fields = ["COND_MEAN", "COND_SD"] + ["COND_P{0:02d}".format(p) for p in SENSITIVITY_PERCENTILES]
+        sensitivity_values = [cond_mean, cond_sd] + list(cond_percentiles.T)
+
+    # output attributes for every reach (confined reaches keep a condition value of 0)
+    rca_table = make_reach_table(n_reaches, [("NATIV_DEP", np.float64)] +
+                                 [(field, np.float64) for field in INPUT_FIELDS] +
+                                 [("COND_VAL", np.float64), ("CONDITION", "U50")] +
+                                 [(field, np.float64) for field in sensitivity_fields])
+    rca_table["NATIV_DEP"] = nativ_dep
+    for field, values in zip(INPUT_FIELDS, [lui, connect, ex_vegetated, hist_vegetated, veg]):
+        rca_table[field] = values
+    rca_table["COND_VAL"][unconfined] = out
+    for field, values in zip(sensitivity_fields, sensitivity_values):
+        rca_table[field][unconfined] = values
+
+    # If any segments are found outside of the valley bottom, set the fields to a NoData value
+    arcpy.AddMessage("Cleaning up and saving final output...")
+    arcpy.MakeFeatureLayer_management(fcOut, "outlyr")
+    arcpy.SelectLayerByLocation_management("outlyr", "HAVE_THEIR_CENTER_IN", frag_valley)
+    arcpy.SelectLayerByLocation_management("outlyr", selection_type="SWITCH_SELECTION")
+    outside_valley = np.zeros(n_reaches, dtype=bool)
+    outside_valley[[row[0] for row in arcpy.da.SearchCursor("outlyr", "FID")]] = True
+    arcpy.Delete_management("outlyr")
 
+    # add final condition category for each segment, including segments in confined valleys
+    condition_codes, _ = classify_condition(rca_table["COND_VAL"], ~unconfined, outside_valley, lui, connect, veg)
+    rca_table["CONDITION"] = CONDITION_LABELS[condition_codes]
+    for field in ["COND_VAL", "LUI", "EX_VEG", "HIST_VEG", "VEG"] + sensitivity_fields:
+        rca_table[field][outside_valley] = -9999
 
-    # merge the results of the rca for confined and unconfined valleys
+    # write the output network
     if not outName.endswith(".shp"):
         outName = outName+".shp"
-    tempOut = os.path.join(rca_out_dir, "tempout.shp")
     output = os.path.join(rca_out_dir, outName)
+    arcpy.CopyFeatures_management(seg_network, output)
+    write_reach_table(output, rca_table)
 
-    arcpy.Merge_management([rca_u_final, rca_c], tempOut)
+    return output
 
-    # add final condition category for each segment
-    cursor = arcpy.da.UpdateCursor(tempOut, ["COND_VAL", "CONDITION"])
-    for row in cursor:
-        if row[0] == 0:
-            pass
-        elif row[0] > 0 and row[0] <= 0.2:
-            row[1] = "Very Poor"
-        elif row[0] > 0.2 and row[0] <= 0.4:
-            row[1] = "Poor"
-        elif row[0] > 0.4 and row[0] <= 0.65:
-            row[1] = "Moderate"
-        elif row[0] > 0.65 and row[0] <= 0.85:
-            row[1] = "Good"
-        elif row[0] > 0.85:
-            row[1] = "Intact"
-        cursor.updateRow(row)
 
+def classify_condition(cond_val, confined, outside_valley, lui, connect, veg):
+    """
+    Assigns condition categories: segments in unconfined valleys by condition value, segments in confined valleys by
+    whether they are unimpacted (low land use intensity, fully connected floodplain and little vegetation loss)
+    :param cond_val: Array of condition values for each reach (0 for reaches in confined valleys)
+    :param confined: Boolean array, True for reaches in confined valleys
+    :param outside_valley: Boolean array, True for reaches outside of the valley bottom
+    :param lui: Array of land use intensity for each reach
+    :param connect: Array of floodplain connectivity for each reach
+    :param veg: Array of vegetation departure (existing / historic vegetated proportion) for each reach
+    :return: Array of condition codes for each reach, and dictionary of condition labels for each code
+    """
+    unconfined_codes = np.digitize(cond_val, CONDITION_BREAKS, right=True) + 1
+    unimpacted = (lui <= 0.04) & (connect == 1) & (veg > 0.8)
+    codes = np.select([outside_valley, cond_val > 0, confined & unimpacted, confined],
+                      [8, unconfined_codes, 6, 7], default=0)
+    return codes, CONDITION_TYPES
 
-    # If any segments are found outside of the valley bottom, set the fields to a NoData value
-    arcpy.AddMessage("Cleaning up and saving final output...")
-    arcpy.MakeFeatureLayer_management(tempOut, "outlyr")
-    arcpy.SelectLayerByLocation_management("outlyr", "HAVE_THEIR_CENTER_IN", frag_valley)
-    arcpy.SelectLayerByLocation_management("outlyr", selection_type="SWITCH_SELECTION")
-    getcount = arcpy.GetCount_management("outlyr")
-    count = int(getcount.getOutput(0))
-    if count != 0:
-        cursor = arcpy.da.UpdateCursor("outlyr", ["COND_VAL", "CONDITION", "LUI", "EX_VEG", "HIST_VEG", "VEG"])
-        for row in cursor:
-            row[0] = -9999
-            row[1] = "None"
-            row[2] = -9999
-            row[3] = -9999
-            row[4] = -9999
-            row[5] = -9999
-            cursor.updateRow(row)
-        del row
-        del cursor
-    arcpy.SelectLayerByAttribute_management("outlyr", "CLEAR_SELECTION")
-    arcpy.CopyFeatures_management("outlyr", output)
-
-    # temp output and environment clean up
-    arcpy.Delete_management(tempOut)
-    #arcpy.Delete_management(fcOut)
-    arcpy.Delete_management(out_table)
-    arcpy.CheckInExtension('spatial')
 
-    # make layers
-    arcpy.AddMessage("Making layers...")
-    make_layers(fcOut, intermediates_folder)
-    
-    # write xml
-    arcpy.AddMessage("Writing XML file. NOTE: This is the final step and non-critical to the outputs")
-    try:
-        write_xml(projName, hucID, hucName, projPath, ex_veg, hist_veg, seg_network, frag_valley, lg_river, dredge_tailings, confin_thresh, output)
-    except Exception:
-        arcpy.AddMessage("Writing the XML file has failed, but RVD outputs are saved. This is a known bug in RCAT and you can proceed to the next step without problems.")
-    
+def build_rca_fis(exact_centroid=True):
+    """
+    Builds the riparian condition fuzzy inference system from RCA_FIS_INPUTS, RCA_FIS_OUTPUT and RCA_FIS_RULES
+    :param exact_centroid: If True, condition is the exact centroid of the aggregated output rather than the centroid
+    sampled on RCA_FIS_UNIVERSE (as skfuzzy computes it)
+    :return: FIS with inputs "input1" (NATIV_DEP), "input2" (LUI), "input3" (CONNECT) and output "result" (condition)
+    """
+    return MamdaniFIS(RCA_FIS_INPUTS, RCA_FIS_OUTPUT, RCA_FIS_RULES, RCA_FIS_UNIVERSE, exact_centroid)
+
+
+def check_fis(n_samples=1000, seed=0):
+    """
+    Checks that the riparian condition FIS gives the same condition as skfuzzy (which RCA used to evaluate the FIS
+    with) for random inputs, to within SKFUZZY_TOLERANCE. Needs scikit-fuzzy.
+    :param n_samples: Number of random inputs
+    :param seed: Seed for drawing the inputs
+    """
+    difference = build_rca_fis().skfuzzy_difference(n_samples, seed)
+    if not difference < SKFUZZY_TOLERANCE:
+        raise Exception("ERROR: RCA FIS differs from skfuzzy by up to {0} (tolerance {1})".format(difference,
+                                                                                             SKFUZZY_TOLERANCE))
+    print("RCA FIS matches skfuzzy for {0} random inputs (largest difference {1})".format(n_samples, difference))
 
-def check_fields(frag_valley, seg_network, ex_veg, hist_veg):
+
+def check_fields(frag_valley, seg_network, ex_veg, hist_veg, rvd_fields=True):
     # make sure that the fragmented valley input has a field called "connected"
     valley_fields = [f.name for f in arcpy.ListFields(frag_valley)]
     missing_fields = []
@@ -314,7 +382,7 @@ def check_fields(frag_valley, seg_network, ex_veg, hist_veg):
         missing_fields.append("Valley input has no field 'Connected'")
     # double check that input network has "NATIV_DEP" field from RVD
     network_fields = [f.name for f in arcpy.ListFields(seg_network)]
-    if "NATIV_DEP" not in network_fields:
+    if rvd_fields and "NATIV_DEP" not in network_fields:
         missing_fields.append("Network has no field 'NATIV_DEP'. Rerun RVD on network")
     # double check that input existing veg has a "LU_CODE" field
     ex_veg_fields = [f.name for f in arcpy.ListFields(ex_veg)]
@@ -326,6 +394,9 @@ def check_fields(frag_valley, seg_network, ex_veg, hist_veg):
     hist_veg_fields = [f.name for f in arcpy.ListFields(hist_veg)]
     if "VEGETATED" not in hist_veg_fields:
         missing_fields.append("Field 'VEGETATED' must be added to historic vegetation raster before RCA can be run")
+    if not same_grid(hist_veg, ex_veg):
+        arcpy.AddMessage("WARNING: Historic vegetation raster is not on the same grid (cell size, alignment and coordinate "
+                         + "system) as the existing vegetation raster, so it will be resampled onto the existing vegetation grid")
     # return messages for each missing field and then raise exception to stop script
     if len(missing_fields) > 0:
         i = 0
@@ -401,62 +472,59 @@ def create_thiessen_polygons_in_valley(seg_network, valley, intermediates_folder
     return thiessen_valley, valley_buf
 
 
-def calc_lui(ex_veg, thiessen_valley, intermediates_folder, fcOut):
-    lui_lookup = Lookup(ex_veg, "LU_CODE")
-    lui_zs = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", lui_lookup, "lui_zs", statistics_type="MEAN")
+def calc_lui(lui_lookup, zone_grid, intermediates_folder):
     ex_veg_folder = os.path.join(intermediates_folder, "03_VegetationRasters", "01_Ex_Veg")
-    lui_lookup.save(ex_veg_folder + "/Land_Use_Intensity.tif")
-    arcpy.JoinField_management(fcOut, "FID", lui_zs, "RCH_FID", "MEAN")
-    arcpy.AddField_management(fcOut, "LUI", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(fcOut, ["MEAN", "LUI"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
+    zone_grid.save(lui_lookup, ex_veg_folder + "/Land_Use_Intensity.tif")
+    return reach_lui(zonal_mean(zone_grid.zones(), lui_lookup, zone_grid.n_zones))
 
-    arcpy.DeleteField_management(fcOut, "MEAN")
 
-    return
+def reach_lui(lui_means):
+    """
+    :param lui_means: Array of mean land use intensity (LU_CODE) for each reach
+    :return: Array of land use intensity for each reach, with 0 for reaches without data
+    """
+    lui = np.array(lui_means, dtype=np.float64)
+    lui[np.isnan(lui)] = 0
+    return lui
 
 
-def calc_connectivity(frag_valley, thiessen_valley, fcOut, dredge_tailings, ex_veg, intermediates_folder, scratch):
-    # set raster environment
-    arcpy.env.extent = ex_veg
-    arcpy.env.snapRaster = ex_veg
-    
+def calc_connectivity(frag_valley, dredge_tailings, zone_grid, intermediates_folder):
+    """
+    Calculates the proportion of each reach's thiessen polygon that is connected floodplain, from the fragmented valley
+    "Connected" field burned onto the zone grid (dredge tailings count as disconnected)
+    :param frag_valley: Fragmented valley bottom shapefile with a "Connected" field
+    :param dredge_tailings: Dredge tailings polygon shapefile (optional)
+    :param zone_grid: ZoneGrid of thiessen polygons on the vegetation grid
+    :param intermediates_folder: Intermediates folder the floodplain connectivity raster is saved in
+    :return: Array of floodplain connectivity for each reach
+    """
     # set up folder structure
     connect_folder = os.path.join(intermediates_folder, find_available_num_prefix(intermediates_folder)+ "_Connectivity")
     make_folder(connect_folder)
-    if dredge_tailings is not None:
-        fp_conn = scratch + '/fp_conn'
-        arcpy.PolygonToRaster_conversion(frag_valley, "Connected", fp_conn, "", "", 10)
-
-        dredge_tailings_dissolved = arcpy.Dissolve_management(dredge_tailings)
-        arcpy.env.extent = thiessen_valley
-        dredge_tailings_raster = ExtractByMask(fp_conn, dredge_tailings_dissolved)
-
-        dredge_tailings_reclass = Reclassify(dredge_tailings_raster, "VALUE", "0 8; 1 8; NODATA 0")
-        connect_mine_calc = dredge_tailings_reclass + fp_conn
-        fp_conn_out = Reclassify(connect_mine_calc, "VALUE", "0 0; 1 1; 8 0; 9 0")
-        fp_conn_out.save(connect_folder + '/Floodplain_Connectivity.tif')
-    else:
-        fp_conn_out = connect_folder + '/Floodplain_Connectivity.tif'
-        arcpy.PolygonToRaster_conversion(frag_valley, "Connected", fp_conn_out, "", "", 10)
 
-    fp_conn_zs = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", fp_conn_out, "fp_conn_zs", statistics_type="MEAN")
+    fp_conn = zone_grid.read(rasterize_polygons(frag_valley, zone_grid, "in_memory/fp_conn", "Connected"), -1)
+    arcpy.Delete_management("in_memory/fp_conn")
+    if dredge_tailings is not None:
+        dredge_tailings_raster = rasterize_polygons(dredge_tailings, zone_grid, "in_memory/dredge_tailings")
+        dredge_tailings_mask = zone_grid.read(dredge_tailings_raster, -1) >= 0
+        arcpy.Delete_management("in_memory/dredge_tailings")
+        fp_conn[dredge_tailings_mask & (fp_conn >= 0)] = 0
+    zone_grid.save(fp_conn, connect_folder + '/Floodplain_Connectivity.tif', -1)
 
-    arcpy.JoinField_management(fcOut, "FID", fp_conn_zs, "RCH_FID", "MEAN")
-    arcpy.AddField_management(fcOut, "CONNECT", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(fcOut, ["MEAN", "CONNECT"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
+    return reach_connectivity(zonal_mean(zone_grid.zones(), np.where(fp_conn >= 0, fp_conn, np.nan), zone_grid.n_zones))
 
-    arcpy.DeleteField_management(fcOut, "MEAN")
 
-    return
+def reach_connectivity(connect_means):
+    """
+    :param connect_means: Array of mean floodplain connectivity (1 connected, 0 disconnected) for each reach
+    :return: Array of floodplain connectivity for each reach, with 0 for reaches without any connectivity cells
+    """
+    connect = np.array(connect_means, dtype=np.float64)
+    connect[np.isnan(connect)] = 0
+    return connect
 
 
-def calc_veg(ex_veg, hist_veg, thiessen_valley, intermediates_folder, fcOut):
+def calc_veg(exveg_lookup, histveg_lookup, zone_grid, intermediates_folder):
     # set up vegetation intermediates folder structure
     veg_rasters_folder = intermediates_folder + "/03_VegetationRasters"
     ex_veg_folder = veg_rasters_folder + "/01_Ex_Veg"
@@ -465,47 +533,28 @@ def calc_veg(ex_veg, hist_veg, thiessen_valley, intermediates_folder, fcOut):
     for f in folders:
         if not os.path.exists(f):
             os.mkdir(f)
-    # make lookup raster for existing and historic VEGETATED
-    exveg_lookup = Lookup(ex_veg, "VEGETATED")
-    exveg_lookup.save(ex_veg_folder+"/Existing_Vegetated.tif")
-    histveg_lookup = Lookup(hist_veg, "VEGETATED")
-    histveg_lookup.save(hist_veg_folder+"/Hist_Vegetated.tif")
-
-    exveg_zs = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", exveg_lookup, "exveg_zs", statistics_type="MEAN")
-    histveg_zs = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", histveg_lookup, "histveg_zs", statistics_type="MEAN")
-
-    arcpy.JoinField_management(fcOut, "FID", exveg_zs, "RCH_FID", "MEAN")
-    arcpy.AddField_management(fcOut, "EX_VEG", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(fcOut, ["MEAN", "EX_VEG"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-        if row[1] == 0:
-            row[1] = 0.0001
-        cursor.updateRow(row)
-
-    arcpy.DeleteField_management(fcOut, "MEAN")
-
-    arcpy.JoinField_management(fcOut, "FID", histveg_zs, "RCH_FID", "MEAN")
-    arcpy.AddField_management(fcOut, "HIST_VEG", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(fcOut, ["MEAN", "HIST_VEG"])
-    for row in cursor:
-        row[1] = row[0]
-        cursor.updateRow(row)
-        if row[1] == 0:
-            row[1] = 0.0001
-        cursor.updateRow(row)
-
-    arcpy.DeleteField_management(fcOut, "MEAN")
-
-    arcpy.AddField_management(fcOut, "VEG", "DOUBLE")
-    cursor = arcpy.da.UpdateCursor(fcOut, ["EX_VEG", "HIST_VEG", "VEG"])
-    for row in cursor:
-        row[2] = row[0] / row[1]
-        cursor.updateRow(row)
+    # save lookup rasters for existing and historic VEGETATED
+    zone_grid.save(exveg_lookup, ex_veg_folder+"/Existing_Vegetated.tif")
+    zone_grid.save(histveg_lookup, hist_veg_folder+"/Hist_Vegetated.tif")
 
+    return reach_vegetated(zonal_mean(zone_grid.zones(), exveg_lookup, zone_grid.n_zones),
+                           zonal_mean(zone_grid.zones(), histveg_lookup, zone_grid.n_zones))
 
-    return
+
+def reach_vegetated(ex_means, hist_means):
+    """
+    :param ex_means: Array of mean existing VEGETATED for each reach
+    :param hist_means: Array of mean historic VEGETATED for each reach
+    :return: Arrays of existing proportion vegetated, historic proportion vegetated and vegetation departure (existing /
+    historic) for each reach
+    """
+    # reaches with no data or no vegetation get a small value to avoid division issues
+    ex_vegetated = np.array(ex_means, dtype=np.float64)
+    ex_vegetated[np.isnan(ex_vegetated) | (ex_vegetated == 0)] = 0.0001
+    hist_vegetated = np.array(hist_means, dtype=np.float64)
+    hist_vegetated[np.isnan(hist_vegetated) | (hist_vegetated == 0)] = 0.0001
+
+    return ex_vegetated, hist_vegetated, ex_vegetated / hist_vegetated
 
 
 def make_layers(out_network, intermediates_folder):
@@ -829,6 +878,10 @@ def make_folder(folder):
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "check_fis":
+        # python RCA.py check_fis [number of random inputs]
+        check_fis(*[int(arg) for arg in sys.argv[2:3]])
+        sys.exit()
     main(sys.argv[1],
         sys.argv[2],
         sys.argv[3],
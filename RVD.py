@@ -25,8 +25,102 @@ import projectxml
 import uuid
 import datetime
 import shutil
-from SupportingFunctions import  find_available_num_prefix, make_layer
-
+from SupportingFunctions import  find_available_num_prefix, make_layer, get_zone_raster, ZoneGrid, zone_class_histogram, \
+    zonal_band_sums, AttributeLookup, make_reach_table, write_reach_table, rasterize_polygons, compile_remap, apply_remap, \
+    same_grid, snap_to_grid, RASTER_NODATA
+
+# conversion type field suffixes, in the column order used to flag conversion types (no change first)
+CONVERSION_FIELD_SUFFIXES = ["noch", "decid", "grsh", "deveg", "conif", "inv", "dev", "agr", "exp"]
+# conversion raster value for each conversion type, in the same order as the field suffixes
+CONVERSION_VALUES = [0, 35, 50, 60, 80, 97, 98, 99, -50]
+# riparian conversion value for each difference between historic and existing CONVERSION values; differences that
+# aren't riparian conversions are listed under None and get NODATA in the conversion raster
+CONVERSION_REMAP = {
+    0: [0], # no change
+    35: [35], # conversion to deciduous forest
+    50: [50], # conversion to grass/shrubland
+    60: [60], # devegetation
+    80: [80], # conifer encroachment
+    97: [97], # conversion to invasive
+    98: [98], # development
+    99: [99], # conversion to agriculture
+    -50: [-80, -60, -50, -35], # riparian expansion
+    None: [-480, -460, -450, -435, -400, -115, -64, -63, -62, -49, -48, -47, -45, -39, -38, -37, -30, -25, -20, -19,
+           -18, -17, -10, 5, 10, 17, 18, 19, 20, 25, 30, 37, 38, 39, 45, 47, 48, 49, 62, 63, 64, 400, 435, 450, 460,
+           480, 497, 498, 499]}
+CONVERSION_REMAP_OFFSET, CONVERSION_REMAP_LUT = compile_remap(CONVERSION_REMAP)
+# vegetation raster attributes used by RVD
+VEG_FIELDS = ["RIPARIAN", "NATIVE_RIP", "CONVERSION"]
+# lookups that departure is calculated from, with their existing mean, historic mean and departure fields
+DEPARTURE_FIELDS = [("RIPARIAN", "ExRip_Mean", "HsRip_Mean", "RIPAR_DEP"),
+                    ("NATIVE_RIP", "ExNtv_Mean", "HsNtv_Mean", "NATIV_DEP")]
+# existing and historic vegetation lookups RCA needs, summarized in the same sweep when RVD and RCA are run together
+RCA_EX_FIELDS = ["LU_CODE", "VEGETATED"]
+RCA_HIST_FIELDS = ["VEGETATED"]
+# approximate peak memory (bytes) per grid cell for each vegetation raster held while processing a window
+WINDOW_BYTES_PER_CELL = 64
+# memory ceiling (MB) for processing the vegetation rasters if none is given; a 32-bit python (e.g., ArcMap's foreground
+# geoprocessing) can address about 2 GB
+VEG_MEMORY_MB = 1024 if sys.maxsize <= 2 ** 32 else 8192
+# first conversion code for each conversion type (excluding no change); magnitude is added to this code
+CONVERSION_BASE_CODES = np.array([80, 10, 20, 30, 40, 50, 60, 70], dtype=np.float64)
+# upper proportion limits for very minor, minor and moderate conversions; anything above is significant
+CONVERSION_MAGNITUDE_BREAKS = np.array([0.10, 0.25, 0.5])
+# conversion code to conversion type label
+CONVERSION_TYPES = {
+    0: "Multiple Dominant Conversion Types",
+    1: "No Change",
+    10: "Very Minor Change",
+    11: "Minor Change", #Conversion to Grass/Shrubland"
+    12: "Moderate Conversion to Grass/Shrubland",
+    13: "Significant Conversion to Grass/Shrubland",
+    20: "Very Minor Change",
+    21: "Minor Change", #Devegetation"
+    22: "Moderate Devegetation",
+    23: "Significant Devegetation",
+    30: "Very Minor Change",
+    31: "Minor Change", #Conifer Encroachment"
+    32: "Moderate Conifer Encroachment",
+    33: "Significant Conifer Encroachment",
+    40: "Very Minor Change",
+    41: "Minor Change", #Conversion to Invasive"
+    42: "Moderate Conversion to Invasive",
+    43: "Significant Conversion to Invasive",
+    50: "Very Minor Change",
+    51: "Minor Change", #Development"
+    52: "Moderate Development",
+    53: "Significant Development",
+    60: "Very Minor Change",
+    61: "Minor Change", #Conversion to Agriculture"
+    62: "Moderate Conversion to Agriculture",
+    63: "Significant Conversion to Agriculture",
+    70: "Very Minor Change",
+    71: "Minor Change", #Riparian Expansion"
+    72: "Moderate Riparian Expansion",
+    73: "Significant Riparian Expansion",
+    80: "Very Minor Change",
+    81: "Minor Change", #Conversion to Deciduous Forest"
+    82: "Moderate Conversion to Deciduous Forest",
+    83: "Significant Conversion to Deciduous Forest",
+    100: "No Riparian Vegetation Detected"}
+# categorical lookup array so conversion type labels can be indexed directly by conversion code
+CONV_TYPE_LABELS = np.array([CONVERSION_TYPES.get(code, "") for code in range(max(CONVERSION_TYPES) + 1)], dtype=object)
+# RVD fields added to the output network and their types, in output field order
+REACH_FIELDS = [("ExRip_Mean", np.float64), ("HsRip_Mean", np.float64), ("RIPAR_DEP", np.float64),
+                ("ExNtv_Mean", np.float64), ("HsNtv_Mean", np.float64), ("NATIV_DEP", np.float64),
+                ("COUNT", np.int32), ("count_calc", np.int32)]
+for suffix in CONVERSION_FIELD_SUFFIXES:
+    REACH_FIELDS += [("sum_" + suffix, np.float64), ("prop_" + suffix, np.float64)]
+REACH_FIELDS += [("conv_code", np.float64), ("Conv_Type", "U50")]
+# RVD fields calculated from existing vegetation only; all other fields are repeated for each historic baseline
+EX_REACH_FIELDS = ["ExRip_Mean", "ExNtv_Mean"]
+# fields set to NoData (-9999) for reaches outside of the valley bottom
+OUTSIDE_VALLEY_FIELDS = ["RIPAR_DEP", "NATIV_DEP", "conv_code", "ExRip_Mean", "HsRip_Mean", "ExNtv_Mean", "HsNtv_Mean",
+                         "COUNT", "sum_noch", "sum_grsh", "sum_deveg", "sum_conif", "sum_inv", "sum_dev", "sum_agr",
+                         "prop_noch", "prop_grsh", "prop_deveg", "prop_conif", "prop_inv", "prop_dev", "prop_agr",
+                         "prop_exp", "count_calc"]
+# historic baselines are numbered 2-9 in scenario field names, so shapefile field names stay within 10 characters
+MAX_HIST_BASELINES = 9
 
 def main(
     projName,
@@ -39,20 +133,29 @@ def main(
     valley,
     lg_river,
     dredge_tailings,
-    outName):
+    outName,
+    memory_limit=None,
+    rca_inputs=False):
     """ Calculates riparian vegetation departure for a stream network
     :param projName: Project name for XML metadata
     :param hucID: Huc ID for XML metadata
     :param hucName: Huc name for XML metadata
     :param projPath: RCAT project folder
     :param ex_veg: Existing vegetation raster
-    :param hist_veg: Historic vegetation raster
+    :param hist_veg: Historic vegetation raster, or list of historic vegetation rasters to compare existing vegetation
+    against (semicolon-delimited if given as a string). RVD fields for the first baseline keep their usual names, and
+    fields for each other baseline end in its number (e.g., RIPAR_DEP2).
     :param seg_network: Segmented network shapefile
     :param valley: Valley bottom shapefile
     :param lg_river: Large rivers polygon shapefile (optional)
     :param dredge_tailings: Dredge tailings polygon shapefile (optional)
     :param outName: Name for output network
-    return: Output network with RVD fields
+    :param memory_limit: Memory ceiling in MB for processing the vegetation rasters (optional; defaults to VEG_MEMORY_MB)
+    :param rca_inputs: If True, the per-reach vegetation means and floodplain connectivity RCA needs are also calculated
+    in the vegetation raster sweep (for running RVD and RCA together; the valley bottom must be the fragmented valley
+    bottom, with a "Connected" field)
+    return: Output network with RVD fields, ZoneGrid of thiessen polygons, and dictionary of RCA vegetation means and
+    floodplain connectivity for each reach (None unless rca_inputs is True)
     """
     # make clean temporary directory
     scratch = projPath + '/Temp'
@@ -67,7 +170,10 @@ def main(
 
     # check inputs
     arcpy.AddMessage("Validating inputs...")
-    validate_inputs(ex_veg, hist_veg, seg_network, valley, lg_river, dredge_tailings)
+    hist_vegs = parse_hist_baselines(hist_veg)
+    for hist_veg in hist_vegs:
+        validate_inputs(ex_veg, hist_veg, seg_network, valley, lg_river, dredge_tailings)
+    n_scenarios = len(hist_vegs)
 
     # create clean outputs and intermediates folders
     arcpy.AddMessage("Building output folder structure...")
@@ -76,67 +182,71 @@ def main(
     # create thiessen polygons and clip to fragmented valley bottom
     arcpy.AddMessage("Creating thiessen polygons...")
     thiessen_valley, valley_buf = create_thiessen_polygons_in_valley(seg_network, valley, intermediates_folder, scratch)
-    # create lookup tables for existing and historic veg scores
-    # create folder structure
-    arcpy.AddMessage("Creating vegetation lookup rasters...")
+    # create folder structure for vegetation rasters
     veg_rasters_folder = os.path.join(intermediates_folder, "03_VegetationRasters")
-    ex_veg_lookup_folder = os.path.join(veg_rasters_folder, "01_Ex_Veg")
-    hist_veg_lookup_folder = os.path.join(veg_rasters_folder, "02_Hist_Veg")
-    folders = [veg_rasters_folder, ex_veg_lookup_folder, hist_veg_lookup_folder]
+    lookup_folders = {"ex": os.path.join(veg_rasters_folder, "01_Ex_Veg"),
+                      "hist": [os.path.join(veg_rasters_folder, "02_Hist_Veg" + scenario_suffix(scenario, "_"))
+                               for scenario in range(n_scenarios)]}
+    folders = [veg_rasters_folder, lookup_folders["ex"]] + lookup_folders["hist"]
     for f in folders:
         make_folder(f)
-    # make lookup rasters
-    ex_riparian, ex_native = make_veg_lookup_rasters(ex_veg, ex_veg_lookup_folder, type="ex_veg")
-    hist_riparian, hist_native = make_veg_lookup_rasters(hist_veg, hist_veg_lookup_folder, type="hist_veg")
-        
-    # reclassify areas within dredge tailings polygons
-    if dredge_tailings is not None:
-        arcpy.AddMessage("Reclassifying vegetation within dredge tailings...")
-        ex_riparian, ex_native = vegetation_adjustment(dredge_tailings, ex_veg, ex_riparian, ex_native, thiessen_valley, scratch, ex_veg_lookup_folder, "Ex", "DrgTailngs")
+    # get thiessen polygons rasterized onto the vegetation grid (cached per project) so reach statistics can be calculated from arrays
+    n_reaches = int(arcpy.GetCount_management(tempOut).getOutput(0))
+    zone_grid = ZoneGrid(get_zone_raster(thiessen_valley, "RCH_FID", ex_veg), n_reaches)
 
-    # reclassify areas within the large river polygon
+    # rasterize dredge tailings and large river polygons so vegetation within them can be reclassified
+    # (dredge tailings are only applied to existing vegetation; large rivers are applied to both)
+    adjustments = []
+    if dredge_tailings is not None:
+        arcpy.AddMessage("Rasterizing dredge tailings...")
+        adjustments.append(("DrgTailngs", rasterize_polygons(dredge_tailings, zone_grid, os.path.join(scratch, "DrgTailngs.tif")), ["ex"]))
     if lg_river is not None:
-        arcpy.AddMessage("Reclassifying vegetation within large river polygons...")
-        ex_riparian, ex_native = vegetation_adjustment(lg_river, ex_veg, ex_riparian, ex_native, thiessen_valley, scratch, ex_veg_lookup_folder, "Ex", "LgRiver")
-        hist_riparian, hist_native = vegetation_adjustment(lg_river, hist_veg, hist_riparian, hist_native, thiessen_valley, scratch, hist_veg_lookup_folder, "Hist", "LgRiver")
-
-    # calculate overall riparian vegetation departure
-    arcpy.AddMessage("Calculating overall riparian vegetation departure...")
-    ex_rip_field = calc_veg_mean_per_reach(thiessen_valley, ex_riparian, "ex", "rip", tempOut)
-    hist_rip_field = calc_veg_mean_per_reach(thiessen_valley, hist_riparian, "hs", "rip", tempOut)
-    arcpy.AddField_management(tempOut, "RIPAR_DEP", "DOUBLE")
-    arcpy.AddMessage("Updating Riparian veg field...")
-    with arcpy.da.UpdateCursor(tempOut, [ex_rip_field, hist_rip_field, "RIPAR_DEP"]) as cursor:
-        for counter, row in enumerate(cursor):
-            if counter % 100 == 0:
-                arcpy.AddMessage("\tDone {}".format(counter))
-            row[2] = row[0] / row[1]
-            cursor.updateRow(row)
-            if row[2] > 1 and row[1] == 0.0001:
-                row[2] = 1
-            cursor.updateRow(row)
-
-    # calculate native riparian vegetation departure
-    ex_native_field = calc_veg_mean_per_reach(thiessen_valley, ex_native, "ex", "ntv", tempOut)
-    hist_native_field = calc_veg_mean_per_reach(thiessen_valley, hist_native, "hs", "ntv", tempOut)
-    arcpy.AddField_management(tempOut, "NATIV_DEP", "DOUBLE")
-    arcpy.AddMessage("Updating Native veg field...")
-    with arcpy.da.UpdateCursor(tempOut, [ex_native_field, hist_native_field, "NATIV_DEP"]) as cursor:
-        for counter, row in enumerate(cursor):
-            if counter % 100 == 0:
-                arcpy.AddMessage("\tDone {}".format(counter))
-            row[2] = row[0] / row[1]
-            cursor.updateRow(row)
-            if row[2] > 1 and row[1] == 0.0001:
-                row[2] = 1
-            cursor.updateRow(row)
-
-    # calculate riparian conversions
+        arcpy.AddMessage("Rasterizing large river polygons...")
+        adjustments.append(("LgRiver", rasterize_polygons(lg_river, zone_grid, os.path.join(scratch, "LgRiver.tif")), ["ex", "hist"]))
+
+    # rasterize the fragmented valley bottom's "Connected" field so floodplain connectivity can be summed in the same sweep
+    connectivity = None
+    if rca_inputs:
+        arcpy.AddMessage("Rasterizing floodplain connectivity...")
+        connect_folder = os.path.join(intermediates_folder, find_available_num_prefix(intermediates_folder) + "_Connectivity")
+        make_folder(connect_folder)
+        connectivity = (rasterize_polygons(valley, zone_grid, os.path.join(scratch, "fp_conn.tif"), "Connected"),
+                        os.path.join(connect_folder, "Floodplain_Connectivity.tif"))
+
+    # calculate vegetation departure and conversion counts for each reach
+    arcpy.AddMessage("Calculating vegetation statistics for each reach...")
+    if memory_limit is not None:
+        memory_limit = float(memory_limit)
+    departures, conversion_counts, rca_means = calc_reach_veg_stats(ex_veg, hist_vegs, zone_grid, adjustments, valley_buf,
+                                                                    veg_rasters_folder, lookup_folders, scratch,
+                                                                    memory_limit, rca_inputs, connectivity)
+
+    # per-reach RVD attributes are staged in memory and written to the output network once all are calculated
+    reach_table = make_reach_table(n_reaches, reach_fields(n_scenarios))
+    for scenario in range(n_scenarios):
+        if n_scenarios > 1:
+            arcpy.AddMessage("Historic baseline {}: {}".format(scenario + 1, hist_vegs[scenario]))
+        # add overall and native riparian vegetation departure (existing veg means are shared by all baselines)
+        for field in departures[scenario]:
+            if scenario == 0 or field not in EX_REACH_FIELDS:
+                reach_table[scenario_field(field, scenario)] = departures[scenario][field]
+
+        # calculate riparian conversions
+        arcpy.AddMessage("Calculating riparian vegetation conversion types...")
+        calc_conversion_types(conversion_counts[scenario], reach_table, scenario)
+
+    # set NoData values for reaches without riparian vegetation or outside of the valley bottom
+    arcpy.AddMessage("Handling NoData...")
+    handle_nodata_reaches(reach_table, tempOut, valley, n_scenarios)
+
+    # write all RVD fields to output network
+    arcpy.AddMessage("Writing output network...")
     if not outName.endswith(".shp"):
         outName = outName+".shp"
     fcOut = os.path.join(analysis_folder, outName) # specify output path
-    arcpy.AddMessage("Calculating riparian vegetation conversion types...")
-    calculate_riparian_conversion(ex_veg, hist_veg, valley_buf, valley, thiessen_valley, tempOut, fcOut, intermediates_folder, scratch)
+    write_reach_table(tempOut, reach_table)
+    arcpy.CopyFeatures_management(tempOut, fcOut)
+    arcpy.Delete_management(tempOut)
 
     # make layers
     arcpy.AddMessage("Making layers...")
@@ -145,10 +255,12 @@ def main(
     # write XML file
     arcpy.AddMessage("Writing XML file. NOTE: This is the final step and non-critical to the outputs")
     try:
-        write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network, lg_river, dredge_tailings, intermediates_folder, analysis_folder)
+        write_xml(projPath, projName, hucID, hucName, ex_veg, hist_vegs, seg_network, lg_river, dredge_tailings, intermediates_folder, analysis_folder)
     except Exception:
         arcpy.AddMessage("Writing the XML file has failed, but RVD outputs are saved. This is a known bug in RCAT and you can proceed to the next step without problems.")
 
+    return fcOut, zone_grid, rca_means
+
 
 def validate_inputs(ex_veg, hist_veg, seg_network, valley, lg_river, dredge_tailings):
     # Checks if the spatial references are correct and that the inputs are what we want
@@ -167,6 +279,10 @@ def validate_inputs(ex_veg, hist_veg, seg_network, valley, lg_river, dredge_tail
     if not arcpy.Describe(hist_veg).spatialReference.name == network_sr.name:
         #raise Exception("Input historic vegetation raster must have the same coordinate system as input network for accurate calculations.")
         arcpy.AddMessage("WARNING: Input historic vegetation raster must have the same coordinate system as the input network for accurate calculations!")
+    if not same_grid(hist_veg, ex_veg):
+        arcpy.AddMessage("WARNING: Input historic vegetation raster " + os.path.basename(hist_veg) + " is not on the same "
+                         + "grid (cell size, alignment and coordinate system) as the existing vegetation raster, so it will "
+                         + "be resampled onto the existing vegetation grid")
     if lg_river is not None:
         if not arcpy.Describe(lg_river).spatialReference.name == network_sr.name:
             #raise Exception("Input large river polygon must have the same coordinate system as input network for accurate calculations.")
@@ -195,6 +311,53 @@ def validate_inputs(ex_veg, hist_veg, seg_network, valley, lg_river, dredge_tail
         raise Exception("ERROR: Add required attributes (listed above) to vegetation data before running RVD.")
 
 
+def parse_hist_baselines(hist_veg):
+    """
+    Splits historic vegetation input into a list of historic baselines
+    :param hist_veg: Historic vegetation raster, list of rasters, or semicolon-delimited string of rasters
+    :return: List of historic vegetation rasters
+    """
+    if isinstance(hist_veg, (list, tuple)):
+        hist_vegs = list(hist_veg)
+    else:
+        hist_vegs = [path.strip().strip("'\"") for path in hist_veg.split(";") if path.strip() != ""]
+    if len(hist_vegs) > MAX_HIST_BASELINES:
+        raise Exception("ERROR: RVD can compare existing vegetation against at most " + str(MAX_HIST_BASELINES) + " historic vegetation baselines.")
+    return hist_vegs
+
+
+def scenario_suffix(scenario, separator=""):
+    """
+    :param scenario: Index of historic baseline
+    :param separator: Text to put before the baseline number
+    :return: Suffix for names of outputs for a historic baseline (empty for the first baseline)
+    """
+    if scenario == 0:
+        return ""
+    return separator + str(scenario + 1)
+
+
+def scenario_field(field, scenario):
+    """
+    :param field: RVD field name
+    :param scenario: Index of historic baseline
+    :return: Field name for a historic baseline, shortened to fit in a shapefile field name
+    """
+    suffix = scenario_suffix(scenario)
+    return field[:10-len(suffix)] + suffix
+
+
+def reach_fields(n_scenarios):
+    """
+    :param n_scenarios: Number of historic baselines
+    :return: List of RVD fields and their types for all historic baselines, in output field order
+    """
+    fields = list(REACH_FIELDS)
+    for scenario in range(1, n_scenarios):
+        fields += [(scenario_field(field, scenario), field_type) for field, field_type in REACH_FIELDS if field not in EX_REACH_FIELDS]
+    return fields
+
+
 def build_output_folder(projPath, seg_network):
     # make master output folder if not present
     master_outputs_folder = os.path.join(projPath, "Outputs")
@@ -297,493 +460,338 @@ def create_thiessen_polygons_in_valley(seg_network, valley, intermediates_folder
     return thiessen_valley, valley_buf
 
 
-def make_veg_lookup_rasters(veg, folder, type):
-    if type=="ex_veg":
+def calc_reach_veg_stats(ex_veg, hist_vegs, zone_grid, adjustments, valley_buf, veg_rasters_folder, lookup_folders, scratch, memory_limit=None, rca_inputs=False, connectivity=None):
+    """
+    Calculates vegetation departure and conversion counts for each reach, reading the vegetation rasters in windows of rows.
+    Existing vegetation is only read and summarized once, however many historic baselines it is compared against.
+    :param ex_veg: Existing vegetation raster
+    :param hist_vegs: List of historic vegetation rasters (historic baselines)
+    :param zone_grid: ZoneGrid of thiessen polygons on the vegetation grid
+    :param adjustments: List of (polygon type, rasterized polygons, vegetation types to adjust) for vegetation adjustments
+    :param valley_buf: Buffered valley bottom polygon
+    :param veg_rasters_folder: Folder for riparian and conversion rasters
+    :param lookup_folders: Dictionary of lookup raster folder for existing vegetation ("ex") and list of folders for
+    historic baselines ("hist")
+    :param scratch: Scratch folder
+    :param memory_limit: Memory ceiling in MB for processing the vegetation rasters (optional; defaults to
+    VEG_MEMORY_MB). The rasters are processed in windows that fit within it, and full-extent intermediate rasters are
+    only saved if the whole grid fits in a single window.
+    :param rca_inputs: If True, also calculates the mean of the RCA lookups (existing LU_CODE and VEGETATED, and
+    VEGETATED of the first historic baseline) for each reach, from the unadjusted vegetation, and the proportion of
+    each reach's floodplain that is connected
+    :param connectivity: Rasterized "Connected" field of the fragmented valley bottom and path to save the floodplain
+    connectivity raster to (needed if rca_inputs is True); dredge tailings count as disconnected floodplain
+    :return: List of dictionaries of veg mean and departure fields to arrays of values for each reach, list of arrays
+    (reaches x conversion types) of conversion counts, each with one entry for each historic baseline, and dictionary
+    of RCA lookup means ("LU_CODE", "EX_VEGETATED", "HIST_VEGETATED") and floodplain connectivity ("CONNECT") for
+    each reach, with NaN for reaches without data (None unless rca_inputs is True)
+    """
+    n_reaches = zone_grid.n_zones
+    n_scenarios = len(hist_vegs)
+    ex_lookup = AttributeLookup(ex_veg, VEG_FIELDS + (RCA_EX_FIELDS if rca_inputs else []))
+    # historic baselines on another grid than existing vegetation (which the zone grid is snapped to) are resampled onto it
+    hist_lookups = [AttributeLookup(hist_veg, VEG_FIELDS + (RCA_HIST_FIELDS if rca_inputs and scenario == 0 else []),
+                                    snap_to_grid(hist_veg, ex_veg, os.path.join(scratch, "hist_veg" + scenario_suffix(scenario) + ".tif")))
+                    for scenario, hist_veg in enumerate(hist_vegs)]
+    if memory_limit is None:
+        memory_limit = VEG_MEMORY_MB
+    # the existing vegetation lookups are kept while each historic baseline is processed
+    window_rows = min(zone_grid.window_rows(memory_limit, 2 * WINDOW_BYTES_PER_CELL), zone_grid.nrows)
+    save_rasters = window_rows == zone_grid.nrows
+    if not save_rasters:
+        arcpy.AddMessage("\t Processing vegetation rasters {} of {} rows at a time...".format(window_rows, zone_grid.nrows))
+        arcpy.AddMessage("\t Vegetation lookup, riparian and conversion rasters will not be saved")
+
+    # per-reach sums and counts (lookups x reaches) of existing vegetation and each historic baseline, added to for each window
+    n_lookups = len(DEPARTURE_FIELDS)
+    ex_sums, ex_counts = np.zeros((n_lookups, n_reaches)), np.zeros((n_lookups, n_reaches), dtype=np.int64)
+    hist_sums = [np.zeros((n_lookups, n_reaches)) for scenario in range(n_scenarios)]
+    hist_counts = [np.zeros((n_lookups, n_reaches), dtype=np.int64) for scenario in range(n_scenarios)]
+    conversion_counts = [np.zeros((n_reaches, len(CONVERSION_VALUES)), dtype=np.int64) for scenario in range(n_scenarios)]
+    # (RCA lookups are followed by floodplain connectivity)
+    n_rca_lookups = len(RCA_EX_FIELDS) + len(RCA_HIST_FIELDS) + 1 if rca_inputs else 0
+    rca_sums, rca_counts = np.zeros((n_rca_lookups, n_reaches)), np.zeros((n_rca_lookups, n_reaches), dtype=np.int64)
+
+    for row_start, nrows in zone_grid.blocks(window_rows):
+        zones = zone_grid.zone_block(row_start, nrows)
+        ex_block = ex_lookup.read_block(zone_grid, row_start, nrows)
+        if save_rasters:
+            save_lookup_rasters(ex_block, zone_grid, lookup_folders["ex"], "ex")
+            if rca_inputs:
+                save_rca_lookup_rasters(ex_block, zone_grid, lookup_folders["ex"], "ex")
+        masks = read_adjustment_masks(adjustments, zone_grid, row_start, nrows)
+        if rca_inputs:
+            fp_conn = connectivity_block(connectivity[0], masks, zone_grid, row_start, nrows)
+            if save_rasters:
+                zone_grid.save(fp_conn, connectivity[1], -1)
+            connect_band = np.where(fp_conn >= 0, fp_conn, np.nan).astype(np.float32)
+            del fp_conn # clear up memory
+        # reclassify areas within dredge tailings and large river polygons; conversions still use the unadjusted lookups
+        ex_adjusted = dict((lookup_field, ex_block[lookup_field].copy()) for lookup_field in ["RIPARIAN", "NATIVE_RIP"])
+        adjust_vegetation_block(ex_adjusted, masks, "ex", zone_grid, lookup_folders["ex"], save_rasters)
+        ex_bands = [ex_adjusted[fields[0]] for fields in DEPARTURE_FIELDS]
+
+        for scenario in range(n_scenarios):
+            hist_block = hist_lookups[scenario].read_block(zone_grid, row_start, nrows)
+            if save_rasters:
+                save_lookup_rasters(hist_block, zone_grid, lookup_folders["hist"][scenario], "hist")
+                if rca_inputs and scenario == 0:
+                    save_rca_lookup_rasters(hist_block, zone_grid, lookup_folders["hist"][scenario], "hist")
+            # conversions are calculated from the unadjusted lookups
+            all_riparian, conversion = riparian_conversion(ex_block, hist_block)
+            conversion_counts[scenario] += zone_class_histogram(zones, conversion, n_reaches, CONVERSION_VALUES)
+            if save_rasters:
+                save_conversion_rasters(all_riparian, conversion, zone_grid, valley_buf, veg_rasters_folder, scratch, scenario_suffix(scenario, "_"))
+            del all_riparian, conversion # clear up memory
+            # reclassify areas within large river polygons
+            adjust_vegetation_block(hist_block, masks, "hist", zone_grid, lookup_folders["hist"][scenario], save_rasters)
+            hist_bands = [hist_block[fields[0]] for fields in DEPARTURE_FIELDS]
+            # sum existing (first baseline only) and historic lookups for each reach in a single sweep, along with the
+            # unadjusted RCA lookups if needed
+            if scenario == 0:
+                rca_bands = []
+                if rca_inputs:
+                    # (large river adjustments only change RIPARIAN and NATIVE_RIP, so these are unadjusted)
+                    rca_bands = [ex_block[field] for field in RCA_EX_FIELDS] + [hist_block[field] for field in RCA_HIST_FIELDS] \
+                                + [connect_band]
+                sums, counts = zonal_band_sums(zones, ex_bands + hist_bands + rca_bands, n_reaches)
+                ex_sums += sums[:n_lookups]
+                ex_counts += counts[:n_lookups]
+                hist_sums[scenario] += sums[n_lookups:2 * n_lookups]
+                hist_counts[scenario] += counts[n_lookups:2 * n_lookups]
+                rca_sums += sums[2 * n_lookups:]
+                rca_counts += counts[2 * n_lookups:]
+            else:
+                sums, counts = zonal_band_sums(zones, hist_bands, n_reaches)
+                hist_sums[scenario] += sums
+                hist_counts[scenario] += counts
+            del hist_block, hist_bands # clear up memory
+
+    departures = [calc_departures(ex_sums, ex_counts, hist_sums[scenario], hist_counts[scenario]) for scenario in range(n_scenarios)]
+    rca_means = None
+    if rca_inputs:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = rca_sums / rca_counts
+        rca_means = dict(zip(["LU_CODE", "EX_VEGETATED", "HIST_VEGETATED", "CONNECT"], means))
+        if not save_rasters:
+            # the floodplain connectivity raster is saved from a second (cheaper) pass over just the polygon rasters
+            zone_grid.save_blocks(((row_start, connectivity_block(connectivity[0], read_adjustment_masks(adjustments, zone_grid, row_start, nrows),
+                                                                  zone_grid, row_start, nrows))
+                                   for row_start, nrows in zone_grid.blocks(window_rows)), connectivity[1], -1)
+    return departures, conversion_counts, rca_means
+
+
+def read_adjustment_masks(adjustments, zone_grid, row_start, nrows):
+    """
+    Reads a block of rows of each rasterized vegetation adjustment polygon as a mask
+    :param adjustments: List of (polygon type, rasterized polygons, vegetation types to adjust) for vegetation adjustments
+    :param zone_grid: ZoneGrid of thiessen polygons on the vegetation grid
+    :param row_start: First row of the block
+    :param nrows: Number of rows in the block
+    :return: List of (polygon type, boolean mask of cells within the polygons, vegetation types to adjust)
+    """
+    return [(polygon_type, zone_grid.read_block(polygon_raster, row_start, nrows, -1) >= 0, veg_types)
+            for polygon_type, polygon_raster, veg_types in adjustments]
+
+
+def connectivity_block(connect_raster, masks, zone_grid, row_start, nrows):
+    """
+    Reads a block of rows of floodplain connectivity, counting dredge tailings as disconnected
+    :param connect_raster: Rasterized "Connected" field of the fragmented valley bottom
+    :param masks: Vegetation adjustment masks for the block (see read_adjustment_masks)
+    :param zone_grid: ZoneGrid of thiessen polygons on the vegetation grid
+    :param row_start: First row of the block
+    :param nrows: Number of rows in the block
+    :return: Array of 1 for connected and 0 for disconnected floodplain, with -1 outside the valley bottom
+    """
+    fp_conn = zone_grid.read_block(connect_raster, row_start, nrows, -1)
+    for polygon_type, mask, veg_types in masks:
+        if polygon_type == "DrgTailngs":
+            fp_conn[mask & (fp_conn >= 0)] = 0
+    return fp_conn
+
+
+def adjust_vegetation_block(lookups, masks, veg_type, zone_grid, folder, save_rasters):
+    for polygon_type, mask, veg_types in masks:
+        if veg_type in veg_types:
+            vegetation_adjustment(mask, lookups)
+            if save_rasters:
+                save_adjusted_rasters(lookups, zone_grid, folder, veg_type, polygon_type)
+
+
+def save_lookup_rasters(lookups, zone_grid, folder, veg_type):
+    if veg_type == "ex":
         prefix = "Existing"
+        cover_name = "Ex_Cover.tif"
     else:
         prefix = "Historic"
-    # make riparian lookup raster and save
-    riparian = Lookup(veg, "RIPARIAN")
-    riparian.save(os.path.join(folder, prefix + "_Riparian.tif"))
-    # make native lookup raster and save
-    native = Lookup(veg, "NATIVE_RIP")
-    native.save(os.path.join(folder, prefix + "_NativeRiparian.tif"))
-    return riparian, native
-
-
-def vegetation_adjustment(polygons, veg_raster, riparian, native, thiessen_valley, scratch, veg_folder, veg_type, polygon_type):
-    # set raster environment for mask
-    arcpy.env.extent = thiessen_valley
-    arcpy.env.snapRaster = veg_raster
-    # dissolve polygons into single feature
-    polygons_dissolved = os.path.join(scratch, polygon_type+'_dissolved.shp')
-    arcpy.Dissolve_management(polygons, polygons_dissolved)
-    # extract raster values within polygon feature
-    raster_in_polygons = ExtractByMask(veg_raster, polygons_dissolved)
-    # set all values within extracted raster to 0 (i.e., not riparian or native riparian)
-    cursor = arcpy.UpdateCursor(raster_in_polygons)
-    for row in cursor:
-        row.setValue("RIPARIAN", 0)
-        row.setValue("NATIVE_RIP", 0)
-        cursor.updateRow(row)
-    del cursor, row
-    # merge reclassified raster with original rasters
-    riparian = reclassify_adjusted_veg(raster_in_polygons, riparian, "RIPARIAN", veg_type+"_Riparian_"+polygon_type, veg_folder)
-    native = reclassify_adjusted_veg(raster_in_polygons, native, "NATIVE_RIP", veg_type+"_Native_"+polygon_type, veg_folder)
-    return riparian, native
-    
+        cover_name = "Hist_Cover.tif"
+    zone_grid.save(lookups["RIPARIAN"], os.path.join(folder, prefix + "_Riparian.tif"))
+    zone_grid.save(lookups["NATIVE_RIP"], os.path.join(folder, prefix + "_NativeRiparian.tif"))
+    zone_grid.save(lookups["CONVERSION"], os.path.join(folder, cover_name))
 
-def reclassify_adjusted_veg(masked_raster, veg_lookup, field_name, out_name, folder):
-    masked_raster_lookup = Lookup(masked_raster, field_name)
-    masked_raster_reclass = Reclassify(masked_raster_lookup, "VALUE", "0 8; NODATA 0")
-    raster_adjustment = masked_raster_reclass + veg_lookup
-    adjusted_raster_output = Reclassify(raster_adjustment, "VALUE", "0 0; 1 1; 8 0; 9 0")
-    adjusted_raster_output.save(os.path.join(folder, out_name + ".tif"))
-    return adjusted_raster_output
 
+def save_rca_lookup_rasters(lookups, zone_grid, folder, veg_type):
+    if veg_type == "ex":
+        zone_grid.save(lookups["LU_CODE"], os.path.join(folder, "Land_Use_Intensity.tif"))
+        zone_grid.save(lookups["VEGETATED"], os.path.join(folder, "Existing_Vegetated.tif"))
+    else:
+        zone_grid.save(lookups["VEGETATED"], os.path.join(folder, "Hist_Vegetated.tif"))
 
-def calc_veg_mean_per_reach(thiessen_valley, veg_lookup, veg_type, out_type, tempOut):
 
-    arcpy.AddMessage("Calculating veg mean for {} {}".format(veg_type, out_type))
-    # set raster environment for mask
-    arcpy.env.extent = thiessen_valley
-    arcpy.env.snapRaster = veg_lookup
-    # calculate proportion of area with coded vegetation (riparian or native riparian) for each reach based on thiessen polygons
-    # Note: since raster values are 0 and 1, "MEAN" is the same as the proportion of area for all values=1
-    arcpy.AddMessage("\t Doing zonal stats...")
-    veg_zs = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", veg_lookup, veg_type+"_veg_zs_"+out_type, statistics_type="MEAN")
-    # add existing veg field to temp output by reach ids & calculate based on joined zonal stats
-    arcpy.JoinField_management(tempOut, "FID", veg_zs, "RCH_FID", "MEAN")
-    veg_field = veg_type.capitalize() + out_type.capitalize() + "_Mean"
-    arcpy.AddField_management(tempOut, veg_field, "DOUBLE")
-    arcpy.AddMessage("\t Updating veg field...")
-    with arcpy.da.UpdateCursor(tempOut, ["MEAN", veg_field]) as cursor:
-        for counter, row in enumerate(cursor):
-            if counter % 100 == 0:
-                arcpy.AddMessage("\t\tDone {}".format(counter))
-            row[1] = row[0]
-            cursor.updateRow(row)
-            if row[1] == 0:
-                row[1] = 0.0001
-            cursor.updateRow(row)
-    arcpy.DeleteField_management(tempOut, "MEAN")
-    return veg_field
-
-
-def calculate_riparian_conversion(ex_veg, hist_veg, valley_buf, valley, thiessen_valley, tempOut, fcOut, intermediates_folder, scratch):
-    # set extent for all rasters
-    arcpy.env.extent = 'MAXOF'
-    arcpy.env.snapRaster = ex_veg
-    # setting folder paths
-    ex_veg_lookup_folder = os.path.join(intermediates_folder, "03_VegetationRasters/01_Ex_Veg")
-    hist_veg_lookup_folder = os.path.join(intermediates_folder, "03_VegetationRasters/02_Hist_Veg")
-    # create existing and historic rasters based on vegetation "conversion" fields
-    arcpy.AddMessage('\t Creating Lookups...')
-    ex_veg_conversion_lookup = Lookup(ex_veg, "CONVERSION")
-    ex_veg_conversion_lookup.save(os.path.join(ex_veg_lookup_folder, "Ex_Cover.tif"))
-    hist_conversion_lookup = Lookup(hist_veg, "CONVERSION")
-    hist_conversion_lookup.save(os.path.join(hist_veg_lookup_folder, "Hist_Cover.tif"))
-    # create change raster by substracting existing from historic
-    arcpy.AddMessage('\t Creating Conversion Raster...')
-    conversion_raster = hist_conversion_lookup - ex_veg_conversion_lookup
-    int_conversion_raster = Int(conversion_raster)
-
-    # get raster of pixels with historic or existing riparian
-    arcpy.AddMessage('\t Creating Lookups...')
-    ex_riparian_lookup = Lookup(ex_veg, "RIPARIAN")
-    hist_riparian_lookup = Lookup(hist_veg, "RIPARIAN")
-    arcpy.AddMessage('\t Creating Riparian Raster...')
-    riparian_sum = ex_riparian_lookup + hist_riparian_lookup
-    all_riparian = Reclassify(riparian_sum, "VALUE", "0 NODATA; 1 1; 2 2", "NODATA")
-    all_riparian.save(os.path.join(os.path.dirname(ex_veg_lookup_folder), "All_Riparian_recl.tif"))
-    riparian_conversion_raster = ExtractByMask(int_conversion_raster, all_riparian)
-
-    arcpy.AddMessage('\t Reclassifying data...')
-    # reclassify change raster to include only values pertaining to riparian conversion; all non-riparian conversion gets a NODATA value
-    remap = "-480 NODATA; -460 NODATA; -450 NODATA; -435 NODATA; -400 NODATA; -80 -50; -64 NODATA; -63 NODATA; -62 NODATA; -60 -50; -50 -50; -47 NODATA; -48 NODATA; -49 NODATA; " \
-            "-45 NODATA; -37 NODATA; -38 NODATA; -39 NODATA; -35 -50; -30 NODATA; -25 NODATA; -20 NODATA; -19 NODATA; -18 NODATA; -17 NODATA; -115 NODATA; 17 NODATA; 18 NODATA; 5 NODATA; " \
-            "-10 NODATA; 0 0; 10 NODATA; 19 NODATA; 20 NODATA; 25 NODATA; 30 NODATA; 37 NODATA; 38 NODATA; 39 NODATA; 45 NODATA; 47 NODATA; 48 NODATA; 49 NODATA; 62 NODATA; 63 NODATA; " \
-            "64 NODATA; 400 NODATA; 435 NODATA; 450 NODATA; 460 NODATA; 480 NODATA; 497 NODATA; 498 NODATA; 499 NODATA; 35 35; 50 50; 60 60; 80 80; 97 97; 98 98; 99 99"
-    final_conversion_raster = Reclassify(riparian_conversion_raster, "VALUE", remap, "NODATA")
-    # make list of all values in conversion raster
-    valueList = []
-    cursor = arcpy.SearchCursor(final_conversion_raster)
-    for row in cursor:
-        valueList.append(row.getValue("VALUE"))
-    del cursor
-
-    arcpy.AddMessage('\t Creating Individual Conversion Rasters...')
-
-    # make individual rasters for each conversion value - value gets a "1", everything else is "NODATA"
-    if 0 in valueList:
-        conversion_0 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 1; 35 NODATA; 50 NODATA; 60 NODATA; 80 NODATA; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_0 = None
-    if 35 in valueList:
-        conversion_35 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 1; 50 NODATA; 60 NODATA; 80 NODATA; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_35 = None
-    if 50 in valueList:
-        conversion_50 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 1; 60 NODATA; 80 NODATA; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_50 = None
-    if 60 in valueList:
-        conversion_60 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 NODATA; 60 1; 80 NODATA; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_60 = None
-    if 80 in valueList:
-        conversion_80 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 NODATA; 60 NODATA; 80 1; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_80 = None
-    if 97 in valueList:
-        conversion_97 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 NODATA; 60 NODATA; 80 NODATA; 97 1; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_97 = None
-    if 98 in valueList:
-        conversion_98 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 NODATA; 60 NODATA; 80 NODATA; 97 NODATA; 98 1; 99 NODATA", "NODATA")
-    else:
-        conversion_98 = None
-    if 99 in valueList:
-        conversion_99 = Reclassify(final_conversion_raster, "VALUE", "-50 NODATA; 0 NODATA; 35 NODATA; 50 NODATA; 60 NODATA; 80 NODATA; 97 NODATA; 98 NODATA; 99 1", "NODATA")
-    else:
-        conversion_99 = None
-    if -50 in valueList:
-        conversion_min50 = Reclassify(final_conversion_raster, "VALUE", "-50 1; 0 NODATA; 35 NODATA; 50 NODATA; 60 NODATA; 80 NODATA; 97 NODATA; 98 NODATA; 99 NODATA", "NODATA")
-    else:
-        conversion_min50 = None
-
-    # pull section of reclassified raster within buffered valley bottom and save
-    out_conversion_raster = ExtractByMask(final_conversion_raster, valley_buf)
-    out_conversion_raster.save(os.path.join(intermediates_folder, "03_VegetationRasters/Conversion_Raster.tif"))
-
-    # calculate total pixel count for each reach based on zonal stats within thiessen polygons
-    arcpy.AddMessage('\t Zonal Statistics per reach...')
-    count_table = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", final_conversion_raster, "count_table", statistics_type="VARIETY")
-    arcpy.JoinField_management(tempOut, "FID", count_table, "RCH_FID", "COUNT")
-    # add count field for calculations and set counts of 0 to 1 to avoid division issues
-    arcpy.AddField_management(tempOut, "count_calc", "SHORT")
-    with arcpy.da.UpdateCursor(tempOut, ["COUNT", "count_calc"]) as cursor:
-        for counter, row in enumerate(cursor):
-            if counter % 100 == 0:
-                arcpy.AddMessage("\t\tDone {}".format(counter))
-            row[1] = row[0]
-            cursor.updateRow(row)
-            if row[1] == 0:
-                row[1] = 1
-            cursor.updateRow(row)
+def riparian_conversion(ex_lookups, hist_lookups):
+    """
+    Finds riparian pixels and their riparian conversion values
+    :param ex_lookups: Dictionary of existing vegetation lookup arrays
+    :param hist_lookups: Dictionary of historic vegetation lookup arrays
+    :return: Array of riparian pixels (1 or 2, NaN elsewhere), array of riparian conversion values (NODATA elsewhere)
+    """
+    # create change array by substracting existing from historic vegetation "conversion" values
+    conversion = hist_lookups["CONVERSION"] - ex_lookups["CONVERSION"]
+    # get pixels with historic or existing riparian
+    riparian_sum = ex_lookups["RIPARIAN"] + hist_lookups["RIPARIAN"]
+    all_riparian = np.where((riparian_sum == 1) | (riparian_sum == 2), riparian_sum, np.nan)
+    # remap change values of riparian pixels to riparian conversion values; all non-riparian conversion gets a NODATA value
+    riparian_pixels = ~np.isnan(conversion) & ~np.isnan(all_riparian)
+    conversion_array = np.full(conversion.shape, RASTER_NODATA, dtype=np.int32)
+    conversion_array[riparian_pixels] = apply_remap(np.trunc(conversion[riparian_pixels]), CONVERSION_REMAP_OFFSET, CONVERSION_REMAP_LUT)
+    return all_riparian, conversion_array
+
+
+def save_conversion_rasters(all_riparian, conversion, zone_grid, valley_buf, veg_rasters_folder, scratch, suffix=""):
+    zone_grid.save(all_riparian, os.path.join(veg_rasters_folder, "All_Riparian_recl" + suffix + ".tif"))
+    # save section of conversion raster within buffered valley bottom
+    valley_raster = os.path.join(scratch, "valley_buf.tif")
+    if not arcpy.Exists(valley_raster):
+        rasterize_polygons(valley_buf, zone_grid, valley_raster)
+    valley_mask = zone_grid.read(valley_raster, -1) >= 0
+    zone_grid.save(np.where(valley_mask, conversion, RASTER_NODATA), os.path.join(veg_rasters_folder, "Conversion_Raster" + suffix + ".tif"))
+
+
+def vegetation_adjustment(mask, lookups):
+    """
+    Sets vegetation within polygons (e.g., dredge tailings or large rivers) to not riparian or native riparian,
+    modifying the lookup arrays in place
+    :param mask: Boolean array, True for cells within the polygons
+    :param lookups: Dictionary of vegetation lookup arrays, same shape as mask
+    """
+    for field in ["RIPARIAN", "NATIVE_RIP"]:
+        # NODATA cells within the polygons stay NODATA
+        lookups[field][mask & ~np.isnan(lookups[field])] = 0
 
+
+def save_adjusted_rasters(lookups, zone_grid, folder, veg_type, polygon_type):
+    prefix = veg_type.capitalize()
+    zone_grid.save(lookups["RIPARIAN"], os.path.join(folder, prefix + "_Riparian_" + polygon_type + ".tif"))
+    zone_grid.save(lookups["NATIVE_RIP"], os.path.join(folder, prefix + "_Native_" + polygon_type + ".tif"))
+
+
+def calc_departures(ex_sums, ex_counts, hist_sums, hist_counts):
+    """
+    Calculates existing and historic veg means and departure for each reach from per-reach lookup sums and counts
+    :param ex_sums: Array (lookups x reaches) of existing vegetation lookup sums, in DEPARTURE_FIELDS order
+    :param ex_counts: Array (lookups x reaches) of existing vegetation cell counts
+    :param hist_sums: Array (lookups x reaches) of historic vegetation lookup sums
+    :param hist_counts: Array (lookups x reaches) of historic vegetation cell counts
+    :return: Dictionary of veg mean and departure field to array of values for each reach
+    """
+    # calculate proportion of area with coded vegetation (riparian or native riparian) for each reach based on thiessen polygons
+    # Note: since lookup values are 0 and 1, the mean is the same as the proportion of area for all values=1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ex_means = ex_sums / ex_counts
+        hist_means = hist_sums / hist_counts
+    # reaches with no data or no coded vegetation get a small value to avoid division issues
+    for means in [ex_means, hist_means]:
+        means[np.isnan(means) | (means == 0)] = 0.0001
+    departure = ex_means / hist_means
+    # reaches with no historic vegetation can't have gained more than they had
+    departure[(departure > 1) & (hist_means == 0.0001)] = 1
+    departures = {}
+    for i, (lookup_field, ex_field, hist_field, departure_field) in enumerate(DEPARTURE_FIELDS):
+        departures[ex_field] = ex_means[i]
+        departures[hist_field] = hist_means[i]
+        departures[departure_field] = departure[i]
+    return departures
+
+
+def calc_conversion_types(conversion_counts, reach_table, scenario=0):
+    """
+    Calculates conversion proportions and flags the conversion type of each reach
+    :param conversion_counts: Array (reaches x conversion types) of conversion pixel counts
+    :param reach_table: Structured array of RVD attributes for each reach
+    :param scenario: Index of the historic baseline the conversions are for
+    """
     arcpy.AddMessage('\t Calculating proportions...')
-    # calculate count and proportion of each conversion type per reach and join to temporary output shp
-    calculate_conversion_proportion(conversion_0, thiessen_valley, tempOut, valueList, 0, "noch")
-    calculate_conversion_proportion(conversion_35, thiessen_valley, tempOut, valueList, 35, "decid")
-    calculate_conversion_proportion(conversion_50, thiessen_valley, tempOut, valueList, 50, "grsh")
-    calculate_conversion_proportion(conversion_60, thiessen_valley, tempOut, valueList, 60, "deveg")
-    calculate_conversion_proportion(conversion_80, thiessen_valley, tempOut, valueList, 80, "conif")
-    calculate_conversion_proportion(conversion_97, thiessen_valley, tempOut, valueList, 97, "inv")
-    calculate_conversion_proportion(conversion_98, thiessen_valley, tempOut, valueList, 98, "dev")
-    calculate_conversion_proportion(conversion_99, thiessen_valley, tempOut, valueList, 99, "agr")
-    calculate_conversion_proportion(conversion_min50, thiessen_valley, tempOut, valueList, -50, "exp")
-
-    arcpy.AddMessage('\t Creating arrays...')
-    # create numpy arrays for proportion of each conversion type
-    prop0_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_noch")
-    array0 = np.asarray(prop0_array, np.float64)
-    prop35_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_decid")
-    array35 = np.asarray(prop35_array, np.float64)
-    prop50_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_grsh")
-    array50 = np.asarray(prop50_array, np.float64)
-    prop60_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_deveg")
-    array60 = np.asarray(prop60_array, np.float64)
-    prop80_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_conif")
-    array80 = np.asarray(prop80_array, np.float64)
-    prop97_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_inv")
-    array97 = np.asarray(prop97_array, np.float64)
-    prop98_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_dev")
-    array98 = np.asarray(prop98_array, np.float64)
-    prop99_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_agr")
-    array99 = np.asarray(prop99_array, np.float64)
-    propMin50_array = arcpy.da.FeatureClassToNumPyArray(tempOut, "prop_exp")
-    arrayMin50 = np.asarray(propMin50_array, np.float64)
-    del prop0_array, prop50_array, prop60_array, prop80_array, prop97_array, prop98_array, prop99_array, propMin50_array # clear up memory
+    # total pixel count for each reach; counts of 0 are set to 1 to avoid division issues
+    count = conversion_counts.sum(axis=1)
+    count_calc = np.where(count == 0, 1, count)
+    props = conversion_counts / count_calc[:, np.newaxis].astype(np.float64)
+    reach_table[scenario_field("COUNT", scenario)] = count
+    reach_table[scenario_field("count_calc", scenario)] = count_calc
+    for i, suffix in enumerate(CONVERSION_FIELD_SUFFIXES):
+        reach_table[scenario_field("sum_" + suffix, scenario)] = conversion_counts[:, i]
+        reach_table[scenario_field("prop_" + suffix, scenario)] = props[:, i]
 
     # flag conversion type based on proportions of all conversions
-
     arcpy.AddMessage('\t Flagging Conversion types...')
-    out_conv_code = np.zeros(len(array0), dtype=np.float64)
-    for i in range(len(array0)):
-        if array0[i] >= 0.85:  # if no change proportion is greater than or equal to 0.9
-            out_conv_code[i] = 1  # no change
-        else:  # if no change proportion is less than 0.9, move on to next greatest proportion
-            if array35[i] > array50[i] and array35[i] > array60[i] and array35[i] > array80[i] and array35[i] > array97[i] and array35[i] > array98[i] and array35[i] > array99[i] and array35[i] > arrayMin50[i]:  # if deciduous/hardwood is next most dominant
-                if array35[i] <= 0.10:
-                    out_conv_code[i] = 80 # very minor conversion to deciduous/hardwood forest
-                elif array35[i] <= 0.25 and array35[i] > 0.1:
-                    out_conv_code[i] = 81  # minor conversion to deciduous/hardwood forest
-                elif array35[i] > 0.25 and array35[i] <= 0.5:
-                    out_conv_code[i] = 82  # moderate conversion to deciduous/hardwood forest
-                else:
-                    out_conv_code[i] = 83  # significant conversion to deciduous/hardwood forest
-            elif array50[i] > array35[i] and array50[i] > array60[i] and array50[i] > array80[i] and array50[i] > array97[i] and array50[i] > array98[i] and array50[i] > array99[i] and array50[i] > arrayMin50[i]:  # if grass/shrubland is next most dominant
-                if array50[i] <= 0.10:
-                    out_conv_code[i] = 10 # very minor conversion to grass/shrubland
-                elif array50[i] <= 0.25 and array50[i] > 0.1:
-                    out_conv_code[i] = 11  # minor conversion to grass/shrubland
-                elif array50[i] > 0.25 and array50[i] <= 0.5:
-                    out_conv_code[i] = 12  # moderate conversion to grass/shrubland
-                else:
-                    out_conv_code[i] = 13  # significant conversion to grass/shrubland
-            elif array60[i] > array35[i] and array60[i] > array50[i] and array60[i] > array80[i] and array60[i] > array97[i] and array60[i] > array98[i] and array60[i] > array99[i] and array60[i] > arrayMin50[i]:  # if barren is next most dominant
-                if array60[i] <= 0.10:
-                    out_conv_code[i] = 20 # very minor devegetation
-                elif array60[i] <= 0.25 and array60[i] > 0.1:
-                    out_conv_code[i] = 21  # minor devegetation
-                elif array60[i] > 0.25 and array60[i] <= 0.5:
-                    out_conv_code[i] = 22  # moderate devegetation
-                else:
-                    out_conv_code[i] = 23  # significant devegetation
-            elif array80[i] > array35[i] and array80[i] > array50[i] and array80[i] > array60[i] and array80[i] > array97[i] and array80[i] > array98[i] and array80[i] > array99[i] and array80[i] > arrayMin50[i]:  # if conifer encroachment is next most dominant
-                if array80[i] <= 0.10:
-                    out_conv_code[i] = 30 # very minor conifer encroachment
-                elif array80[i] <= 0.25 and array80[i] > 0.1:
-                    out_conv_code[i] = 31  # minor conifer encroachment
-                elif array80[i] > 0.25 and array80[i] <= 0.5:
-                    out_conv_code[i] = 32  # moderate conifer encroachment
-                else:
-                    out_conv_code[i] = 33  # significant conifer encroachment
-            elif array97[i] > array35[i] and array97[i] > array50[i] and array97[i] > array60[i] and array97[i] > array80[i] and array97[i] > array98[i] and array97[i] > array99[i] and array97[i] > arrayMin50[i]:  # if conversion to invasive is next most dominant
-                if array97[i] <= 0.10:
-                    out_conv_code[i] = 40 # very minor conversion to invasive
-                elif array97[i] <= 0.25 and array97[i] > 0.1:
-                    out_conv_code[i] = 41  # minor conversion to invasive
-                elif array97[i] > 0.25 and array97[i] <= 0.5:
-                    out_conv_code[i] = 42  # moderate conversion to invasive
-                else:
-                    out_conv_code[i] = 43  # significant conversion to invasive
-            elif array98[i] > array35[i] and array98[i] > array50[i] and array98[i] > array60[i] and array98[i] > array80[i] and array98[i] > array97[i] and array98[i] > array99[i] and array98[i] > arrayMin50[i]:  # if urbanization is next most dominant
-                if array98[i] <= 0.10:
-                    out_conv_code[i] = 50 # very minor urbanization
-                elif array98[i] <= 0.25 and array98[i] > 0.1:
-                    out_conv_code[i] = 51  # minor urbanization
-                elif array98[i] > 0.25 and array98[i] <= 0.5:
-                    out_conv_code[i] = 52  # moderate urbanization
-                else:
-                    out_conv_code[i] = 53  # significant urbanization
-            elif array99[i] > array35[i] and array99[i] > array50[i] and array99[i] > array60[i] and array99[i] > array80[i] and array99[i] > array97[i] and array99[i] > array98[i] and array99[i] > arrayMin50[i]:  # if conversion to agriculture is next most dominant
-                if array99[i] <= 0.10:
-                    out_conv_code[i] = 60 # very minor conversion to agriculture
-                elif array99[i] <= 0.25 and array99[i] > 0.1:
-                    out_conv_code[i] = 61  # minor conversion to agriculture
-                elif array99[i] > 0.25 and array99[i] <= 0.5:
-                    out_conv_code[i] = 62  # moderate conversion to agriculture
-                else:
-                    out_conv_code[i] = 63  # significant conversion to agriculture
-            elif arrayMin50[i] > array35[i] and arrayMin50[i] > array50[i] and arrayMin50[i] > array60[i] and arrayMin50[i] > array80[i] and arrayMin50[i] > array97[i] and arrayMin50[i] > array98[i] and arrayMin50[i] > array99[i]:  # if riparian expansion is next most dominant
-                if arrayMin50[i] <= 0.10:
-                    out_conv_code[i] = 70 # very minor riparian expansion
-                elif arrayMin50[i] <= 0.25 and arrayMin50[i] > 0.1:
-                    out_conv_code[i] = 71  # minor riparian expansion
-                elif arrayMin50[i] > 0.25 and arrayMin50[i] <= 0.5:
-                    out_conv_code[i] = 72  # moderate riparian expansion
-                else:
-                    out_conv_code[i] = 73  # significant riparian expansion
-            else:
-                out_conv_code[i] = 0
-
-    # save conversion types table
-    arcpy.AddMessage('\t Saving Conversion Tables...')
-    fid = np.arange(0, len(out_conv_code), 1)
-    columns = np.column_stack((fid, out_conv_code))
-    out_table = intermediates_folder + "/Conversion_Table.txt"
-    np.savetxt(out_table, columns, delimiter=",", header="FID, conv_code", comments="")
-
-    # not sure why these lines are needed- this is just taking a copy of the above table and deleting the previous
-    conv_code_table = scratch + "/conv_code_table" 
-    arcpy.CopyRows_management(out_table, conv_code_table)
-    arcpy.Delete_management(out_table)
-
-    arcpy.AddMessage('\t Updating Conversion Types...')
-    # join conversion types table to temp output shp
-    arcpy.JoinField_management(tempOut, "FID", conv_code_table, "FID", "conv_code")
-
-    # specify conversion type field based on conversion code from table
-    arcpy.AddField_management(tempOut, "Conv_Type", "text", "", "", 50)
-    with arcpy.da.UpdateCursor(tempOut, ["conv_code", "Conv_Type", "COUNT"]) as cursor:
-        for row in cursor:
-            if row[0] == 1:
-                row[1] = "No Change"
-            elif row[0] == 10:
-                row[1] = "Very Minor Change"
-            elif row[0] == 11:
-                row[1] = "Minor Change" #Conversion to Grass/Shrubland"
-            elif row[0] == 12:
-                row[1] = "Moderate Conversion to Grass/Shrubland"
-            elif row[0] == 13:
-                row[1] = "Significant Conversion to Grass/Shrubland"
-            elif row[0] == 20:
-                row[1] = "Very Minor Change"
-            elif row[0] == 21:
-                row[1] = "Minor Change" #Devegetation"
-            elif row[0] == 22:
-                row[1] = "Moderate Devegetation"
-            elif row[0] == 23:
-                row[1] = "Significant Devegetation"
-            elif row[0] == 30:
-                row[1] = "Very Minor Change"
-            elif row[0] == 31:
-                row[1] = "Minor Change" #Conifer Encroachment"
-            elif row[0] == 32:
-                row[1] = "Moderate Conifer Encroachment"
-            elif row[0] == 33:
-                row[1] = "Significant Conifer Encroachment"
-            elif row[0] == 40:
-                row[1] = "Very Minor Change"
-            elif row[0] == 41:
-                row[1] = "Minor Change" #Conversion to Invasive"
-            elif row[0] == 42:
-                row[1] = "Moderate Conversion to Invasive"
-            elif row[0] == 43:
-                row[1] = "Significant Conversion to Invasive"
-            elif row[0] == 50:
-                row[1] = "Very Minor Change"
-            elif row[0] == 51:
-                row[1] = "Minor Change" #Development"
-            elif row[0] == 52:
-                row[1] = "Moderate Development"
-            elif row[0] == 53:
-                row[1] = "Significant Development"
-            elif row[0] == 60:
-                row[1] = "Very Minor Change"
-            elif row[0] == 61:
-                row[1] = "Minor Change" #Conversion to Agriculture"
-            elif row[0] == 62:
-                row[1] = "Moderate Conversion to Agriculture"
-            elif row[0] == 63:
-                row[1] = "Significant Conversion to Agriculture"
-            elif row[0] == 70:
-                row[1] = "Very Minor Change"
-            elif row[0] == 71:
-                row[1] = "Minor Change" #Riparian Expansion"
-            elif row[0] == 72:
-                row[1] = "Moderate Riparian Expansion"
-            elif row[0] == 73:
-                row[1] = "Significant Riparian Expansion" 
-            elif row[0] == 80:
-                row[1] = "Very Minor Change"
-            elif row[0] == 81:
-                row[1] = "Minor Change" #Conversion to Deciduous Forest"
-            elif row[0] == 82:
-                row[1] = "Moderate Conversion to Deciduous Forest"
-            elif row[0] == 83:
-                row[1] = "Significant Conversion to Deciduous Forest"
-            elif row[0] == 0:
-                row[1] = "Multiple Dominant Conversion Types"
-            elif row[2] == 1:
-                if row[0] == 1:
-                    row[1] = "No Change"
-                else:
-                    row[0] = 90 # minor change with small sample size
-                    row[1] = "Very Minor Change" # minor change with small sample size
-            cursor.updateRow(row)
+    conv_code = classify_conversion(props)
+    reach_table[scenario_field("conv_code", scenario)] = conv_code
+    reach_table[scenario_field("Conv_Type", scenario)] = CONV_TYPE_LABELS[conv_code.astype(np.int64)]
 
-    arcpy.AddMessage('\t Handling NoData...')
-    # set everything with count 0 with nodata values, type as no riparian
-    with arcpy.da.UpdateCursor(tempOut, ["COUNT", "RIPAR_DEP", "NATIV_DEP", "conv_code", "Conv_Type", "ExRip_Mean",
-                                         "HsRip_Mean", "ExNtv_Mean", "HsNtv_Mean"]) as cursor:
-        for row in cursor:
-            if row[0] == 0:
-                row[1] = -9999
-                row[2] = -9999
-                row[3] = 100
-                row[4] = "No Riparian Vegetation Detected"
-                row[5] = -9999
-                row[6] = -9999
-                row[7] = -9999
-                row[8] = -9999
-                cursor.updateRow(row)
-    
-    # if any features in temp output shp are outside of valley bottom, set all conversion fields to NoData value
-
-    arcpy.AddMessage('\t Handling values outside of valley bottom...')
 
+def handle_nodata_reaches(reach_table, tempOut, valley, n_scenarios=1):
+    """
+    Sets NoData values in the reach table for reaches without riparian vegetation or outside of the valley bottom
+    :param reach_table: Structured array of RVD attributes for each reach
+    :param tempOut: Temporary output network, with reaches in the same FID order as the reach table
+    :param valley: Valley bottom shapefile
+    :param n_scenarios: Number of historic baselines in the reach table
+    """
+    # set everything with count 0 with nodata values, type as no riparian
+    # (existing veg means are shared by all baselines, so they follow the first baseline)
+    for scenario in range(n_scenarios):
+        no_riparian = reach_table[scenario_field("COUNT", scenario)] == 0
+        nodata_fields = ["RIPAR_DEP", "NATIV_DEP", "HsRip_Mean", "HsNtv_Mean"]
+        if scenario == 0:
+            nodata_fields += EX_REACH_FIELDS
+        for field in nodata_fields:
+            reach_table[scenario_field(field, scenario)][no_riparian] = -9999
+        reach_table[scenario_field("conv_code", scenario)][no_riparian] = 100
+        reach_table[scenario_field("Conv_Type", scenario)][no_riparian] = CONVERSION_TYPES[100]
+
+    # if any reaches are outside of valley bottom, set all conversion fields to NoData value
     arcpy.MakeFeatureLayer_management(tempOut, "outlyr")
     arcpy.SelectLayerByLocation_management("outlyr", "HAVE_THEIR_CENTER_IN", valley)
     arcpy.SelectLayerByLocation_management("outlyr", selection_type="SWITCH_SELECTION")
-    getcount = arcpy.GetCount_management("outlyr")
-    count = int(getcount.getOutput(0))
-    if count != 0:
-        with arcpy.da.UpdateCursor("outlyr", ["RIPAR_DEP", "NATIV_DEP", "conv_code", "Conv_Type", "ExRip_Mean", "HsRip_Mean",
-                                              "ExNtv_Mean",  "HsNtv_Mean", "COUNT", "sum_noch", "sum_grsh", "sum_deveg",
-                                              "sum_conif", "sum_inv", "sum_dev", "sum_agr", "prop_noch", "prop_grsh", "prop_deveg",
-                                              "prop_conif", "prop_inv", "prop_dev", "prop_agr", "prop_exp",  "count_calc"]) as cursor:
-            for row in cursor:
-                row[0] = -9999
-                row[1] = -9999
-                row[2] = -9999
-                row[3] = "NA"
-                row[4] = -9999
-                row[5] = -9999
-                row[6] = -9999
-                row[7] = -9999
-                row[8] = -9999
-                row[9] = -9999
-                row[10] = -9999
-                row[11] = -9999
-                row[12] = -9999
-                row[13] = -9999
-                row[14] = -9999
-                row[15] = -9999
-                row[16] = -9999
-                row[17] = -9999
-                row[18] = -9999
-                row[19] = -9999
-                row[20] = -9999
-                row[21] = -9999
-                row[22] = -9999
-                row[23] = -9999
-                row[24] = -9999
-                cursor.updateRow(row)
-
-    # save to output shapefile
-    arcpy.SelectLayerByAttribute_management("outlyr", "CLEAR_SELECTION")
-    arcpy.CopyFeatures_management("outlyr", fcOut)
-    arcpy.Delete_management(tempOut)
+    outside_valley = np.array([row[0] for row in arcpy.da.SearchCursor("outlyr", "FID")], dtype=np.int64)
+    arcpy.Delete_management("outlyr")
+    if len(outside_valley) > 0:
+        for scenario in range(n_scenarios):
+            for field in OUTSIDE_VALLEY_FIELDS:
+                if scenario == 0 or field not in EX_REACH_FIELDS:
+                    reach_table[scenario_field(field, scenario)][outside_valley] = -9999
+            reach_table[scenario_field("Conv_Type", scenario)][outside_valley] = "NA"
 
 
-def calculate_conversion_proportion(conversion_raster, thiessen_valley, tempOut, valueList, value, field_suffix):
-    sum_field = "sum_"+field_suffix # new sum field for conversion type
-    arcpy.AddField_management(tempOut, sum_field, "DOUBLE")
-    # calculate pixel count for conversion type and 
-    if value in valueList:
-        # calculate count of pixels with given value within each thiessen polygon
-        # NOTE: sum only works here because input raster has 0/1 values, so sum is count of all "1"s
-        if value == -50:
-            string_val = "min50"
-        else:
-            string_val = str(value)
-        arcpy.AddMessage('\t\t\t Zonal Statistics for {}...'.format(value))
-        table = ZonalStatisticsAsTable(thiessen_valley, "RCH_FID", conversion_raster, "table_"+string_val, "", "SUM")
-        # add zonal stats calculations to temporary output shp
-        arcpy.JoinField_management(tempOut, "FID", table, "RCH_FID", "SUM")
-        with arcpy.da.UpdateCursor(tempOut, ["SUM", sum_field]) as cursor:
-            for row in cursor:
-                row[1] = row[0]
-                cursor.updateRow(row)
-        arcpy.DeleteField_management(tempOut, "SUM") # otherwise will overlap with next field used
-    # if value is not within conversion raster, all features will have a count of 0 for the value
-    else:
-        with arcpy.da.UpdateCursor(tempOut, sum_field) as cursor:
-            for row in cursor:
-                row[0] = 0
-                cursor.updateRow(row)
-
-    # calculate proportion of conversion type based on sum/count fields
-    prop_field = "prop_"+field_suffix # new prop field for conversion type
-    arcpy.AddField_management(tempOut, prop_field, "DOUBLE")
-    arcpy.AddMessage('\t\t\t Updating {}...'.format(value))
-    with arcpy.da.UpdateCursor(tempOut, ["count_calc", sum_field, prop_field]) as cursor:
-        for row in cursor:
-            row[2] = row[1] / row[0]
-            cursor.updateRow(row)
+def classify_conversion(props):
+    """
+    Flags the conversion type of each reach from the proportions of each conversion type
+    :param props: Array (reaches x 9) of conversion proportions, in the order of CONVERSION_FIELD_SUFFIXES
+    :return: Array of conversion codes for each reach
+    """
+    props = np.asarray(props, np.float64)
+    conversions = props[:, 1:]
+    # find the most dominant conversion type; it is only flagged if no other conversion type ties it
+    # note: NaN proportions never compare equal, so reaches with NaN values are flagged as multiple dominant
+    dominant = np.argmax(conversions, axis=1)
+    dominant_prop = conversions[np.arange(len(conversions)), dominant]
+    is_dominant = (conversions == dominant_prop[:, np.newaxis]).sum(axis=1) == 1
+    # bin dominant proportion into very minor (<= 0.1), minor (<= 0.25), moderate (<= 0.5) or significant
+    magnitude = np.digitize(dominant_prop, CONVERSION_MAGNITUDE_BREAKS, right=True)
+    out_conv_code = np.where(is_dominant, CONVERSION_BASE_CODES[dominant] + magnitude, 0).astype(np.float64)
+    # if no change proportion is greater than or equal to 0.85, reach is flagged as no change
+    out_conv_code[props[:, 0] >= 0.85] = 1
+    return out_conv_code
 
 
 def make_layers(fcOut, thiessen_valley, veg_rasters_folder):
@@ -807,11 +815,16 @@ def make_layers(fcOut, thiessen_valley, veg_rasters_folder):
     make_layer(os.path.dirname(fcOut), fcOut, "Riparian Conversion Type", conversion_type_symbology,
                symbology_field="Conv_Type")
     make_layer(os.path.dirname(thiessen_valley), thiessen_valley, "Clipped Thiessen Polygons", thiessen_valley_symbology)
-    make_layer(os.path.dirname(veg_rasters_folder), conversion_raster, "Riparian Conversion Raster", riparian_conversion_symbology, is_raster=True)
-    make_layer(os.path.dirname(veg_rasters_folder), riparian_corridor, "Riparian Corridor", riparian_corridor_symbology, is_raster=True)
+    # conversion and riparian rasters aren't saved when vegetation rasters are processed in windows
+    if os.path.exists(conversion_raster):
+        make_layer(os.path.dirname(veg_rasters_folder), conversion_raster, "Riparian Conversion Raster", riparian_conversion_symbology, is_raster=True)
+    if os.path.exists(riparian_corridor):
+        make_layer(os.path.dirname(veg_rasters_folder), riparian_corridor, "Riparian Corridor", riparian_corridor_symbology, is_raster=True)
     
     
-def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network, lg_river, dredge_tailings, intermediates_folder, analysis_folder):
+def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_vegs, seg_network, lg_river, dredge_tailings, intermediates_folder, analysis_folder):
+    # project input paths of the historic baselines, for matching against inputs of earlier realizations
+    hist_paths = [hist_veg[hist_veg.find("Inputs"):] for hist_veg in hist_vegs]
     xmlfile = projPath + "/RVDproject.rs.xml"
     if not os.path.exists(xmlfile):
         # initiate xml file creation
@@ -833,7 +846,9 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
         newxml.addProjectInput("Raster", "Existing Vegetation", ex_veg[ex_veg.find("Inputs"):], iid="EXVEG1", guid=getUUID())
         newxml.addRVDInput(newxml.RVDrealizations[0], "Existing Vegetation", ref="EXVEG1")
 
-        newxml.addProjectInput("Raster", "Historic Vegetation", hist_veg[hist_veg.find("Inputs"):], iid="HISTVEG1", guid=getUUID())
+        for scenario, hist_path in enumerate(hist_paths):
+            newxml.addProjectInput("Raster", "Historic Vegetation" + scenario_suffix(scenario, " "), hist_path,
+                                   iid="HISTVEG1" + scenario_suffix(scenario, "_"), guid=getUUID())
         newxml.addRVDInput(newxml.RVDrealizations[0], "Historic Vegetation", ref="HISTVEG1")
 
         newxml.addProjectInput("Vector", "Segmented Network", seg_network[seg_network.find("Inputs"):], iid="NETWORK1", guid=getUUID())
@@ -854,14 +869,10 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
                            path=intermediates_folder + "/03_VegetationRasters/01_Ex_Veg/Existing_Riparian.tif", guid=getUUID())
         newxml.addRVDInput(newxml.RVDrealizationsp[0], "Existing Cover", "Existing Native Riparian",
                            path=intermediates_folder + "/03_VegetationRasters/01_Ex_Veg/Existing_NativeRiparian.tif", guid=getUUID())
-        newxml.addRVDInput(newxml.RVDrealizations[0], "Historic Cover", "Historic Riparian",
-                           path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_Riparian.tif", guid=getUUID())
-        newxml.addRVDInput(newxml.RVDrealizations[0], "Historic Cover", "Historic Native Riparian",
-                           path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_NativeRiparian.tif", guid=getUUID())
         newxml.addRVDInput(newxml.RVDrealizations[0], "Existing Cover", "Existing Cover",
                            path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Ex_Cover.tif", guid=getUUID())
-        newxml.addRVDInput(newxml.RVDrealizations[0], "Historic Cover", "Historic Cover",
-                           path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Hist_Cover.tif", guid=getUUID())
+        for scenario in range(len(hist_paths)):
+            add_hist_cover_inputs(newxml, intermediates_folder, scenario, (getUUID(), getUUID(), getUUID()))
         newxml.addRVDInput(newxml.RVDrealizations[0], "Thiessen Polygons", "Thiessen Polygons",
                            path=intermediates_folder + "/02_ValleyThiessen/Thiessen_Valley_Clip.shp", guid=getUUID())
 
@@ -930,7 +941,8 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
                                       path=intermediates_folder + "/03_VegetationRasters/01_Ex_Veg/Existing_NativeRiparian.tif")
                     exxml.addRVDInput(exxml.RVDrealizations[0], "Existing Cover", "Existing Cover",
                                       path=intermediates_folder + "/03_VegetationRasters/01_Ex_Veg/Ex_Cover.tif")
-            elif os.path.abspath(rasterpath[i]) == os.path.abspath(hist_veg[hist_veg.find("Inputs"):]):
+            elif os.path.abspath(rasterpath[i]) in [os.path.abspath(hist_path) for hist_path in hist_paths]:
+                scenario = [os.path.abspath(hist_path) for hist_path in hist_paths].index(os.path.abspath(rasterpath[i]))
                 HV = exxml.root.findall(".//HistoricVegetation")
                 for x in range(len(HV)):
                     if HV[x].attrib['ref'] == rasterid[i]:
@@ -939,24 +951,12 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
                         histcov_guid = r[1].attrib['guid']
                     else:
                         r = []
-                exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Vegetation", ref=str(rasterid[i]))
+                if scenario == 0:
+                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Vegetation", ref=str(rasterid[i]))
                 if len(r) > 0:
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Riparian",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_Riparian.tif",
-                                      guid=histrip_guid)
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Riparian",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_NativeRiparian.tif",
-                                      guid=histrip_guid)
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Cover",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Hist_Cover.tif",
-                                      guid=histcov_guid)
+                    add_hist_cover_inputs(exxml, intermediates_folder, scenario, (histrip_guid, histrip_guid, histcov_guid))
                 else:
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Riparian",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_Riparian.tif")
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Native Riparian",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_NativeRiparian.tif")
-                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Cover",
-                                      path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Hist_Cover.tif")
+                    add_hist_cover_inputs(exxml, intermediates_folder, scenario)
 
         nlist = []
         for j in rasterpath:
@@ -978,26 +978,21 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
             exxml.addRVDInput(exxml.RVDrealizations[0], "Existing Cover", "Existing Cover",
                               path=intermediates_folder + "/03_VegetationRasters/01_Ex_Veg/Ex_Cover.tif",
                               guid=getUUID())
-        nlist = []
-        for j in rasterpath:
-            if os.path.abspath(hist_veg[hist_veg.find("Inputs"):]) == os.path.abspath(j):
-                nlist.append("yes")
+        for scenario, hist_path in enumerate(hist_paths):
+            nlist = []
+            for j in rasterpath:
+                if os.path.abspath(hist_path) == os.path.abspath(j):
+                    nlist.append("yes")
+                else:
+                    nlist.append("no")
+            if "yes" in nlist:
+                pass
             else:
-                nlist.append("no")
-        if "yes" in nlist:
-            pass
-        else:
-            exxml.addProjectInput("Raster", "Historic Vegetation", hist_veg[hist_veg.find("Inputs"):], iid="HISTVEG" + str(k), guid=getUUID())
-            exxml.addRVDInput(exxml.RVDrealizations[0], "HistoricVegetation", ref="HISTVEG" + str(k))
-            exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Riparian",
-                              path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_Riparian.tif",
-                              guid=getUUID())
-            exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Native Riparian",
-                              path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg/Historic_NativeRiparian.tif",
-                              guid=getUUID())
-            exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Cover", "Historic Cover",
-                              path=intermediates_folder + "/03_VegetationRasters/02_Hist_Veg//Hist_Cover.tif",
-                              guid=getUUID())
+                hist_id = "HISTVEG" + str(k) + scenario_suffix(scenario, "_")
+                exxml.addProjectInput("Raster", "Historic Vegetation" + scenario_suffix(scenario, " "), hist_path, iid=hist_id, guid=getUUID())
+                if scenario == 0:
+                    exxml.addRVDInput(exxml.RVDrealizations[0], "Historic Vegetation", ref=hist_id)
+                add_hist_cover_inputs(exxml, intermediates_folder, scenario, (getUUID(), getUUID(), getUUID()))
         del nlist
 
         vector = inputs.findall("Vector")
@@ -1095,6 +1090,25 @@ def write_xml(projPath, projName, hucID, hucName, ex_veg, hist_veg, seg_network,
 
         exxml.write()
 
+
+def add_hist_cover_inputs(xml, intermediates_folder, scenario, guids=("", "", "")):
+    """
+    Adds the historic riparian, native riparian and cover rasters of a historic baseline to the newest RVD realization,
+    numbered like the baseline's fields (e.g., "Historic Riparian 2" for RIPAR_DEP2)
+    :param xml: ProjectXML or ExistingXML of the RVD project
+    :param intermediates_folder: RVD intermediates folder
+    :param scenario: Index of historic baseline
+    :param guids: GUIDs of the riparian, native riparian and cover rasters (optional)
+    """
+    suffix = scenario_suffix(scenario, " ")
+    folder = intermediates_folder + "/03_VegetationRasters/02_Hist_Veg" + scenario_suffix(scenario, "_")
+    xml.addRVDInput(xml.RVDrealizations[0], "Historic Cover", "Historic Riparian" + suffix,
+                    path=folder + "/Historic_Riparian.tif", guid=guids[0])
+    xml.addRVDInput(xml.RVDrealizations[0], "Historic Cover", "Historic Native Riparian" + suffix,
+                    path=folder + "/Historic_NativeRiparian.tif", guid=guids[1])
+    xml.addRVDInput(xml.RVDrealizations[0], "Historic Cover", "Historic Cover" + suffix,
+                    path=folder + "/Hist_Cover.tif", guid=guids[2])
+
                               
 def getUUID():
     return str(uuid.uuid4()).upper()
@@ -0,0 +1,111 @@
+# -----------------------------------------------------------------------------------------------------------------------
+# Name:        RVD + RCA
+# Purpose:     Runs Riparian Vegetation Departure and Riparian Condition Assessment together, summarizing the vegetation
+#              rasters for both tools in one sweep
+#
+# Author:      Jordan Gilbert
+#
+# Created:     10/2026
+# Copyright:   (c) Jordan Gilbert 2017
+# Licence:     This work is licensed under the Creative Commons Attribution-NonCommercial-ShareAlike 4.0 International
+#              License. To view a copy of this license, visit http://creativecommons.org/licenses/by-nc-sa/4.0/.
+# -----------------------------------------------------------------------------------------------------------------------
+
+import arcpy
+import os
+import RVD
+import RCA
+from SupportingFunctions import find_available_num_prefix
+
+
+def main(
+    projName,
+    hucID,
+    hucName,
+    projPath,
+    ex_veg,
+    hist_veg,
+    seg_network,
+    frag_valley,
+    lg_river,
+    dredge_tailings,
+    confin_thresh,
+    rvdName,
+    rcaName,
+    memory_limit=None,
+    fis_surface_resolution=None,
+    fis_cache_folder=None,
+    sensitivity_samples=None,
+    sensitivity_spread=None,
+    sensitivity_processes=None):
+    """ Calculates riparian vegetation departure and riparian condition for a stream network, reading the vegetation
+    rasters once for both tools
+    :param projName: Project name for XML metadata
+    :param hucID: Huc ID for XML metadata
+    :param hucName: Huc name for XML metadata
+    :param projPath: RCAT project folder
+    :param ex_veg: Existing vegetation raster
+    :param hist_veg: Historic vegetation raster(s); RCA uses the first baseline
+    :param seg_network: Segmented stream network from the confinement tool (with a CONF_RATIO field)
+    :param frag_valley: Fragmented valley bottom shapefile
+    :param lg_river: Large river polygon shapefile (optional)
+    :param dredge_tailings: Dredge tailings polygon shapefile (optional)
+    :param confin_thresh: Confinement threshold for calculating riparian condition
+    :param rvdName: Name for RVD output network
+    :param rcaName: Name for RCA output network
+    :param memory_limit: Memory ceiling in MB for processing the vegetation rasters (optional)
+    :param fis_surface_resolution: See RCA.main
+    :param fis_cache_folder: See RCA.main
+    :param sensitivity_samples: See RCA.main
+    :param sensitivity_spread: See RCA.main
+    :param sensitivity_processes: See RCA.main
+    return: Output networks with RVD fields and with Riparian Condition fields
+    """
+    # check the RCA inputs before the RVD run so a missing field doesn't fail after the raster sweep
+    hist_vegs = RVD.parse_hist_baselines(hist_veg)
+    RCA.check_fields(frag_valley, seg_network, ex_veg, hist_vegs[0], rvd_fields=False)
+
+    # run RVD, summarizing the vegetation lookups RCA needs in the same sweep over the vegetation rasters
+    rvd_network, zone_grid, rca_means = RVD.main(projName, hucID, hucName, projPath, ex_veg, hist_vegs, seg_network,
+                                                 frag_valley, lg_river, dredge_tailings, rvdName, memory_limit,
+                                                 rca_inputs=True)
+
+    # RCA outputs go in the same output folder as the RVD outputs
+    output_folder = os.path.dirname(os.path.dirname(os.path.dirname(rvd_network)))
+    intermediates_folder = os.path.join(output_folder, "01_Intermediates")
+    analysis_dir = os.path.join(output_folder, "02_Analyses")
+    rca_out_dir = os.path.join(analysis_dir, find_available_num_prefix(analysis_dir)+"_RCA")
+    RCA.make_folder(rca_out_dir)
+    # the RVD output network already has NATIV_DEP, so it is the RCA input network
+    fcOut = output_folder + "/rca_table.shp"
+    arcpy.CopyFeatures_management(rvd_network, fcOut)
+
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("spatial")
+
+    # calculate model inputs for each reach from the RVD sweep
+    arcpy.AddMessage("Assessing land use intensity...")
+    lui = RCA.reach_lui(rca_means["LU_CODE"])
+    arcpy.AddMessage("Assessing floodplain connectivity...")
+    connect = RCA.reach_connectivity(rca_means["CONNECT"])
+    arcpy.AddMessage("Assessing overall vegetation departure...")
+    ex_vegetated, hist_vegetated, veg = RCA.reach_vegetated(rca_means["EX_VEGETATED"], rca_means["HIST_VEGETATED"])
+
+    output = RCA.assess_condition(fcOut, rvd_network, frag_valley, [lui, connect, ex_vegetated, hist_vegetated, veg],
+                                  confin_thresh, rca_out_dir, rcaName, fis_surface_resolution, fis_cache_folder,
+                                  sensitivity_samples, sensitivity_spread, sensitivity_processes)
+
+    arcpy.CheckInExtension('spatial')
+
+    # make layers
+    arcpy.AddMessage("Making layers...")
+    RCA.make_layers(fcOut, intermediates_folder)
+
+    # write xml
+    arcpy.AddMessage("Writing XML file. NOTE: This is the final step and non-critical to the outputs")
+    try:
+        RCA.write_xml(projName, hucID, hucName, projPath, ex_veg, hist_vegs[0], seg_network, frag_valley, lg_river, dredge_tailings, confin_thresh, output)
+    except Exception:
+        arcpy.AddMessage("Writing the XML file has failed, but RCA outputs are saved. This is a known bug in RCAT and you can proceed to the next step without problems.")
+
+    return rvd_network, output
@@ -16,7 +16,40 @@
 # load dependencies
 import math
 import os
+import glob
+import hashlib
+import json
+import sys
+import time
 import arcpy
+import numpy as np
+from Hydrology import drainage_area, smoothed_dem, smoothed_slope, DRAIN_AREA_BYTES_PER_CELL, FILL_TILE_CELLS, \
+    WINDOW_TILE_CELLS
+
+# value used for NODATA cells when moving rasters into and out of arrays
+RASTER_NODATA = -9999
+# value in compiled remap lookups for input values that aren't in the remap table
+REMAP_UNKNOWN = np.iinfo(np.int32).min
+# size of the square cell window DEMs are smoothed over (mean) before calculating drainage area and slope
+DEM_SMOOTHING_CELLS = 3
+# drainage area calculation, part of the drainage area cache key so rasters from other versions aren't reused
+DRAIN_AREA_ALGORITHM = "mean filter, priority-flood fill, D8 flow direction, flow accumulation (Hydrology.py v3)"
+# drainage area calculation used for DEMs too large to calculate drainage area for in memory
+DRAIN_AREA_FALLBACK_ALGORITHM = "FocalStatistics mean, Spatial Analyst Fill, FlowDirection, FlowAccumulation"
+# memory (MB) drainage area may use in this process before falling back to Spatial Analyst; a 32-bit python (e.g.,
+# ArcMap's foreground geoprocessing) can address about 2 GB, and large arrays each need a contiguous block of it
+DRAIN_AREA_MEMORY_MB = 1024 if sys.maxsize <= 2 ** 32 else 8192
+# environment variable naming a drainage area cache folder shared by all DEMs (by default each DEM's Flow folder
+# holds its own cache)
+DRAIN_AREA_CACHE_VARIABLE = "RCAT_DRAIN_AREA_CACHE"
+# default size cap for a drainage area cache folder (MB); the least recently used rasters are deleted to stay under it
+DRAIN_AREA_CACHE_MAX_MB = 4096
+# number of DEM cells read at a time when hashing DEM content
+HASH_BLOCK_CELLS = 4000000
+# maximum number of point x window cells gathered at a time when sampling a raster around points
+POINT_WINDOW_CELLS = 4000000
+# maximum number of raster cells read at a time around a group of points when sampling a raster around points
+POINT_BAND_CELLS = 16000000
 
 
 def make_folder(folder):
@@ -165,3 +198,823 @@ def get_execute_error_code(err):
     :return:
     """
     return err[0][6:12]
+
+
+class ZoneGrid(object):
+    """
+    A zone raster (e.g., rasterized thiessen polygons) and the grid it sits on. Other rasters snapped to the same
+    grid can be read into arrays that line up cell for cell with the zones.
+    """
+    def __init__(self, zone_raster, n_zones):
+        """
+        :param zone_raster: Integer zone raster, with zone IDs from 0 to n_zones - 1
+        :param n_zones: Number of zones (e.g., number of reaches in the network)
+        """
+        raster = arcpy.Raster(zone_raster)
+        self.zone_raster = zone_raster
+        self.n_zones = n_zones
+        self.cell_size = raster.meanCellWidth
+        self.nrows = raster.height
+        self.ncols = raster.width
+        self.lower_left = arcpy.Point(raster.extent.XMin, raster.extent.YMin)
+        self.spatial_reference = raster.spatialReference
+        self._zones = None
+
+    def read(self, raster, nodata):
+        """
+        Reads a raster into an array covering the zone grid
+        :param raster: Raster snapped to the zone grid
+        :param nodata: Value to give NODATA cells
+        :return: Array with the same shape as the zone grid
+        """
+        return arcpy.RasterToNumPyArray(raster, self.lower_left, self.ncols, self.nrows, nodata)
+
+    def read_block(self, raster, row_start, nrows, nodata):
+        """
+        Reads a block of full-width rows of a raster on the zone grid
+        :param raster: Raster snapped to the zone grid
+        :param row_start: First row of the block (row 0 is the top of the grid)
+        :param nrows: Number of rows in the block
+        :param nodata: Value to give NODATA cells
+        :return: Array (nrows x grid columns)
+        """
+        lower_left = arcpy.Point(self.lower_left.X, self.lower_left.Y + (self.nrows - row_start - nrows) * self.cell_size)
+        return arcpy.RasterToNumPyArray(raster, lower_left, self.ncols, nrows, nodata)
+
+    def read_values(self, raster):
+        """
+        Reads a raster into a float array covering the zone grid, with NaN for NODATA cells
+        :param raster: Raster snapped to the zone grid
+        :return: Float array with the same shape as the zone grid
+        """
+        values = self.read(raster, RASTER_NODATA).astype(np.float32)
+        values[values == RASTER_NODATA] = np.nan
+        return values
+
+    def blocks(self, block_rows):
+        """
+        Splits the grid into blocks of full-width rows
+        :param block_rows: Maximum number of rows in each block
+        :return: Generator of (first row, number of rows) for each block
+        """
+        for row_start in range(0, self.nrows, block_rows):
+            yield row_start, min(block_rows, self.nrows - row_start)
+
+    def window_rows(self, memory_limit, bytes_per_cell):
+        """
+        Finds how many full-width rows can be processed at a time within a memory ceiling
+        :param memory_limit: Memory ceiling in MB
+        :param bytes_per_cell: Approximate peak memory used per grid cell while processing a block
+        :return: Number of rows in each block (at least 1)
+        """
+        return max(1, int(memory_limit * 1024 * 1024 / (self.ncols * bytes_per_cell)))
+
+    def zones(self):
+        """
+        :return: Array of zone IDs, with -1 for cells outside all zones
+        """
+        if self._zones is None:
+            self._zones = self.read(self.zone_raster, -1)
+        return self._zones
+
+    def zone_block(self, row_start, nrows):
+        """
+        :param row_start: First row of the block (row 0 is the top of the grid)
+        :param nrows: Number of rows in the block
+        :return: Array of zone IDs for a block of full-width rows, with -1 for cells outside all zones
+        """
+        if self._zones is not None:
+            return self._zones[row_start:row_start+nrows]
+        return self.read_block(self.zone_raster, row_start, nrows, -1)
+
+    def save(self, values, out_raster, nodata=RASTER_NODATA):
+        """
+        Saves an array covering the zone grid as a raster
+        :param values: Array with the same shape as the zone grid; NaN cells are saved as NODATA
+        :param out_raster: Path for output raster
+        :param nodata: Value used for NODATA cells in the array
+        :return: Path to output raster
+        """
+        if values.dtype.kind == 'f':
+            values = np.where(np.isnan(values), nodata, values)
+        raster = arcpy.NumPyArrayToRaster(values, self.lower_left, self.cell_size, self.cell_size, nodata)
+        raster.save(out_raster)
+        arcpy.DefineProjection_management(out_raster, self.spatial_reference)
+        return out_raster
+
+    def save_blocks(self, blocks, out_raster, nodata=RASTER_NODATA):
+        """
+        Saves a raster covering the zone grid from blocks of full-width rows, so the whole grid is never held in
+        memory. Each block is saved beside the output raster and the blocks are then mosaicked together.
+        :param blocks: Iterable of (first row, array of full-width rows) covering the grid; NaN cells are saved as NODATA
+        :param out_raster: Path for output raster
+        :param nodata: Value used for NODATA cells in the arrays
+        :return: Path to output raster
+        """
+        base, extension = os.path.splitext(out_raster)
+        block_rasters = []
+        for row_start, values in blocks:
+            if values.dtype.kind == 'f':
+                values = np.where(np.isnan(values), nodata, values)
+            lower_left = arcpy.Point(self.lower_left.X,
+                                     self.lower_left.Y + (self.nrows - row_start - values.shape[0]) * self.cell_size)
+            block_raster = "{0}_block{1}{2}".format(base, len(block_rasters), extension)
+            arcpy.NumPyArrayToRaster(values, lower_left, self.cell_size, self.cell_size, nodata).save(block_raster)
+            block_rasters.append(block_raster)
+        if len(block_rasters) > 1:
+            arcpy.Mosaic_management(";".join(block_rasters[1:]), block_rasters[0])
+            for block_raster in block_rasters[1:]:
+                arcpy.Delete_management(block_raster)
+        if arcpy.Exists(out_raster):
+            arcpy.Delete_management(out_raster)
+        arcpy.Rename_management(block_rasters[0], out_raster)
+        arcpy.DefineProjection_management(out_raster, self.spatial_reference)
+        return out_raster
+
+
+class RasterRows(object):
+    """
+    Rows of a raster on a zone grid, read when they are sliced as a float array with NaN for NODATA cells, so moving
+    window functions (e.g., Hydrology.smoothed_slope) can work through a raster a tile of rows at a time
+    """
+    def __init__(self, raster, zone_grid):
+        """
+        :param raster: Raster snapped to the zone grid
+        :param zone_grid: ZoneGrid the raster is on
+        """
+        self.raster = raster
+        self.zone_grid = zone_grid
+        self.shape = (zone_grid.nrows, zone_grid.ncols)
+
+    def __getitem__(self, rows):
+        """
+        :param rows: Slice of rows (row 0 is the top of the grid)
+        :return: Float32 array of the rows, with NaN for NODATA cells
+        """
+        row_start, row_end, step = rows.indices(self.shape[0])
+        values = self.zone_grid.read_block(self.raster, row_start, row_end - row_start, RASTER_NODATA)
+        values = values.astype(np.float32)
+        values[values == RASTER_NODATA] = np.nan
+        return values
+
+
+def make_zone_raster(zone_polygons, zone_field, snap_raster, out_raster):
+    """
+    Rasterizes zone polygons onto the grid of a snap raster
+    :param zone_polygons: Polygons to rasterize (e.g., thiessen polygons clipped to the valley bottom)
+    :param zone_field: Integer field holding the zone ID for each polygon
+    :param snap_raster: Raster whose cell size and alignment the zone raster should match
+    :param out_raster: Path for output zone raster
+    :return: Path to zone raster
+    """
+    # the extent and snap raster are only set for the rasterization, so later geoprocessing isn't clipped to the zones
+    old_extent, old_snap_raster = arcpy.env.extent, arcpy.env.snapRaster
+    arcpy.env.extent = zone_polygons
+    arcpy.env.snapRaster = snap_raster
+    try:
+        cell_size = arcpy.Describe(snap_raster).meanCellWidth
+        arcpy.PolygonToRaster_conversion(zone_polygons, zone_field, out_raster, "CELL_CENTER", "", cell_size)
+    finally:
+        arcpy.env.extent, arcpy.env.snapRaster = old_extent, old_snap_raster
+    return out_raster
+
+
+def get_zone_raster(zone_polygons, zone_field, snap_raster):
+    """
+    Finds the zone raster for a set of polygons on the grid of a snap raster. Zone rasters are cached beside the
+    polygons (one for each grid), and the polygons are only rasterized again if they or the target grid have changed.
+    :param zone_polygons: Polygons to rasterize (e.g., thiessen polygons clipped to the valley bottom)
+    :param zone_field: Integer field holding the zone ID for each polygon
+    :param snap_raster: Raster whose cell size and alignment the zone raster should match
+    :return: Path to zone raster
+    """
+    cache_prefix = os.path.splitext(zone_polygons)[0] + "_Zones_" + grid_key(snap_raster) + "_"
+    zone_raster = cache_prefix + polygon_key(zone_polygons, zone_field) + ".tif"
+    if arcpy.Exists(zone_raster):
+        arcpy.AddMessage("\t Using cached zone raster " + os.path.basename(zone_raster))
+        return zone_raster
+    # remove zone rasters made on this grid from older versions of the polygons
+    for stale_raster in glob.glob(cache_prefix + "*.tif"):
+        arcpy.Delete_management(stale_raster)
+    arcpy.AddMessage("\t Rasterizing " + os.path.basename(zone_polygons) + "...")
+    return make_zone_raster(zone_polygons, zone_field, snap_raster, zone_raster)
+
+
+def polygon_key(zone_polygons, zone_field):
+    """
+    Hashes polygon geometries and zone IDs, so a cached zone raster can be matched to the polygons it was made from
+    :param zone_polygons: Polygons to rasterize
+    :param zone_field: Integer field holding the zone ID for each polygon
+    :return: Hex string key
+    """
+    key = hashlib.md5()
+    with arcpy.da.SearchCursor(zone_polygons, ["SHAPE@WKB", zone_field]) as cursor:
+        for row in cursor:
+            key.update(bytes(row[0]))
+            key.update(str(row[1]).encode("utf-8"))
+    return key.hexdigest()[:12]
+
+
+def grid_key(snap_raster):
+    """
+    Hashes the cell size, alignment and coordinate system of a raster's grid
+    :param snap_raster: Raster whose grid a zone raster is made on
+    :return: Hex string key
+    """
+    raster = arcpy.Raster(snap_raster)
+    cell_width = raster.meanCellWidth
+    cell_height = raster.meanCellHeight
+    grid = "{0!r} {1!r} {2!r} {3!r} {4}".format(cell_width, cell_height, raster.extent.XMin % cell_width,
+                                                raster.extent.YMin % cell_height, raster.spatialReference.name)
+    return hashlib.md5(grid.encode("utf-8")).hexdigest()[:8]
+
+
+def same_grid(raster, snap_raster):
+    """
+    Checks whether a raster has the same cell size, alignment and coordinate system as a snap raster, so its cells can
+    be read on the snap raster's grid
+    :param raster: Raster to check
+    :param snap_raster: Raster whose grid the raster should be on
+    :return: True if the raster is on the snap raster's grid
+    """
+    raster_cells = arcpy.Raster(raster)
+    snap_cells = arcpy.Raster(snap_raster)
+    return raster_cells.meanCellWidth == snap_cells.meanCellWidth and \
+        raster_cells.meanCellHeight == snap_cells.meanCellHeight and grid_key(raster) == grid_key(snap_raster)
+
+
+def snap_to_grid(raster, snap_raster, out_raster):
+    """
+    Resamples a classified raster onto the grid of a snap raster (nearest neighbor, so class values are kept), unless
+    it is already on that grid
+    :param raster: Classified raster (e.g., historic vegetation)
+    :param snap_raster: Raster whose grid the raster should be on (e.g., existing vegetation)
+    :param out_raster: Path for resampled raster
+    :return: Path to a raster on the snap raster's grid (the input raster if it is already on it)
+    """
+    if same_grid(raster, snap_raster):
+        return raster
+    arcpy.AddMessage("\t Resampling " + os.path.basename(raster) + " onto the grid of " + os.path.basename(snap_raster) + "...")
+    snap_cells = arcpy.Raster(snap_raster)
+    old_snap_raster = arcpy.env.snapRaster
+    arcpy.env.snapRaster = snap_raster
+    try:
+        if arcpy.Describe(raster).spatialReference.name != snap_cells.spatialReference.name:
+            arcpy.ProjectRaster_management(raster, out_raster, snap_cells.spatialReference, "NEAREST",
+                                           snap_cells.meanCellWidth)
+        else:
+            arcpy.Resample_management(raster, out_raster, "{0} {1}".format(snap_cells.meanCellWidth,
+                                                                           snap_cells.meanCellHeight), "NEAREST")
+    finally:
+        arcpy.env.snapRaster = old_snap_raster
+    return out_raster
+
+
+def zone_class_histogram(zones, classes, n_zones, class_values):
+    """
+    Counts the cells of each class within each zone with a single bincount over combined zone/class keys
+    :param zones: Integer array of zone IDs (cells with negative zone IDs are outside all zones)
+    :param classes: Array of class values, same shape as zones
+    :param n_zones: Number of zones (zone IDs run from 0 to n_zones - 1)
+    :param class_values: Class values to count; cells with any other value (e.g., NODATA) are ignored
+    :return: Array (zones x class values) of cell counts
+    """
+    class_values = np.asarray(class_values, dtype=np.int64)
+    zones = np.asarray(zones).ravel()
+    classes = np.asarray(classes).ravel()
+    n_classes = len(class_values)
+    # dense lookup from class value to column index (-1 for values that aren't counted)
+    min_value = class_values.min()
+    max_value = class_values.max()
+    class_lut = np.full(max_value - min_value + 1, -1, dtype=np.int64)
+    class_lut[class_values - min_value] = np.arange(n_classes)
+    # drop cells outside all zones or with class values outside the lookup
+    keep = (zones >= 0) & (zones < n_zones) & (classes >= min_value) & (classes <= max_value)
+    columns = class_lut[classes[keep].astype(np.int64) - min_value]
+    counted = columns >= 0
+    keys = zones[keep][counted].astype(np.int64) * n_classes + columns[counted]
+    return np.bincount(keys, minlength=n_zones * n_classes).reshape(n_zones, n_classes)
+
+
+def zonal_band_sums(zones, bands, n_zones):
+    """
+    Sums values and counts cells with data within each zone for several bands of values in one sweep (a single
+    bincount over combined band/zone keys), ignoring NaN (NODATA) cells. Results for separate blocks of a grid can be
+    added together.
+    :param zones: Integer array of zone IDs (cells with negative zone IDs are outside all zones)
+    :param bands: List of float arrays of values, each the same shape as zones
+    :param n_zones: Number of zones (zone IDs run from 0 to n_zones - 1)
+    :return: Array (bands x zones) of sums, array (bands x zones) of cell counts
+    """
+    zones = np.asarray(zones).ravel()
+    in_zone = (zones >= 0) & (zones < n_zones)
+    zone_ids = zones[in_zone].astype(np.int64)
+    n_bands = len(bands)
+    values = np.vstack([np.asarray(band).ravel()[in_zone] for band in bands])
+    has_data = ~np.isnan(values)
+    keys = (np.arange(n_bands, dtype=np.int64)[:, np.newaxis] * n_zones + zone_ids)[has_data]
+    sums = np.bincount(keys, weights=values[has_data].astype(np.float64), minlength=n_bands * n_zones)
+    counts = np.bincount(keys, minlength=n_bands * n_zones)
+    return sums.reshape(n_bands, n_zones), counts.reshape(n_bands, n_zones)
+
+
+def zonal_sum_count(zones, values, n_zones):
+    """
+    Sums values and counts cells with data within each zone, ignoring NaN (NODATA) cells. Results for separate blocks
+    of a grid can be added together.
+    :param zones: Integer array of zone IDs (cells with negative zone IDs are outside all zones)
+    :param values: Float array of values, same shape as zones
+    :param n_zones: Number of zones (zone IDs run from 0 to n_zones - 1)
+    :return: Array of sum for each zone, array of cell count for each zone
+    """
+    sums, counts = zonal_band_sums(zones, [values], n_zones)
+    return sums[0], counts[0]
+
+
+def zonal_mean(zones, values, n_zones):
+    """
+    Calculates the mean of values within each zone, ignoring NaN (NODATA) cells
+    :param zones: Integer array of zone IDs (cells with negative zone IDs are outside all zones)
+    :param values: Float array of values, same shape as zones
+    :param n_zones: Number of zones (zone IDs run from 0 to n_zones - 1)
+    :return: Array of mean value for each zone, with NaN for zones without data
+    """
+    sums, counts = zonal_sum_count(zones, values, n_zones)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return sums / counts
+
+
+def zonal_max(zones, values, n_zones):
+    """
+    Finds the maximum of values within each zone, ignoring NaN (NODATA) cells
+    :param zones: Integer array of zone IDs (cells with negative zone IDs are outside all zones)
+    :param values: Float array of values, same shape as zones
+    :param n_zones: Number of zones (zone IDs run from 0 to n_zones - 1)
+    :return: Array of maximum value for each zone, with NaN for zones without data
+    """
+    zones = np.asarray(zones).ravel()
+    values = np.asarray(values).ravel()
+    keep = (zones >= 0) & (zones < n_zones) & ~np.isnan(values)
+    zone_ids = zones[keep].astype(np.int64)
+    values = values[keep].astype(np.float64)
+    maximums = np.full(n_zones, np.nan)
+    if len(zone_ids) > 0:
+        # sort cells by zone so each zone is a contiguous run that can be reduced at once
+        order = np.argsort(zone_ids, kind="mergesort")
+        zone_ids = zone_ids[order]
+        starts = np.concatenate(([0], np.nonzero(np.diff(zone_ids))[0] + 1))
+        maximums[zone_ids[starts]] = np.maximum.reduceat(values[order], starts)
+    return maximums
+
+
+def window_max_at_points(values, rows, cols, radius, row_offset=0):
+    """
+    Finds the maximum of values in the cells whose centres lie within a radius of each point, ignoring NaN (NODATA)
+    cells. Points are handled independently, so windows can overlap and extend past the edge of the grid.
+    :param values: 2D float array of values (a band of full-width rows of a grid, starting at row_offset)
+    :param rows: Array of point positions down the grid, in cells (the top edge of the grid is 0, so cell i's centre
+                 is at i + 0.5)
+    :param cols: Array of point positions across the grid, in cells (the left edge of the grid is 0)
+    :param radius: Window radius, in cells
+    :param row_offset: Grid row of the first row of values; cells outside the band are treated as NODATA
+    :return: Array of maximum value for each point, with NaN for points without data in their window
+    """
+    rows = np.asarray(rows, dtype=np.float64).ravel()
+    cols = np.asarray(cols, dtype=np.float64).ravel()
+    maximums = np.full(len(rows), np.nan)
+    # offsets of every cell that could have its centre within the radius of a point anywhere in the centre cell
+    half = int(math.ceil(radius)) + 1
+    window = np.arange(-half, half + 1)
+    row_offsets = np.repeat(window, len(window))
+    col_offsets = np.tile(window, len(window))
+    valid = np.nonzero(np.isfinite(rows) & np.isfinite(cols))[0]
+    chunk = max(1, POINT_WINDOW_CELLS // len(row_offsets))
+    for start in range(0, len(valid), chunk):
+        points = valid[start:start+chunk]
+        point_rows = rows[points][:, np.newaxis]
+        point_cols = cols[points][:, np.newaxis]
+        cell_rows = np.floor(point_rows).astype(np.int64) + row_offsets
+        cell_cols = np.floor(point_cols).astype(np.int64) + col_offsets
+        inside = ((cell_rows + 0.5 - point_rows) ** 2 + (cell_cols + 0.5 - point_cols) ** 2 <= radius ** 2) & \
+                 (cell_rows >= row_offset) & (cell_rows < row_offset + values.shape[0]) & \
+                 (cell_cols >= 0) & (cell_cols < values.shape[1])
+        window_values = np.full(inside.shape, -np.inf)
+        window_values[inside] = values[cell_rows[inside] - row_offset, cell_cols[inside]]
+        window_values[np.isnan(window_values)] = -np.inf
+        point_max = window_values.max(axis=1)
+        point_max[np.isneginf(point_max)] = np.nan
+        maximums[points] = point_max
+    return maximums
+
+
+def compile_remap(remap, nodata=RASTER_NODATA):
+    """
+    Compiles a remap table into a dense lookup array indexed by input value minus the smallest input value
+    :param remap: Dictionary of output value to list of input values; input values listed under None map to nodata
+    :param nodata: Output value for input values listed under None
+    :return: Smallest input value, lookup array (input values not in the table map to REMAP_UNKNOWN)
+    """
+    inputs = [value for values in remap.values() for value in values]
+    if len(set(inputs)) < len(inputs):
+        raise Exception("ERROR: Remap table lists the same input value more than once.")
+    offset = min(inputs)
+    lut = np.full(max(inputs) - offset + 1, REMAP_UNKNOWN, dtype=np.int32)
+    for output, values in remap.items():
+        lut[np.array(values, dtype=np.int64) - offset] = nodata if output is None else output
+    return offset, lut
+
+
+def apply_remap(values, offset, lut):
+    """
+    Remaps integer values with a compiled remap table
+    :param values: Integer array of input values
+    :param offset: Smallest input value in the remap table (see compile_remap)
+    :param lut: Compiled remap lookup array (see compile_remap)
+    :return: Array of output values, same shape as values
+    """
+    values = np.asarray(values, dtype=np.int64)
+    index = values - offset
+    in_table = (index >= 0) & (index < len(lut))
+    remapped = np.full(values.shape, REMAP_UNKNOWN, dtype=np.int32)
+    remapped[in_table] = lut[index[in_table]]
+    unknown = remapped == REMAP_UNKNOWN
+    if unknown.any():
+        raise Exception("ERROR: Values not found in remap table: " + ", ".join(str(value) for value in np.unique(values[unknown])))
+    return remapped
+
+
+def read_attribute_luts(raster, fields):
+    """
+    Parses a raster attribute table once into dense value to attribute lookup arrays
+    :param raster: Classified raster with attribute table (e.g., LANDFIRE existing or historic vegetation)
+    :param fields: Attribute table fields to make lookups for
+    :return: Smallest raster value (lookups are indexed by raster value minus this), dictionary of field to lookup
+    """
+    with arcpy.da.SearchCursor(raster, ["VALUE"] + fields) as cursor:
+        rows = [row for row in cursor]
+    values = np.array([row[0] for row in rows], dtype=np.int64)
+    offset = values.min()
+    luts = {}
+    for i, field in enumerate(fields):
+        lut = np.full(values.max() - offset + 1, np.nan, dtype=np.float32)
+        lut[values - offset] = [np.nan if row[i+1] is None else row[i+1] for row in rows]
+        luts[field] = lut
+    return offset, luts
+
+
+class AttributeLookup(object):
+    """
+    Lookups from the values of a classified raster to attributes in its attribute table
+    """
+    def __init__(self, raster, fields, grid_raster=None):
+        """
+        :param raster: Classified raster with attribute table (e.g., LANDFIRE existing or historic vegetation)
+        :param fields: Attribute table fields to make lookups for
+        :param grid_raster: Copy of the raster resampled onto the zone grid, read in place of the raster if it is on
+        another grid (optional, see snap_to_grid)
+        """
+        self.raster = raster if grid_raster is None else grid_raster
+        self.fields = fields
+        self.offset, self.luts = read_attribute_luts(raster, fields)
+        self.lut_size = len(self.luts[fields[0]])
+        # NODATA cells are read as a value just outside the attribute table so they don't match any lookup
+        self.nodata = self.offset - 1 if self.offset > 0 else self.offset + self.lut_size
+
+    def read_block(self, zone_grid, row_start, nrows):
+        """
+        Reads a block of full-width rows of the raster and looks up attributes for each cell
+        :param zone_grid: ZoneGrid the raster is snapped to
+        :param row_start: First row of the block (row 0 is the top of the grid)
+        :param nrows: Number of rows in the block
+        :return: Dictionary of field to float array (nrows x grid columns), with NaN for NODATA cells
+        """
+        index = zone_grid.read_block(self.raster, row_start, nrows, self.nodata).astype(np.int64) - self.offset
+        valid = (index >= 0) & (index < self.lut_size)
+        block = {}
+        for field in self.fields:
+            block[field] = np.full(index.shape, np.nan, dtype=np.float32)
+            block[field][valid] = self.luts[field][index[valid]]
+        return block
+
+
+def veg_lookup_arrays(veg, fields, zone_grid, block_rows=1024, grid_raster=None):
+    """
+    Makes lookup arrays for several attributes of a classified raster, reading the raster only once
+    :param veg: Classified raster with attribute table (e.g., LANDFIRE existing or historic vegetation)
+    :param fields: Attribute table fields to make lookups for
+    :param zone_grid: ZoneGrid the raster is snapped to
+    :param block_rows: Number of raster rows read at a time
+    :param grid_raster: Copy of the raster resampled onto the zone grid (optional, see AttributeLookup)
+    :return: Dictionary of field to float array covering the zone grid, with NaN for NODATA cells
+    """
+    veg_lookup = AttributeLookup(veg, fields, grid_raster)
+    lookups = dict((field, np.empty((zone_grid.nrows, zone_grid.ncols), dtype=np.float32)) for field in fields)
+    for row_start, nrows in zone_grid.blocks(block_rows):
+        block = veg_lookup.read_block(zone_grid, row_start, nrows)
+        for field in fields:
+            lookups[field][row_start:row_start+nrows] = block[field]
+    return lookups
+
+
+def reach_midpoints(network):
+    """
+    Finds the point halfway along each reach of a network
+    :param network: Network shapefile
+    :return: Arrays of x and y coordinates of each reach midpoint, in FID order (NaN for reaches without geometry)
+    """
+    n_reaches = int(arcpy.GetCount_management(network).getOutput(0))
+    x = np.full(n_reaches, np.nan)
+    y = np.full(n_reaches, np.nan)
+    with arcpy.da.SearchCursor(network, ["FID", "SHAPE@"]) as cursor:
+        for fid, shape in cursor:
+            if shape is not None:
+                midpoint = shape.positionAlongLine(0.5, True).firstPoint
+                x[fid] = midpoint.X
+                y[fid] = midpoint.Y
+    return x, y
+
+
+def midpoint_window_max(network, raster, radius):
+    """
+    Finds the maximum raster value within a radius of each reach midpoint (e.g., drainage area at each reach), in
+    place of buffering the midpoints and running zonal statistics on the buffers. Midpoints are handled in order down
+    the raster, and only the band of rows around each group of midpoints (at most POINT_BAND_CELLS cells, unless a
+    single midpoint's window needs more) is read at a time.
+    :param network: Network shapefile, in the same projection as the raster
+    :param raster: Raster to sample
+    :param radius: Search radius around each midpoint, in meters
+    :return: Array of maximum value for each reach, in FID order (NaN for reaches without data nearby)
+    """
+    grid = ZoneGrid(raster, 0)
+    meters_per_unit = arcpy.Describe(network).spatialReference.metersPerUnit or 1.0
+    x, y = reach_midpoints(network)
+    top = grid.lower_left.Y + grid.nrows * grid.cell_size
+    rows = (top - y) / grid.cell_size
+    cols = (x - grid.lower_left.X) / grid.cell_size
+    radius_cells = radius / meters_per_unit / grid.cell_size
+    raster_rows = RasterRows(raster, grid)
+    maximums = np.full(len(rows), np.nan)
+    # rows above and below a midpoint's own row that its window can reach (as in window_max_at_points)
+    half = int(math.ceil(radius_cells)) + 1
+    band_rows = max(2 * half + 1, POINT_BAND_CELLS // grid.ncols)
+    valid = np.nonzero(np.isfinite(rows) & np.isfinite(cols))[0]
+    point_rows = np.floor(rows[valid]).astype(np.int64)
+    order = np.argsort(point_rows, kind="mergesort")
+    valid, point_rows = valid[order], point_rows[order]
+    start = 0
+    while start < len(valid):
+        # group the next midpoints whose windows all fit within a band of band_rows rows
+        end = max(start + 1, np.searchsorted(point_rows, point_rows[start] + band_rows - 2 * half))
+        row_start = max(point_rows[start] - half, 0)
+        row_end = min(point_rows[end-1] + half + 1, grid.nrows)
+        if row_end > row_start:
+            points = valid[start:end]
+            maximums[points] = window_max_at_points(raster_rows[row_start:row_end], rows[points], cols[points],
+                                                    radius_cells, row_start)
+        start = end
+    return maximums
+
+
+def make_reach_table(n_reaches, fields):
+    """
+    Makes an in-memory table of reach attributes, with one record per reach in FID order
+    :param n_reaches: Number of reaches in the network
+    :param fields: List of (field name, numpy type) for each attribute, in output field order
+    :return: Structured array with an FID field and the given fields, all set to 0
+    """
+    reach_table = np.zeros(n_reaches, dtype=[("FID", np.int32)] + fields)
+    reach_table["FID"] = np.arange(n_reaches)
+    return reach_table
+
+
+def write_reach_table(network, reach_table):
+    """
+    Adds all fields of a reach table to a network in a single write, replacing any fields with the same names
+    :param network: Network shapefile, with reaches in the same FID order as the reach table
+    :param reach_table: Structured array of reach attributes with an FID field (see make_reach_table)
+    """
+    table_fields = [name for name in reach_table.dtype.names if name != "FID"]
+    existing_fields = [f.name for f in arcpy.ListFields(network) if f.name in table_fields]
+    if len(existing_fields) > 0:
+        arcpy.DeleteField_management(network, existing_fields)
+    arcpy.da.ExtendTable(network, "FID", reach_table, "FID")
+
+
+def rasterize_polygons(polygons, zone_grid, out_raster, value_field=None):
+    """
+    Rasterizes polygons onto a zone grid, e.g., to use as a mask. Cells within the polygons hold the polygon's
+    object ID (or value field) and cells outside are NODATA.
+    :param polygons: Polygons to rasterize (e.g., large river polygons)
+    :param zone_grid: ZoneGrid to rasterize the polygons onto
+    :param out_raster: Path for rasterized polygons (can be in the in_memory workspace)
+    :param value_field: Field holding the cell value for each polygon (optional; defaults to the object ID)
+    :return: Path to rasterized polygons
+    """
+    if value_field is None:
+        value_field = arcpy.Describe(polygons).OIDFieldName
+    old_extent, old_snap_raster = arcpy.env.extent, arcpy.env.snapRaster
+    arcpy.env.extent = zone_grid.zone_raster
+    arcpy.env.snapRaster = zone_grid.zone_raster
+    try:
+        arcpy.PolygonToRaster_conversion(polygons, value_field, out_raster, "CELL_CENTER", "", zone_grid.cell_size)
+    finally:
+        arcpy.env.extent, arcpy.env.snapRaster = old_extent, old_snap_raster
+    return out_raster
+
+
+def slope_raster(dem, out_raster, slope_file, smoothing_cells=DEM_SMOOTHING_CELLS):
+    """
+    Smooths a DEM and calculates its slope in degrees with numpy (see Hydrology.smoothed_slope), in place of Spatial
+    Analyst FocalStatistics and Slope. The DEM is read a tile of rows at a time and the slope is written to a memory
+    mapped file, so neither is held in memory in full.
+    :param dem: Path to DEM raster
+    :param out_raster: Path for slope raster
+    :param slope_file: Path for the memory mapped slope array (e.g., in a temporary folder)
+    :param smoothing_cells: Width of the window (in cells) the DEM is smoothed over first
+    :return: ZoneGrid of the DEM and float32 memory mapped array of slope (delete it before deleting its file)
+    """
+    grid = ZoneGrid(dem, 0)
+    raster = arcpy.Raster(dem)
+    slope = np.memmap(slope_file, dtype=np.float32, mode="w+", shape=(grid.nrows, grid.ncols))
+    smoothed_slope(RasterRows(dem, grid), raster.meanCellWidth, raster.meanCellHeight, smoothing_cells, out=slope)
+    block_rows = max(1, WINDOW_TILE_CELLS // grid.ncols)
+    grid.save_blocks(((row_start, slope[row_start:row_start+nrows]) for row_start, nrows in grid.blocks(block_rows)),
+                     out_raster)
+    return grid, slope
+
+
+def valley_raster(slope, buffer, slope_thresh, dem_grid, out_raster):
+    """
+    Finds cells within a buffer with slope at or below a threshold, a block of rows at a time
+    :param slope: Array (e.g., memory mapped) of slope (degrees) on the DEM grid
+    :param buffer: Network buffer polygons
+    :param slope_thresh: Slope threshold (degrees)
+    :param dem_grid: ZoneGrid of the DEM
+    :param out_raster: Path for output raster
+    :return: Path to raster with 1 for low slope cells within the buffer and NODATA elsewhere
+    """
+    buffer_raster = rasterize_polygons(buffer, dem_grid, os.path.splitext(out_raster)[0] + "_buffer.tif")
+
+    def valley_blocks():
+        for row_start, nrows in dem_grid.blocks(max(1, WINDOW_TILE_CELLS // dem_grid.ncols)):
+            in_buffer = dem_grid.read_block(buffer_raster, row_start, nrows, -1) >= 0
+            with np.errstate(invalid='ignore'):
+                valley = in_buffer & (slope[row_start:row_start+nrows] <= float(slope_thresh))
+            yield row_start, np.where(valley, 1, -9999).astype(np.int16)
+
+    dem_grid.save_blocks(valley_blocks(), out_raster, -9999)
+    arcpy.Delete_management(buffer_raster)
+    return out_raster
+
+
+def drainage_area_raster(dem, out_raster, smoothing_cells=DEM_SMOOTHING_CELLS):
+    """
+    Calculates drainage area from a DEM raster with numpy (see Hydrology.drainage_area), in place of Spatial Analyst
+    FocalStatistics, Fill, FlowDirection and FlowAccumulation
+    :param dem: DEM raster (in meters)
+    :param out_raster: Path for drainage area raster (square kilometers)
+    :param smoothing_cells: Width of the window (in cells) the DEM is smoothed over first (0 for no smoothing)
+    :return: Path to drainage area raster
+    """
+    if drainage_area_algorithm(dem) == DRAIN_AREA_FALLBACK_ALGORITHM:
+        arcpy.AddMessage("\t DEM is too large to calculate drainage area in memory, using Spatial Analyst instead")
+        return spatial_analyst_drainage_area(dem, out_raster, smoothing_cells)
+    grid = ZoneGrid(dem, 0)
+    raster = arcpy.Raster(dem)
+    values = grid.read_values(dem)
+    if smoothing_cells:
+        values = smoothed_dem(values, smoothing_cells)
+    return grid.save(drainage_area(values, raster.meanCellWidth, raster.meanCellHeight), out_raster)
+
+
+def drainage_area_algorithm(dem):
+    """
+    :param dem: DEM raster
+    :return: DRAIN_AREA_ALGORITHM, or DRAIN_AREA_FALLBACK_ALGORITHM if calculating drainage area for the DEM in memory
+    would need more than DRAIN_AREA_MEMORY_MB
+    """
+    raster = arcpy.Raster(dem)
+    memory = (raster.width * raster.height * DRAIN_AREA_BYTES_PER_CELL + FILL_TILE_CELLS * 100) / (1024.0 * 1024.0)
+    return DRAIN_AREA_ALGORITHM if memory <= DRAIN_AREA_MEMORY_MB else DRAIN_AREA_FALLBACK_ALGORITHM
+
+
+def spatial_analyst_drainage_area(dem, out_raster, smoothing_cells=DEM_SMOOTHING_CELLS):
+    """
+    Calculates drainage area from a DEM raster with Spatial Analyst FocalStatistics, Fill, FlowDirection and
+    FlowAccumulation, for DEMs too large for drainage_area_raster
+    :param dem: DEM raster (in meters)
+    :param out_raster: Path for drainage area raster (square kilometers)
+    :param smoothing_cells: Width of the window (in cells) the DEM is smoothed over first (0 for no smoothing)
+    :return: Path to drainage area raster
+    """
+    desc = arcpy.Describe(dem)
+    smoothed = dem
+    if smoothing_cells:
+        neighborhood = arcpy.sa.NbrRectangle(smoothing_cells, smoothing_cells, "CELL")
+        smoothed = arcpy.sa.ExtractByMask(arcpy.sa.FocalStatistics(dem, neighborhood, "MEAN"), dem)
+    flow_accumulation = arcpy.sa.FlowAccumulation(arcpy.sa.FlowDirection(arcpy.sa.Fill(smoothed)))
+    drain_area = flow_accumulation * (desc.meanCellWidth * desc.meanCellHeight / 1000000.0)
+    arcpy.CopyRaster_management(drain_area, out_raster)
+    return out_raster
+
+
+def cached_drainage_area(dem, out_raster, cache_folder=None, max_cache_mb=DRAIN_AREA_CACHE_MAX_MB):
+    """
+    Gets drainage area for a DEM from the drainage area cache, or calculates it with drainage_area_raster and adds it
+    to the cache. Cached rasters are named by a hash of the DEM's values and grid, the smoothing and the drainage area
+    calculation, and each has a JSON manifest beside it recording what it was made from and when it was last used.
+    :param dem: DEM raster (in meters), before smoothing
+    :param out_raster: Path to copy the drainage area raster (square kilometers) to
+    :param cache_folder: Folder holding cached drainage area rasters (optional; defaults to the folder named by the
+    RCAT_DRAIN_AREA_CACHE environment variable, or the Flow folder beside the DEM)
+    :param max_cache_mb: Size cap for the cache folder (MB)
+    :return: Path to drainage area raster
+    """
+    if cache_folder is None:
+        cache_folder = os.environ.get(DRAIN_AREA_CACHE_VARIABLE,
+                                      os.path.join(arcpy.Describe(dem).path, "Flow", "DrainAreaCache"))
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    dem_hash = dem_content_key(dem)
+    algorithm = drainage_area_algorithm(dem)
+    key = hashlib.md5("{0} {1} {2} {3}".format(dem_hash, grid_key(dem), DEM_SMOOTHING_CELLS,
+                                               algorithm).encode("utf-8")).hexdigest()[:16]
+    cached_raster = os.path.join(cache_folder, "DrainArea_" + key + ".tif")
+    manifest_file = os.path.join(cache_folder, "DrainArea_" + key + ".json")
+
+    if os.path.exists(manifest_file) and arcpy.Exists(cached_raster):
+        arcpy.AddMessage("\t Using cached drainage area raster " + cached_raster)
+        manifest = read_manifest(manifest_file)
+        manifest["last_used"] = time.time()
+        manifest["uses"] = manifest.get("uses", 0) + 1
+        write_manifest(manifest_file, manifest)
+    else:
+        drainage_area_raster(dem, cached_raster)
+        # the manifest is written last, so a raster is only used once it has been completely written
+        write_manifest(manifest_file, {"dem": arcpy.Describe(dem).catalogPath, "dem_hash": dem_hash, "grid": grid_key(dem),
+                                       "smoothing_cells": DEM_SMOOTHING_CELLS, "algorithm": algorithm,
+                                       "created": time.time(), "last_used": time.time(), "uses": 0})
+        evict_cached_drainage_areas(cache_folder, max_cache_mb, keep=manifest_file)
+
+    arcpy.CopyRaster_management(cached_raster, out_raster)
+    return out_raster
+
+
+def dem_content_key(dem):
+    """
+    Hashes the cell values of a DEM, reading it in blocks of rows
+    :param dem: DEM raster
+    :return: Hex string key
+    """
+    grid = ZoneGrid(dem, 0)
+    key = hashlib.md5()
+    for row_start, nrows in grid.blocks(max(1, HASH_BLOCK_CELLS // grid.ncols)):
+        key.update(np.ascontiguousarray(grid.read_block(dem, row_start, nrows, RASTER_NODATA)).tobytes())
+    return key.hexdigest()
+
+
+def read_manifest(manifest_file):
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest_file, manifest):
+    # write to a temporary file first so a run sharing the cache never reads a partly written manifest
+    temp_file = manifest_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    os.rename(temp_file, manifest_file)
+
+
+def evict_cached_drainage_areas(cache_folder, max_cache_mb, keep=None):
+    """
+    Deletes the least recently used cached drainage area rasters (and their manifests) until the cache is under its
+    size cap
+    :param cache_folder: Folder holding cached drainage area rasters
+    :param max_cache_mb: Size cap for the cache folder (MB)
+    :param keep: Manifest of a raster not to delete (optional)
+    """
+    entries = []
+    for manifest_file in glob.glob(os.path.join(cache_folder, "DrainArea_*.json")):
+        try:
+            last_used = read_manifest(manifest_file)["last_used"]
+        except (IOError, OSError, ValueError, KeyError):
+            last_used = os.path.getmtime(manifest_file)
+        entry_files = glob.glob(os.path.splitext(manifest_file)[0] + ".*")
+        entries.append((last_used, manifest_file, sum(os.path.getsize(f) for f in entry_files)))
+    cache_size = sum(size for last_used, manifest_file, size in entries)
+    for last_used, manifest_file, size in sorted(entries):
+        if cache_size <= max_cache_mb * 1024 * 1024:
+            break
+        if manifest_file == keep:
+            continue
+        arcpy.AddMessage("\t Removing least recently used drainage area raster " + os.path.basename(manifest_file))
+        try:
+            os.remove(manifest_file)
+            arcpy.Delete_management(os.path.splitext(manifest_file)[0] + ".tif")
+        except OSError:
+            # another run may be reading (Windows) or have already deleted it
+            pass
+        cache_size -= size
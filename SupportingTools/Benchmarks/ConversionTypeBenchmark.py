@@ -0,0 +1,156 @@
+# -------------------------------------------------------------------------------
+# Name:        Conversion Type Benchmark
+# Purpose:     Times RVD.classify_conversion against the per-reach loop RVD used to classify conversion types before it
+#              was vectorized, and checks that both give the same conversion codes
+#
+# Usage:       python ConversionTypeBenchmark.py [number of reaches]
+#              (from an ArcGIS python, since RVD imports arcpy)
+# -------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import numpy as np
+# RVD is in the RCAT folder two levels up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from RVD import classify_conversion, CONVERSION_FIELD_SUFFIXES
+
+
+def classify_conversion_loop(array0, array35, array50, array60, array80, array97, array98, array99, arrayMin50):
+    """
+    The per-reach conversion type loop from RVD before classify_conversion, copied unchanged
+    :param array0: Array of no change proportions for each reach
+    :param array35: Array of conversion to deciduous proportions
+    :param array50: Array of conversion to grass/shrubland proportions
+    :param array60: Array of devegetation proportions
+    :param array80: Array of conifer encroachment proportions
+    :param array97: Array of conversion to invasive proportions
+    :param array98: Array of development proportions
+    :param array99: Array of conversion to agriculture proportions
+    :param arrayMin50: Array of riparian expansion proportions
+    :return: Array of conversion codes for each reach
+    """
+    out_conv_code = np.zeros(len(array0), dtype=np.float64)
+    for i in range(len(array0)):
+        if array0[i] >= 0.85:  # if no change proportion is greater than or equal to 0.9
+            out_conv_code[i] = 1  # no change
+        else:  # if no change proportion is less than 0.9, move on to next greatest proportion
+            if array35[i] > array50[i] and array35[i] > array60[i] and array35[i] > array80[i] and array35[i] > array97[i] and array35[i] > array98[i] and array35[i] > array99[i] and array35[i] > arrayMin50[i]:  # if deciduous/hardwood is next most dominant
+                if array35[i] <= 0.10:
+                    out_conv_code[i] = 80 # very minor conversion to deciduous/hardwood forest
+                elif array35[i] <= 0.25 and array35[i] > 0.1:
+                    out_conv_code[i] = 81  # minor conversion to deciduous/hardwood forest
+                elif array35[i] > 0.25 and array35[i] <= 0.5:
+                    out_conv_code[i] = 82  # moderate conversion to deciduous/hardwood forest
+                else:
+                    out_conv_code[i] = 83  # significant conversion to deciduous/hardwood forest
+            elif array50[i] > array35[i] and array50[i] > array60[i] and array50[i] > array80[i] and array50[i] > array97[i] and array50[i] > array98[i] and array50[i] > array99[i] and array50[i] > arrayMin50[i]:  # if grass/shrubland is next most dominant
+                if array50[i] <= 0.10:
+                    out_conv_code[i] = 10 # very minor conversion to grass/shrubland
+                elif array50[i] <= 0.25 and array50[i] > 0.1:
+                    out_conv_code[i] = 11  # minor conversion to grass/shrubland
+                elif array50[i] > 0.25 and array50[i] <= 0.5:
+                    out_conv_code[i] = 12  # moderate conversion to grass/shrubland
+                else:
+                    out_conv_code[i] = 13  # significant conversion to grass/shrubland
+            elif array60[i] > array35[i] and array60[i] > array50[i] and array60[i] > array80[i] and array60[i] > array97[i] and array60[i] > array98[i] and array60[i] > array99[i] and array60[i] > arrayMin50[i]:  # if barren is next most dominant
+                if array60[i] <= 0.10:
+                    out_conv_code[i] = 20 # very minor devegetation
+                elif array60[i] <= 0.25 and array60[i] > 0.1:
+                    out_conv_code[i] = 21  # minor devegetation
+                elif array60[i] > 0.25 and array60[i] <= 0.5:
+                    out_conv_code[i] = 22  # moderate devegetation
+                else:
+                    out_conv_code[i] = 23  # significant devegetation
+            elif array80[i] > array35[i] and array80[i] > array50[i] and array80[i] > array60[i] and array80[i] > array97[i] and array80[i] > array98[i] and array80[i] > array99[i] and array80[i] > arrayMin50[i]:  # if conifer encroachment is next most dominant
+                if array80[i] <= 0.10:
+                    out_conv_code[i] = 30 # very minor conifer encroachment
+                elif array80[i] <= 0.25 and array80[i] > 0.1:
+                    out_conv_code[i] = 31  # minor conifer encroachment
+                elif array80[i] > 0.25 and array80[i] <= 0.5:
+                    out_conv_code[i] = 32  # moderate conifer encroachment
+                else:
+                    out_conv_code[i] = 33  # significant conifer encroachment
+            elif array97[i] > array35[i] and array97[i] > array50[i] and array97[i] > array60[i] and array97[i] > array80[i] and array97[i] > array98[i] and array97[i] > array99[i] and array97[i] > arrayMin50[i]:  # if conversion to invasive is next most dominant
+                if array97[i] <= 0.10:
+                    out_conv_code[i] = 40 # very minor conversion to invasive
+                elif array97[i] <= 0.25 and array97[i] > 0.1:
+                    out_conv_code[i] = 41  # minor conversion to invasive
+                elif array97[i] > 0.25 and array97[i] <= 0.5:
+                    out_conv_code[i] = 42  # moderate conversion to invasive
+                else:
+                    out_conv_code[i] = 43  # significant conversion to invasive
+            elif array98[i] > array35[i] and array98[i] > array50[i] and array98[i] > array60[i] and array98[i] > array80[i] and array98[i] > array97[i] and array98[i] > array99[i] and array98[i] > arrayMin50[i]:  # if urbanization is next most dominant
+                if array98[i] <= 0.10:
+                    out_conv_code[i] = 50 # very minor urbanization
+                elif array98[i] <= 0.25 and array98[i] > 0.1:
+                    out_conv_code[i] = 51  # minor urbanization
+                elif array98[i] > 0.25 and array98[i] <= 0.5:
+                    out_conv_code[i] = 52  # moderate urbanization
+                else:
+                    out_conv_code[i] = 53  # significant urbanization
+            elif array99[i] > array35[i] and array99[i] > array50[i] and array99[i] > array60[i] and array99[i] > array80[i] and array99[i] > array97[i] and array99[i] > array98[i] and array99[i] > arrayMin50[i]:  # if conversion to agriculture is next most dominant
+                if array99[i] <= 0.10:
+                    out_conv_code[i] = 60 # very minor conversion to agriculture
+                elif array99[i] <= 0.25 and array99[i] > 0.1:
+                    out_conv_code[i] = 61  # minor conversion to agriculture
+                elif array99[i] > 0.25 and array99[i] <= 0.5:
+                    out_conv_code[i] = 62  # moderate conversion to agriculture
+                else:
+                    out_conv_code[i] = 63  # significant conversion to agriculture
+            elif arrayMin50[i] > array35[i] and arrayMin50[i] > array50[i] and arrayMin50[i] > array60[i] and arrayMin50[i] > array80[i] and arrayMin50[i] > array97[i] and arrayMin50[i] > array98[i] and arrayMin50[i] > array99[i]:  # if riparian expansion is next most dominant
+                if arrayMin50[i] <= 0.10:
+                    out_conv_code[i] = 70 # very minor riparian expansion
+                elif arrayMin50[i] <= 0.25 and arrayMin50[i] > 0.1:
+                    out_conv_code[i] = 71  # minor riparian expansion
+                elif arrayMin50[i] > 0.25 and arrayMin50[i] <= 0.5:
+                    out_conv_code[i] = 72  # moderate riparian expansion
+                else:
+                    out_conv_code[i] = 73  # significant riparian expansion
+            else:
+                out_conv_code[i] = 0
+
+
+    return out_conv_code
+
+
+def synthetic_proportions(n_reaches, seed=0):
+    """
+    Makes synthetic conversion proportions, including ties, values exactly on the thresholds and NaN proportions
+    :param n_reaches: Number of synthetic reaches
+    :param seed: Random seed
+    :return: Array (reaches x 9) of proportions, in the order of CONVERSION_FIELD_SUFFIXES
+    """
+    random = np.random.RandomState(seed)
+    props = random.uniform(0, 1, (n_reaches, len(CONVERSION_FIELD_SUFFIXES)))
+    props /= props.sum(axis=1)[:, np.newaxis]
+    # no change proportions around the no change threshold
+    props[::7, 0] = random.choice([0.84, 0.85, 0.86], len(props[::7]))
+    # dominant conversions exactly on the magnitude thresholds
+    rows = np.arange(1, n_reaches, 11)
+    props[rows, 1:] = 0.01
+    props[rows, random.randint(1, 9, len(rows))] = random.choice([0.1, 0.25, 0.5], len(rows))
+    # two conversion types tied for dominant
+    rows = np.arange(2, n_reaches, 13)
+    props[rows, 3] = props[rows, 5] = props[rows, 1:].max(axis=1)
+    props[3::17, random.randint(0, 9)] = np.nan
+    return props
+
+
+def main(n_reaches=200000):
+    props = synthetic_proportions(n_reaches)
+    start = time.time()
+    loop_codes = classify_conversion_loop(*[props[:, i] for i in range(props.shape[1])])
+    loop_time = time.time() - start
+    start = time.time()
+    codes = classify_conversion(props)
+    vectorized_time = time.time() - start
+    if not np.array_equal(codes, loop_codes):
+        raise Exception("ERROR: classify_conversion differs from the per-reach loop for {0} of {1} reaches".format(
+            int((codes != loop_codes).sum()), n_reaches))
+    print("classify_conversion: {0} reaches in {1:.3f} s; per-reach loop: {2:.3f} s; codes identical".format(
+        n_reaches, vectorized_time, loop_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
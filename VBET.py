@@ -21,6 +21,8 @@ import projectxml
 import RCAT_Drainage_Area_Check as DA_Check
 from shutil import rmtree
 import glob
+import numpy as np
+from SupportingFunctions import cached_drainage_area, midpoint_window_max, slope_raster, valley_raster
 arcpy.CheckOutExtension("Spatial")
 
 
@@ -32,130 +34,21 @@ def parseInputBool(given_input):
 
 
 # calculate drainage area function
-def calc_drain_area(smDEM, flowDir):
+def calc_drain_area(DEM, flowDir):
 
-    #  define raster environment settings
-    desc = arcpy.Describe(smDEM)
-    arcpy.env.cellSize = desc.meanCellWidth
-
-    #  calculate cell area for use in drainage area calcultion
-    height = desc.meanCellHeight
-    width = desc.meanCellWidth
-    cellArea = height * width
-
-    # derive drainage area raster (in square km) from input DEM
+    # get drainage area raster (in square km) for input DEM from the drainage area cache, or derive it from the
+    # smoothed DEM (fill, flow direction and flow accumulation)
     # note: draiange area calculation assumes input dem is in meters
-    filled_DEM = Fill(smDEM)  # fill sinks in dem
-    flow_direction = FlowDirection(filled_DEM) # calculate flow direction
-    flow_accumulation = FlowAccumulation(flow_direction) # calculate flow accumulattion
-    DrainArea = flow_accumulation * cellArea / 1000000 # calculate drainage area in square kilometers
-
-    # save drainage area raster
-    if os.path.exists(os.path.join(flowDir, "DrainArea_sqkm.tif")):
-        arcpy.Delete_management(os.path.join(flowDir, "DrainArea_sqkm.tif"))
-        arcpy.CopyRaster_management(DrainArea, os.path.join(flowDir, "DrainArea_sqkm.tif"))
-    else:
-        arcpy.CopyRaster_management(DrainArea, os.path.join(flowDir, "DrainArea_sqkm.tif"))
+    drain_area_path = os.path.join(flowDir, "DrainArea_sqkm.tif")
+    if os.path.exists(drain_area_path):
+        arcpy.Delete_management(drain_area_path)
+    cached_drainage_area(DEM, drain_area_path)
 
 
 def getUUID():
     return str(uuid.uuid4()).upper()
 
 
-# zonal statistics within buffer function
-# dictionary join field function
-def zonalStatsWithinBuffer(buffer, ras, statType, statField, outFC, outFCField, scratch):
-    # get input raster stat value within each buffer
-    # note: zonal stats as table does not support overlapping polygons so we will check which
-    #       reach buffers output was produced for and which we need to run tool on again
-
-    # Check if this network is coming from Riverscapes Context, which has a different Reach ID Field
-    if 'ReachCode' in [field.name for field in arcpy.ListFields(buffer)] and 'ReachCode' in [field.name for field in arcpy.ListFields(outFC)]:
-
-        # Need to convert the ReachCode field from a string to a shorter, usable number
-        id_field = 'RchCode_L'
-
-        # Delete the field if it's already there
-        if id_field in [field.name for field in arcpy.ListFields(buffer)]:
-            arcpy.DeleteField_management(buffer, id_field)
-        if id_field in [field.name for field in arcpy.ListFields(outFC)]:
-            arcpy.DeleteField_management(outFC, id_field)
-
-        # Add a new ID field
-        arcpy.AddField_management(buffer, id_field, "LONG")
-        arcpy.AddField_management(outFC, id_field, "LONG")
-
-        # The new Reach ID field is identical to ReachCode, but is now a LONG, and the first 6 digits are removed
-        arcpy.CalculateField_management(buffer, id_field, "int(!ReachCode![6:])", "PYTHON_9.3")
-        arcpy.CalculateField_management(outFC, id_field, "int(!ReachCode![6:])", "PYTHON_9.3")
-
-    else:
-        id_field = 'ReachID'
-
-    # Give a warning if the Reach ID field isn't actually distinguishing between reaches
-    reach_ids = [row[0] for row in arcpy.da.SearchCursor(buffer, id_field)]
-    if len(set(reach_ids)) < 5:
-        arcpy.AddWarning('Caution, the reach ID field ({}) has very few unique values'.format(id_field))
-
-
-    statTbl = arcpy.sa.ZonalStatisticsAsTable(buffer, id_field, ras, os.path.join(scratch, 'statTbl'), 'DATA', statType)
-    # get list of segment buffers where zonal stats tool produced output
-    haveStatList = [row[0] for row in arcpy.da.SearchCursor(statTbl, id_field)]
-    # create dictionary to hold all reach buffer min dem z values
-    statDict = {}
-    # add buffer raster stat values to dictionary
-    with arcpy.da.SearchCursor(statTbl, [id_field, statField]) as cursor:
-        for row in cursor:
-            statDict[row[0]] = row[1]
-    # create list of overlapping buffer reaches (i.e., where zonal stats tool did not produce output)
-    needStatList = []
-    with arcpy.da.SearchCursor(buffer, [id_field]) as cursor:
-        for row in cursor:
-            if row[0] not in haveStatList:
-                needStatList.append(row[0])
-    # run zonal stats until we have output for each overlapping buffer segment
-    stat = None
-    tmp_buff_lyr = None
-
-    # create tuple of segment ids where still need raster values
-    needStat = ()
-    for reach in needStatList:
-        if reach not in needStat:
-            needStat += (reach,)
-    # use the segment id tuple to create selection query and run zonal stats tool
-    if len(needStat) == 1:
-        quer = '"{}" = '.format(id_field) + str(needStat[0])
-    else:
-        quer = '"{}" IN '.format(id_field) + str(needStat)
-    tmp_buff_lyr = arcpy.MakeFeatureLayer_management(buffer, 'tmp_buff_lyr')
-    arcpy.SelectLayerByAttribute_management(tmp_buff_lyr, 'NEW_SELECTION', quer)
-    stat = arcpy.sa.ZonalStatisticsAsTable(tmp_buff_lyr, id_field, ras, os.path.join(scratch, 'stat'), 'DATA', statType)
-    # add segment stat values from zonal stats table to main dictionary
-    with arcpy.da.SearchCursor(stat, [id_field, statField]) as cursor:
-        for row in cursor:
-            statDict[row[0]] = row[1]
-    # create list of reaches that were run and remove from 'need to run' list
-    haveStatList2 = [row[0] for row in arcpy.da.SearchCursor(stat, id_field)]
-    for reach in haveStatList2:
-        needStatList.remove(reach)
-
-    # populate dictionary value to output field by ReachID
-    with arcpy.da.UpdateCursor(outFC, [id_field, outFCField]) as cursor:
-        for row in cursor:
-            try:
-                aKey = row[0]
-                row[1] = statDict[aKey]
-                cursor.updateRow(row)
-            except:
-                pass
-    statDict.clear()
-    # delete temp fcs, tbls, etc.
-    items = [statTbl, stat, tmp_buff_lyr]
-    for item in items:
-        if item is not None:
-            arcpy.Delete_management(item)
-
-
 def main(
     projName,
     hucID,
@@ -240,12 +133,6 @@ def main(
                 row[1] = row[0]
                 cursor.updateRow(row)
 
-    # --smooth input dem to remove any anomolies--
-    neighborhood = NbrRectangle(3, 3, "CELL")
-    smDEM_raw = FocalStatistics(DEM, neighborhood, 'MEAN')
-    smDEM = ExtractByMask(smDEM_raw, DEM)
-    arcpy.Delete_management(smDEM_raw)
-
     # --calculate drainage area values for each network segment--
 
     # calculate drainage area raster if not specified
@@ -256,7 +143,7 @@ def main(
         os.mkdir(flowDir)
     if FlowAcc is None:
         arcpy.AddMessage("Calculating drainage area...")
-        calc_drain_area(smDEM, flowDir)
+        calc_drain_area(DEM, flowDir)
         DrAr = os.path.join(flowDir, 'DrainArea_sqkm.tif')
         inFlow = Raster(DrAr)
     else:
@@ -286,14 +173,6 @@ def main(
 
     arcpy.AddMessage("Calculating stream network drainage area values...")
 
-    # create network segment midpoints
-    network_midpoints = os.path.join(tempDir, "network_midpoints.shp")
-    arcpy.FeatureVerticesToPoints_management(fcNetwork, network_midpoints, "MID")
-
-    # create midpoint 100 m buffer
-    midpoint_buffer = arcpy.Buffer_analysis(network_midpoints, os.path.join(tempDir, "midpoint_buffer.shp"), "100 Meters")
-    arcpy.Delete_management(network_midpoints)
-
     # check 'DA_sqkm' field exists in flowline network attribute table
     # if it does delete it
     lf = arcpy.ListFields(fcNetwork, "DA_sqkm")
@@ -303,9 +182,13 @@ def main(
         pass
     # add drainage area 'DA_sqkm' field to flowline network
     arcpy.AddField_management(fcNetwork, "DA_sqkm", "DOUBLE")
-    # get max drainage area within 100 m midpoint buffer
-    zonalStatsWithinBuffer(midpoint_buffer, inFlow, "MAXIMUM", 'MAX', fcNetwork, "DA_sqkm", tempDir)
-    arcpy.Delete_management(midpoint_buffer)
+    # get max drainage area within 100 m of each segment midpoint
+    drain_areas = midpoint_window_max(fcNetwork, DrAr, 100)
+    with arcpy.da.UpdateCursor(fcNetwork, ["FID", "DA_sqkm"]) as cursor:
+        for row in cursor:
+            if not np.isnan(drain_areas[row[0]]):
+                row[1] = drain_areas[row[0]].item()
+                cursor.updateRow(row)
 
 
     # replace '0' drainage area values with tiny value
@@ -352,26 +235,17 @@ def main(
     slopeDir = os.path.join(DEMDir, 'Slope')
     if not os.path.exists(slopeDir):
         os.mkdir(slopeDir)
-    # create slope raster and save to 'Slope' folder
-    slope_raster = Slope(smDEM, "DEGREE")
-    arcpy.CopyRaster_management(slope_raster, os.path.join(slopeDir, 'slope.tif'))
+    # smooth input dem to remove any anomolies and calculate slope in one pass over the dem, a tile of rows at a time,
+    # then save slope to 'Slope' folder
     # save slope path as separate object for xml purposes
     inSlope = os.path.join(slopeDir, 'slope.tif')
-    arcpy.Delete_management(slope_raster)
-    arcpy.Delete_management(smDEM)
-
-    # clip slope raster to each of the small, large, medium network segment buffers
-    lg_buf_slope = ExtractByMask(inSlope, lg_buffer)
-    med_buf_slope = ExtractByMask(inSlope, med_buffer)
-    sm_buf_slope = ExtractByMask(inSlope, sm_buffer)
-
-    # reclassify slope rasters for each of the buffers
-    lg_valley_raster = Con(lg_buf_slope <= float(lg_slope_thresh), 1)
-    lg_valley_raster.save(os.path.join(tempDir, "lg_valley_raster.tif"))
-    med_valley_raster = Con(med_buf_slope <= float(med_slope_thresh), 1)
-    med_valley_raster.save(os.path.join(tempDir, "med_valley_raster.tif"))
-    sm_valley_raster = Con(sm_buf_slope <= float(sm_slope_thresh), 1)
-    sm_valley_raster.save(os.path.join(tempDir, "sm_valley_raster.tif"))
+    dem_grid, slope = slope_raster(dem_path, inSlope, os.path.join(tempDir, 'slope.dat'))
+
+    # select low slope cells within each of the large, medium and small network segment buffers
+    lg_valley_raster = valley_raster(slope, lg_buffer, lg_slope_thresh, dem_grid, os.path.join(tempDir, "lg_valley_raster.tif"))
+    med_valley_raster = valley_raster(slope, med_buffer, med_slope_thresh, dem_grid, os.path.join(tempDir, "med_valley_raster.tif"))
+    sm_valley_raster = valley_raster(slope, sm_buffer, sm_slope_thresh, dem_grid, os.path.join(tempDir, "sm_valley_raster.tif"))
+    del slope
 
     # convert into polygons
     lg_polygon = os.path.join(tempDir, "lg_polygon.shp")
@@ -382,7 +256,7 @@ def main(
     arcpy.RasterToPolygon_conversion(sm_valley_raster, sm_polygon, "SIMPLIFY")
 
     # delete rasters that are no longer needed
-    items = [lg_buf_slope, med_buf_slope, sm_buf_slope, lg_valley_raster, med_valley_raster, sm_valley_raster]
+    items = [lg_valley_raster, med_valley_raster, sm_valley_raster]
     for item in items:
         try:
             arcpy.Delete_management(item)